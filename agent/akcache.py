@@ -0,0 +1,305 @@
+import os
+import re
+import json
+import time
+import pickle
+import sqlite3
+import hashlib
+import inspect
+import builtins
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+DEFAULT_AKSHARE_CACHE_DIR = ".akshare_cache"
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+DEFAULT_TTL = 3600
+
+# 按函数名匹配的TTL规则（秒），按顺序取第一个命中的规则
+TTL_RULES = [
+    (re.compile(r'spot|_min|tick|intraday|realtime|bid_ask|minute'), 30),
+    (re.compile(r'news|notice|telegraph|report_disclosure'), 300),
+    (re.compile(r'individual_info|profile|_info'), 86400),
+]
+# 历史行情接口：请求区间已经收盘时结果基本不会再变
+HISTORY_PATTERN = re.compile(r'_hist|_daily')
+CLOSED_HISTORY_TTL = 7 * 86400
+# 前复权价格会随新的除权除息整体变动，缓存时间缩短
+ADJUSTED_HISTORY_TTL = 86400
+OPEN_HISTORY_TTL = 600
+END_DATE_ARGS = ("end_date", "end", "end_day")
+DATE_PATTERN = re.compile(r'^(\d{4})-?(\d{2})-?(\d{2})$')
+
+
+def _normalize_value(value):
+    """规范化参数值，使 "2024-01-01" 与 "20240101" 得到相同的缓存键"""
+    if isinstance(value, str):
+        value = value.strip()
+        match = DATE_PATTERN.match(value)
+        if match:
+            return "".join(match.groups())
+    return value
+
+
+def _parse_date(value) -> Optional[datetime]:
+    match = DATE_PATTERN.match(str(value).strip())
+    if not match:
+        return None
+    try:
+        return datetime.strptime("".join(match.groups()), "%Y%m%d")
+    except ValueError:
+        return None
+
+
+def get_ttl(func_name: str, arguments: Dict[str, Any]) -> float:
+    """
+    根据函数名和参数确定缓存有效期
+
+    Args:
+        func_name: akshare函数名
+        arguments: 规范化后的调用参数
+
+    Returns:
+        float: 有效期（秒）
+    """
+    for pattern, ttl in TTL_RULES:
+        if pattern.search(func_name):
+            return ttl
+    if HISTORY_PATTERN.search(func_name):
+        for name in END_DATE_ARGS:
+            end_date = _parse_date(arguments.get(name, ""))
+            if end_date is not None:
+                if end_date.date() >= datetime.now().date():
+                    return OPEN_HISTORY_TTL
+                if arguments.get("adjust") == "qfq":
+                    return ADJUSTED_HISTORY_TTL
+                return CLOSED_HISTORY_TTL
+        return OPEN_HISTORY_TTL
+    return DEFAULT_TTL
+
+
+class AkshareCache:
+    def __init__(self, cache_dir: str = DEFAULT_AKSHARE_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        """
+        初始化akshare调用结果缓存
+        DataFrame以zstd压缩的Parquet保存，其他结果用pickle保存，
+        元数据（过期时间、大小、最近访问时间）存放在SQLite中，用于多进程共享和LRU淘汰。
+
+        Args:
+            cache_dir: 缓存目录
+            max_bytes: 缓存文件总大小上限（字节）
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(cache_dir, "meta.sqlite"), timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, func TEXT, path TEXT, size INTEGER, expire_at REAL, last_access REAL)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(func_name: str, arguments: Dict[str, Any]) -> str:
+        """根据函数名和规范化参数生成缓存键"""
+        payload = json.dumps([func_name, arguments], sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.md5(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str):
+        """
+        读取缓存
+
+        Returns:
+            tuple: (是否命中, 缓存值)
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT path, expire_at FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] < time.time():
+            self.misses += 1
+            return False, None
+        path = row[0]
+        try:
+            if path.endswith(".parquet"):
+                import pandas as pd
+                value = pd.read_parquet(path)
+            else:
+                with open(path, 'rb') as f:
+                    value = pickle.load(f)
+        except Exception:
+            # 文件被其他进程淘汰或损坏
+            self.misses += 1
+            return False, None
+        with self._lock:
+            self._conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        self.hits += 1
+        return True, value
+
+    def put(self, key: str, func_name: str, value: Any, ttl: float):
+        """写入缓存，写入后按LRU淘汰超出容量的条目"""
+        path = self._write_value(key, value)
+        if path is None:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                (key, func_name, path, os.path.getsize(path), now + ttl, now)
+            )
+            self._conn.commit()
+            self._evict()
+
+    def _write_value(self, key: str, value: Any) -> Optional[str]:
+        """保存结果文件，先写临时文件再替换，返回文件路径"""
+        base = os.path.join(self.cache_dir, key)
+        try:
+            import pandas as pd
+            if isinstance(value, pd.DataFrame) and all(isinstance(c, str) for c in value.columns):
+                try:
+                    value.to_parquet(base + ".parquet.tmp", compression="zstd")
+                    os.replace(base + ".parquet.tmp", base + ".parquet")
+                    return base + ".parquet"
+                except Exception:
+                    # 含混合类型列等无法写成Parquet的情况，退回pickle
+                    if os.path.exists(base + ".parquet.tmp"):
+                        os.remove(base + ".parquet.tmp")
+        except ImportError:
+            pass
+        try:
+            with open(base + ".pkl.tmp", 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(base + ".pkl.tmp", base + ".pkl")
+            return base + ".pkl"
+        except Exception as e:
+            print(f"akshare结果无法缓存: {e}")
+            return None
+
+    def _evict(self):
+        """删除过期条目，并在总大小超限时按最近访问时间淘汰"""
+        now = time.time()
+        expired = self._conn.execute("SELECT key, path FROM entries WHERE expire_at < ?", (now,)).fetchall()
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries WHERE expire_at >= ?", (now,)).fetchone()[0]
+        victims = list(expired)
+        if total > self.max_bytes:
+            for key, path, size in self._conn.execute(
+                    "SELECT key, path, size FROM entries WHERE expire_at >= ? ORDER BY last_access", (now,)):
+                if total <= self.max_bytes:
+                    break
+                victims.append((key, path))
+                total -= size
+        for key, path in victims:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+        if victims:
+            self._conn.commit()
+
+    def wrap(self, func: Callable, func_name: str) -> Callable:
+        """包装akshare函数，相同参数的调用在有效期内直接返回缓存结果"""
+        try:
+            signature = inspect.signature(func)
+        except (TypeError, ValueError):
+            signature = None
+
+        def cached(*args, **kwargs):
+            if signature is not None:
+                try:
+                    bound = signature.bind(*args, **kwargs)
+                    bound.apply_defaults()
+                    arguments = dict(bound.arguments)
+                except TypeError:
+                    # 参数不匹配时交给原函数报错
+                    return func(*args, **kwargs)
+            else:
+                arguments = {"args": list(args), **kwargs}
+            arguments = {name: _normalize_value(value) for name, value in arguments.items()}
+            key = self.make_key(func_name, arguments)
+            hit, value = self.get(key)
+            if hit:
+                return value
+            value = func(*args, **kwargs)
+            if value is not None and not getattr(value, "empty", False):
+                self.put(key, func_name, value, get_ttl(func_name, arguments))
+            return value
+
+        cached.__name__ = func_name
+        cached.__doc__ = func.__doc__
+        cached.__wrapped__ = func
+        return cached
+
+    def stats(self) -> dict:
+        """获取缓存统计信息"""
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        total = self.hits + self.misses
+        return {
+            "entries": entries,
+            "bytes": size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class CachedAkshare:
+    def __init__(self, module, cache: AkshareCache):
+        """akshare模块的缓存代理，公开函数经过缓存，其他属性原样返回"""
+        self._module = module
+        self._cache = cache
+        self._wrapped = {}
+
+    def __getattr__(self, name):
+        attr = getattr(self._module, name)
+        if name.startswith('_') or not inspect.isfunction(attr):
+            return attr
+        if name not in self._wrapped:
+            self._wrapped[name] = self._cache.wrap(attr, name)
+        return self._wrapped[name]
+
+    def __dir__(self):
+        return dir(self._module)
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache() -> AkshareCache:
+    """获取进程内共享的akshare缓存，缓存目录可通过环境变量 AKSHARE_CACHE_DIR 指定"""
+    global _default_cache
+    if _default_cache is None:
+        with _default_cache_lock:
+            if _default_cache is None:
+                _default_cache = AkshareCache(os.getenv("AKSHARE_CACHE_DIR", DEFAULT_AKSHARE_CACHE_DIR))
+    return _default_cache
+
+
+def make_caching_import(cache: AkshareCache = None) -> Callable:
+    """
+    生成替换 __import__ 的函数，使生成代码中的 import akshare 得到缓存代理
+
+    Args:
+        cache: akshare缓存，为None时使用进程内共享的缓存
+
+    Returns:
+        Callable: 可放入执行上下文 __builtins__ 的 __import__
+    """
+    original_import = builtins.__import__
+    proxy = None
+
+    def caching_import(name, globals=None, locals=None, fromlist=(), level=0):
+        nonlocal proxy
+        module = original_import(name, globals, locals, fromlist, level)
+        if name != "akshare" or level != 0:
+            return module
+        if proxy is None:
+            proxy = CachedAkshare(module, cache or get_default_cache())
+        return proxy
+
+    return caching_import
@@ -0,0 +1,255 @@
+import os
+import re
+import json
+import time
+import tempfile
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from typing import Callable, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_BAR_STORE_DIR = ".bar_store"
+DATE_COLUMN = "日期"
+# 已覆盖日期区间保存在Parquet文件的schema元数据中，与数据一起原子替换
+COVERAGE_META_KEY = b"finchat_coverage"
+# 前复权价格会随新的除权除息整体变动，超过该时间的前复权数据整体重新获取
+ADJUSTED_MAX_AGE = 86400
+
+
+def _to_date(value) -> date:
+    """把 20240101 / 2024-01-01 / date / datetime 转为 date"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(re.sub(r'[^0-9]', '', str(value)), "%Y%m%d").date()
+
+
+def _normalize_symbol(symbol: str) -> str:
+    """去掉 sh/sz/bj 市场前缀，只保留股票代码"""
+    return re.sub(r'^(sh|sz|bj)\.?', '', str(symbol).strip().lower())
+
+
+def merge_ranges(ranges: List[Tuple[date, date]]) -> List[Tuple[date, date]]:
+    """合并重叠或相邻的日期区间"""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + timedelta(days=1):
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def missing_ranges(coverage: List[Tuple[date, date]], start: date, end: date) -> List[Tuple[date, date]]:
+    """
+    计算请求区间中尚未覆盖的部分
+
+    Args:
+        coverage: 已覆盖的日期区间（已合并）
+        start: 请求开始日期
+        end: 请求结束日期
+
+    Returns:
+        list: 缺失的日期区间
+    """
+    gaps = []
+    cursor = start
+    for covered_start, covered_end in coverage:
+        if covered_end < cursor:
+            continue
+        if covered_start > end:
+            break
+        if covered_start > cursor:
+            gaps.append((cursor, covered_start - timedelta(days=1)))
+        cursor = max(cursor, covered_end + timedelta(days=1))
+        if cursor > end:
+            break
+    if cursor <= end:
+        gaps.append((cursor, end))
+    return gaps
+
+
+class BarStore:
+    def __init__(self, store_dir: str = DEFAULT_BAR_STORE_DIR, fetcher: Callable = None,
+                 max_cached_symbols: int = 64):
+        """
+        初始化本地日线行情存储
+        每个股票代码和复权方式对应一个Parquet文件，文件中记录已经覆盖的日期区间，
+        请求时只向上游获取缺失的区间。
+
+        Args:
+            store_dir: 存储目录
+            fetcher: 获取日线数据的函数 fetcher(symbol, start_date, end_date, adjust)，
+                     为None时使用 akshare.stock_zh_a_hist
+            max_cached_symbols: 进程内保留在内存中的股票数量
+        """
+        self.store_dir = store_dir
+        self.fetcher = fetcher
+        self.max_cached_symbols = max_cached_symbols
+        os.makedirs(store_dir, exist_ok=True)
+        # (symbol, adjust) -> (文件修改时间, 数据, 日期数组, 覆盖区间)
+        self._frames = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def _path(self, symbol: str, adjust: str) -> str:
+        return os.path.join(self.store_dir, f"{symbol}_{adjust or 'none'}.parquet")
+
+    def _key_lock(self, key) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _fetch(self, symbol: str, start: date, end: date, adjust: str) -> pd.DataFrame:
+        start_date, end_date = start.strftime("%Y%m%d"), end.strftime("%Y%m%d")
+        if self.fetcher is not None:
+            return self.fetcher(symbol, start_date, end_date, adjust)
+        import akshare as ak
+        return ak.stock_zh_a_hist(symbol=symbol, period="daily", start_date=start_date,
+                                  end_date=end_date, adjust=adjust)
+
+    def _read(self, key):
+        """读取磁盘上的数据，返回 (修改时间, 数据, 覆盖区间, 更新时间)"""
+        path = self._path(*key)
+        if not os.path.exists(path):
+            return None, None, [], 0.0
+        import pyarrow.parquet as pq
+        mtime = os.path.getmtime(path)
+        try:
+            table = pq.read_table(path)
+            meta = json.loads((table.schema.metadata or {}).get(COVERAGE_META_KEY, b'{}'))
+            coverage = [(_to_date(start), _to_date(end)) for start, end in meta.get("ranges", [])]
+        except Exception as e:
+            # 文件损坏时按没有数据处理，重新获取后会覆盖该文件
+            print(f"行情文件 {path} 读取失败，将重新获取: {str(e)}")
+            return mtime, None, [], 0.0
+        return mtime, table.to_pandas(), coverage, meta.get("updated_at", 0.0)
+
+    def _write(self, key, frame: pd.DataFrame, coverage: List[Tuple[date, date]]):
+        """把数据和覆盖区间写入同一个文件，先写临时文件再替换
+        临时文件名唯一，多个进程同时写同一股票时不会写入同一个临时文件
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        path = self._path(*key)
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        meta = {
+            "ranges": [[start.strftime("%Y%m%d"), end.strftime("%Y%m%d")] for start, end in coverage],
+            "updated_at": time.time(),
+        }
+        metadata = dict(table.schema.metadata or {})
+        metadata[COVERAGE_META_KEY] = json.dumps(meta).encode('utf-8')
+        fd, tmp_path = tempfile.mkstemp(dir=self.store_dir, suffix=".tmp")
+        os.close(fd)
+        try:
+            pq.write_table(table.replace_schema_metadata(metadata), tmp_path, compression="zstd")
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @staticmethod
+    def _index_dates(frame: pd.DataFrame) -> np.ndarray:
+        return pd.to_datetime(frame[DATE_COLUMN]).values.astype("datetime64[D]")
+
+    def _cache(self, key, mtime, frame, coverage):
+        entry = (mtime, frame, self._index_dates(frame) if frame is not None and len(frame) else None, coverage)
+        with self._lock:
+            self._frames[key] = entry
+            self._frames.move_to_end(key)
+            while len(self._frames) > self.max_cached_symbols:
+                self._frames.popitem(last=False)
+        return entry
+
+    def _get_entry(self, key):
+        """获取内存中的数据，磁盘文件被其他进程更新时重新读取"""
+        path = self._path(*key)
+        mtime = os.path.getmtime(path) if os.path.exists(path) else None
+        with self._lock:
+            entry = self._frames.get(key)
+            if entry is not None and entry[0] == mtime:
+                self._frames.move_to_end(key)
+                return entry
+        mtime, frame, coverage, updated_at = self._read(key)
+        if key[1] == "qfq" and time.time() - updated_at > ADJUSTED_MAX_AGE:
+            frame, coverage = None, []
+        return self._cache(key, mtime, frame, coverage)
+
+    def _fill(self, key, gaps: List[Tuple[date, date]], end_limit: date):
+        """获取缺失区间并合并写回磁盘"""
+        symbol, adjust = key
+        fetched = [self._fetch(symbol, start, end, adjust) for start, end in gaps]
+        # 写入前重新读取，合并其他进程在此期间写入的数据
+        _, frame, coverage, updated_at = self._read(key)
+        if adjust == "qfq" and time.time() - updated_at > ADJUSTED_MAX_AGE:
+            frame, coverage = None, []
+        frames = [f for f in [frame] + fetched if f is not None and len(f)]
+        if frames:
+            frame = pd.concat(frames, ignore_index=True)
+            frame[DATE_COLUMN] = pd.to_datetime(frame[DATE_COLUMN]).dt.date
+            frame = frame.drop_duplicates(subset=[DATE_COLUMN], keep="last")
+            frame = frame.sort_values(DATE_COLUMN).reset_index(drop=True)
+        else:
+            frame = pd.DataFrame(columns=[DATE_COLUMN])
+        # 当天的行情在收盘前会变化，只把昨天及以前的区间记为已覆盖
+        covered = [(start, min(end, end_limit)) for start, end in gaps if start <= end_limit]
+        coverage = merge_ranges(coverage + covered)
+        self._write(key, frame, coverage)
+        return self._cache(key, os.path.getmtime(self._path(*key)), frame, coverage)
+
+    def get_daily_bars(self, symbol: str, start_date, end_date=None, adjust: str = "") -> pd.DataFrame:
+        """
+        获取日线行情，只向上游请求本地缺失的日期区间
+
+        Args:
+            symbol: 股票代码，如 "000001"
+            start_date: 开始日期，如 "20240101"
+            end_date: 结束日期，默认到今天
+            adjust: 复权方式，""不复权，"qfq"前复权，"hfq"后复权
+
+        Returns:
+            DataFrame: 列与 stock_zh_a_hist 相同的日线数据，
+                       是存储数据的切片（不复制），请勿原地修改
+        """
+        key = (_normalize_symbol(symbol), adjust or "")
+        today = date.today()
+        start = _to_date(start_date)
+        end = min(_to_date(end_date), today) if end_date else today
+        if start > end:
+            return pd.DataFrame(columns=[DATE_COLUMN])
+
+        with self._key_lock(key):
+            entry = self._get_entry(key)
+            gaps = missing_ranges(entry[3], start, end)
+            if gaps:
+                entry = self._fill(key, gaps, today - timedelta(days=1))
+
+        _, frame, dates, _ = entry
+        if frame is None or dates is None:
+            return pd.DataFrame(columns=[DATE_COLUMN])
+        lo = np.searchsorted(dates, np.datetime64(start, "D"), side="left")
+        hi = np.searchsorted(dates, np.datetime64(end, "D"), side="right")
+        return frame.iloc[lo:hi]
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_default_bar_store() -> BarStore:
+    """获取进程内共享的行情存储，存储目录可通过环境变量 BAR_STORE_DIR 指定"""
+    global _default_store
+    if _default_store is None:
+        with _default_store_lock:
+            if _default_store is None:
+                _default_store = BarStore(os.getenv("BAR_STORE_DIR", DEFAULT_BAR_STORE_DIR))
+    return _default_store
+
+
+def get_daily_bars(symbol: str, start_date, end_date=None, adjust: str = "") -> pd.DataFrame:
+    """使用共享行情存储获取日线行情，参数见 BarStore.get_daily_bars"""
+    return get_default_bar_store().get_daily_bars(symbol, start_date, end_date, adjust)
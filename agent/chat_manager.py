@@ -1,27 +1,239 @@
+import re
+import asyncio
+from collections import deque, OrderedDict
 from typing import List, Dict, Generator, Union, AsyncGenerator
+from promptstore.prompt import chat_history_summary_prompt
 from .query import QueryAgent
+from .summarize import summarize_result, estimate_tokens, truncate_text
+
+# 查询结果写入对话上下文的总token预算，多个子查询平分
+DEFAULT_CONTEXT_TOKENS = 3000
+# 每个子查询结果至少分到的token数，预算不够分时只执行前面的子查询
+MIN_QUERY_TOKENS = 100
+# 聊天历史的token预算，超出的早期消息合并到运行摘要中
+DEFAULT_HISTORY_TOKENS = 4000
+# 单条消息写入历史时的token上限
+MAX_MESSAGE_TOKENS = 1500
+# 运行摘要的token上限
+SUMMARY_TOKENS = 600
+# 每个会话保留的数据附件数，以及每轮最多重新插入的历史附件数
+MAX_ATTACHMENTS = 8
+MAX_RELEVANT_ATTACHMENTS = 2
+# 附件与问题的相关度阈值（问题和查询语句中重合的二元组占比）
+ATTACHMENT_RELEVANCE = 0.3
+NON_WORD_PATTERN = re.compile(r'[^\w]+')
+# 所有问题和查询中都会出现的套话，不参与相关度计算
+GENERIC_BIGRAMS = {"关于", "于股", "股票", "票的", "的问", "问题", "的查", "查询"}
 
 class ChatManager:
-    def __init__(self, query_processor: QueryAgent):
+    def __init__(self, query_processor: QueryAgent, max_concurrent_queries: int = 3,
+                 context_tokens: int = DEFAULT_CONTEXT_TOKENS, history_tokens: int = DEFAULT_HISTORY_TOKENS):
+        """
+        初始化聊天管理器
+
+        Args:
+            query_processor: QueryAgent实例
+            max_concurrent_queries: 同一个聊天中同时执行的子查询数上限
+            context_tokens: 查询结果写入对话上下文的总token预算
+            history_tokens: 聊天历史的token预算，超出的早期消息在后台合并到运行摘要中
+        """
         self.query_processor = query_processor
-        self.history: List[Dict[str, str]] = []
-        self.max_history = 10  # 最大历史记录数
+        self.history = deque()
+        self.max_history = 40  # 最大历史记录数
+        self.max_concurrent_queries = max(1, max_concurrent_queries)
+        self.context_tokens = context_tokens
+        self.history_tokens = history_tokens
+        self._message_tokens = deque()
+        self._total_tokens = 0
+        # 运行摘要，以及移出历史、还没合并到摘要中的消息
+        self.summary = ""
+        self._pending_summary: List[Dict[str, str]] = []
+        self._summary_task = None
+        # 数据附件：编号 -> {"queries": 子查询列表, "content": 查询结果上下文}
+        self.attachments = OrderedDict()
+        self._next_attachment_id = 1
             
     def add_message(self, role: str, content: str):
-        """添加消息到历史记录"""
+        """添加消息到历史记录，超出token预算或条数上限时把最早的消息移到待摘要列表"""
+        content = truncate_text(content, MAX_MESSAGE_TOKENS)
+        tokens = estimate_tokens(content)
         self.history.append({"role": role, "content": content})
+        self._message_tokens.append(tokens)
+        self._total_tokens += tokens
         
-        # 保持历史记录在最大限制内
-        if len(self.history) > self.max_history:
-            self.history.pop(0)  # 移除最早的消息
+        # 保持历史记录在最大限制内，至少保留最新一条
+        while len(self.history) > 1 and (
+                self._total_tokens > self.history_tokens or len(self.history) > self.max_history):
+            self._pending_summary.append(self.history.popleft())  # 移除最早的消息
+            self._total_tokens -= self._message_tokens.popleft()
             
     def get_messages(self) -> List[Dict[str, str]]:
         """获取当前的消息历史"""
-        return self.history.copy()
+        return list(self.history)
     
     def clear_history(self):
         """清空历史记录"""
-        self.history = []
+        if self._summary_task is not None:
+            self._summary_task.cancel()
+            self._summary_task = None
+        self.history.clear()
+        self._message_tokens.clear()
+        self._total_tokens = 0
+        self.summary = ""
+        self._pending_summary = []
+        self.attachments.clear()
+
+    def export_state(self) -> dict:
+        """导出会话状态，用于会话存储换出到磁盘"""
+        return {
+            "history": self.get_messages(),
+            "summary": self.summary,
+            "pending_summary": list(self._pending_summary),
+            "attachments": [[key, value] for key, value in self.attachments.items()],
+            "next_attachment_id": self._next_attachment_id,
+        }
+
+    def import_state(self, state: dict):
+        """从 export_state 导出的状态恢复会话"""
+        self.clear_history()
+        self.summary = state.get("summary", "")
+        self._pending_summary = list(state.get("pending_summary", []))
+        self.attachments = OrderedDict((int(key), value) for key, value in state.get("attachments", []))
+        self._next_attachment_id = state.get("next_attachment_id", len(self.attachments) + 1)
+        for message in state.get("history", []):
+            self.add_message(message["role"], message["content"])
+
+    def memory_size(self) -> int:
+        """估计会话占用的内存字节数"""
+        texts = [message["content"] for message in list(self.history) + self._pending_summary]
+        texts.append(self.summary)
+        texts.extend(attachment["content"] for attachment in self.attachments.values())
+        return sum(len(text.encode("utf-8")) + 64 for text in texts)
+
+    def _schedule_summary(self):
+        """在后台把待摘要的消息合并到运行摘要中，不阻塞当前对话"""
+        if not self._pending_summary or (self._summary_task is not None and not self._summary_task.done()):
+            return
+        try:
+            self._summary_task = asyncio.get_running_loop().create_task(self._update_summary())
+        except RuntimeError:
+            # 没有运行中的事件循环时留到下一次异步对话再摘要
+            self._summary_task = None
+
+    async def _update_summary(self):
+        """
+        增量更新运行摘要，每次只处理新移出历史的消息
+        摘要完成前消息一直留在 _pending_summary 中，期间换出会话或构建上下文时不会丢失这些消息
+        """
+        while self._pending_summary:
+            batch = list(self._pending_summary)
+            conversation = "\n".join(f"{message['role']}: {message['content']}" for message in batch)
+            prompt = chat_history_summary_prompt.format(
+                max_chars=SUMMARY_TOKENS,
+                summary=self.summary or "无",
+                conversation=conversation
+            )
+            try:
+                summary = await self.query_processor.achat_llm([{"role": "user", "content": prompt}])
+            except Exception as e:
+                print(f"更新对话摘要失败: {str(e)}")
+                return
+            self.summary = truncate_text(summary.strip(), SUMMARY_TOKENS)
+            # 摘要期间新移出的消息追加在后面，只删除已合并进摘要的部分
+            del self._pending_summary[:len(batch)]
+
+    def _build_summary_message(self) -> List[Dict[str, str]]:
+        """运行摘要和尚未完成摘要的早期消息，作为系统消息放在历史之前"""
+        parts = []
+        if self.summary:
+            parts.append(f"以下是之前对话的摘要：\n{self.summary}")
+        if self._pending_summary:
+            earlier = "\n".join(f"{message['role']}: {message['content']}" for message in self._pending_summary)
+            parts.append(f"以下是更早的对话内容：\n{truncate_text(earlier, SUMMARY_TOKENS)}")
+        return [{"role": "system", "content": "\n\n".join(parts)}] if parts else []
+
+    @staticmethod
+    def _bigrams(text: str, stock_name: str = None) -> set:
+        if stock_name:
+            text = text.replace(stock_name, " ")
+        words = NON_WORD_PATTERN.split(text.lower())
+        return {word[i:i + 2] for word in words for i in range(len(word) - 1)} - GENERIC_BIGRAMS
+
+    def _add_attachment(self, queries: List[str], content: str) -> int:
+        """保存本轮查询到的数据，后续问题相关时重新插入对话"""
+        attachment_id = self._next_attachment_id
+        self._next_attachment_id += 1
+        self.attachments[attachment_id] = {"queries": queries, "content": content}
+        while len(self.attachments) > MAX_ATTACHMENTS:
+            self.attachments.popitem(last=False)
+        return attachment_id
+
+    def _relevant_attachments(self, user_message: str, stock_name: str = None, exclude: int = None) -> List[int]:
+        """按问题与附件查询语句的重合程度挑选相关的历史附件，总长度不超过 context_tokens"""
+        message_bigrams = self._bigrams(user_message, stock_name)
+        scored = []
+        for attachment_id, attachment in self.attachments.items():
+            if attachment_id == exclude:
+                continue
+            query_bigrams = self._bigrams(" ".join(attachment["queries"]), stock_name)
+            if not query_bigrams or not message_bigrams:
+                continue
+            # 问题通常比查询语句短，按较短一方的二元组数计算重合比例
+            score = len(query_bigrams & message_bigrams) / min(len(query_bigrams), len(message_bigrams))
+            if score >= ATTACHMENT_RELEVANCE:
+                scored.append((score, attachment_id))
+        selected = []
+        budget = self.context_tokens
+        for _, attachment_id in sorted(scored, reverse=True)[:MAX_RELEVANT_ATTACHMENTS]:
+            tokens = estimate_tokens(self.attachments[attachment_id]["content"])
+            if tokens <= budget:
+                selected.append(attachment_id)
+                budget -= tokens
+        return selected
+
+    @staticmethod
+    def _dedupe_queries(query_list) -> List[str]:
+        """去掉空白和重复的子查询，保持原有顺序"""
+        if isinstance(query_list, str):
+            query_list = [query_list]
+        queries = []
+        seen = set()
+        for query in query_list or []:
+            query = " ".join(str(query).split())
+            if query and query not in seen:
+                seen.add(query)
+                queries.append(query)
+        return queries
+
+    async def _arun_queries(self, queries: List[str], stock_name: str = None) -> list:
+        """
+        并发执行子查询，单个子查询出错不影响其他子查询
+
+        Returns:
+            list: 与queries顺序对应的查询结果，出错的子查询为异常对象
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrent_queries)
+
+        async def _run(query):
+            # 如果提供了股票名称，将其添加到查询中
+            query_message = f"关于股票【{stock_name}】的查询：{query}" if stock_name else query
+            async with semaphore:
+                return await self.query_processor.aquery(query_message)
+
+        return await asyncio.gather(*[_run(query) for query in queries], return_exceptions=True)
+
+    def _build_query_context(self, queries: List[str], results: list) -> str:
+        """把各子查询的结果压缩后合并为一段上下文，总长度不超过 context_tokens"""
+        share = max(self.context_tokens // len(queries), MIN_QUERY_TOKENS)
+        parts = []
+        for i, (query, result) in enumerate(zip(queries, results)):
+            if isinstance(result, Exception):
+                data = f"在查询数据时遇到了问题：{str(result)}"
+            else:
+                data = summarize_result(result, share)
+            parts.append(f"【子查询{i + 1}】{query}:\n[相关数据]\n{data}")
+        # 各部分的标题不计入share，合并后再截断一次保证不超出预算
+        return truncate_text("\n\n".join(parts), self.context_tokens)
 
     async def process_message_async(self, user_message: str, stock_name: str = None) -> AsyncGenerator[str, None]:
         """异步处理用户消息并返回流式响应"""
@@ -29,42 +241,36 @@ class ChatManager:
         self.add_message("user", user_message)
         
         # 检查是否需要使用query
-        is_need_data, query_list = self.query_processor.check_need_query(user_message)
+        is_need_data, query_list = await self.query_processor.acheck_need_query(user_message)
         
-        if is_need_data:
-            # 如果需要查询数据，使用process_query处理
-            try:
-                query_results = []
-                for query in query_list:
-                    # 如果提供了股票名称，将其添加到查询中
-                    if stock_name:
-                        query_message = f"关于股票【{stock_name}】的查询：{query}"
-                    else:
-                        query_message = query
-                    query_result = self.query_processor.query(query_message)
-                    query_results.append(query+":\n[相关数据]\n"+str(query_result)  )
-                # 将查询结果添加到消息中
-                messages = self.get_messages()
-                messages.append({
-                    "role": "assistant",
-                    "content": f"我已经查询到相关数据，让我为您分析：\n{str(query_result)}"
-                })
-            except Exception as e:
-                messages = self.get_messages()
-                messages.append({
-                    "role": "assistant",
-                    "content": f"在查询数据时遇到了问题：{str(e)}"
-                })
-        else:
-            messages = self.get_messages()
+        messages = self._build_summary_message() + self.get_messages()
+        queries = self._dedupe_queries(query_list) if is_need_data else []
+        # 子查询过多时每个结果分到的预算太少，只执行预算够分的前几个
+        queries = queries[:max(1, self.context_tokens // MIN_QUERY_TOKENS)]
+        new_attachment = None
+        if queries:
+            # 各子查询并发执行，结果合并后一起提供给LLM
+            results = await self._arun_queries(queries, stock_name)
+            context = self._build_query_context(queries, results)
+            new_attachment = self._add_attachment(queries, context)
+            messages.append({
+                "role": "assistant",
+                "content": f"我已经查询到相关数据，让我为您分析：\n{context}"
+            })
+        # 之前查询过的相关数据按引用重新插入，不常驻在历史中
+        for attachment_id in self._relevant_attachments(user_message, stock_name, exclude=new_attachment):
+            messages.append({
+                "role": "assistant",
+                "content": f"之前查询到的相关数据：\n{self.attachments[attachment_id]['content']}"
+            })
             
         # 使用流式输出生成最终响应
-        response_stream = self.query_processor.stream_chat_llm(messages)
+        response_stream = await self.query_processor.astream_chat_llm(messages)
         
         # 收集完整响应用于保存到历史记录
         full_response = ""
         
-        for chunk in response_stream:
+        async for chunk in response_stream:
             if hasattr(chunk.choices[0].delta, 'content'):
                 content = chunk.choices[0].delta.content
                 if content:
@@ -72,4 +278,5 @@ class ChatManager:
                     yield content
                     
         # 将助手的完整响应添加到历史记录
-        self.add_message("assistant", full_response) 
\ No newline at end of file
+        self.add_message("assistant", full_response)
+        self._schedule_summary()
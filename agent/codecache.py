@@ -0,0 +1,154 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, Optional, Tuple
+
+DEFAULT_CODE_CACHE_PATH = os.path.join(".code_cache", "code.sqlite")
+# 参数在缓存代码中的占位符，如 __TPL_stock_1__ 表示参数 stock 的第2种写法
+PLACEHOLDER_PATTERN = re.compile(r'__TPL_([A-Za-z0-9_]+?)_(\d+)__')
+
+
+def normalize_params(template_params: Dict) -> Dict[str, Tuple[str, ...]]:
+    """
+    规范化模板参数，每个参数可以有多种等价写法，如股票名称和股票代码
+
+    Args:
+        template_params: 参数名 -> 取值或等价取值的元组，第一种写法是查询语句中出现的写法
+
+    Returns:
+        dict: 参数名 -> 取值元组（缺失的写法为空字符串）
+    """
+    params = {}
+    for name, value in template_params.items():
+        values = value if isinstance(value, (tuple, list)) else (value,)
+        seen = set()
+        normalized = []
+        for v in values:
+            v = "" if v is None else str(v).strip()
+            # 同一参数的重复写法只保留第一个
+            normalized.append("" if v in seen else v)
+            seen.add(v)
+        params[name] = tuple(normalized)
+    return params
+
+
+def make_template(user_query: str, params: Dict[str, Tuple[str, ...]]) -> str:
+    """把查询语句中的参数值替换为参数名，得到查询模板"""
+    template = user_query
+    for name, values in sorted(params.items(), key=lambda item: -len(item[1][0])):
+        if values[0]:
+            template = template.replace(values[0], "{" + name + "}")
+    return template
+
+
+def parameterize_code(code: str, params: Dict[str, Tuple[str, ...]]) -> Optional[str]:
+    """
+    把代码中出现的参数值替换为占位符
+
+    Returns:
+        str: 代码模板；有参数的所有写法都没出现在代码中，或不同参数取值相同时返回None
+    """
+    spellings = [(value, name, i) for name, values in params.items() for i, value in enumerate(values) if value]
+    if len({value for value, _, _ in spellings}) != len(spellings):
+        return None
+    template = code
+    found = set()
+    for value, name, i in sorted(spellings, key=lambda item: -len(item[0])):
+        if value in template:
+            template = template.replace(value, f"__TPL_{name}_{i}__")
+            found.add(name)
+    if found != {name for name, values in params.items() if any(values)}:
+        return None
+    return template
+
+
+def render_code(template: str, params: Dict[str, Tuple[str, ...]]) -> Optional[str]:
+    """用本次请求的参数值填充代码模板，缺少需要的写法时返回None"""
+    missing = False
+
+    def _replace(match):
+        nonlocal missing
+        values = params.get(match.group(1), ())
+        index = int(match.group(2))
+        if index >= len(values) or not values[index]:
+            missing = True
+            return match.group(0)
+        return values[index]
+
+    code = PLACEHOLDER_PATTERN.sub(_replace, template)
+    return None if missing else code
+
+
+class CodeCache:
+    def __init__(self, cache_path: str = DEFAULT_CODE_CACHE_PATH):
+        """
+        初始化已通过代码的缓存
+        以查询模板和API文档的哈希为键，保存参数化后的代码模板
+
+        Args:
+            cache_path: SQLite缓存文件路径
+        """
+        cache_dir = os.path.dirname(cache_path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(cache_path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS code_templates ("
+            "key TEXT PRIMARY KEY, query_template TEXT, code TEXT, hits INTEGER DEFAULT 0, updated_at REAL)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(user_query: str, doc_api: str, params: Dict[str, Tuple[str, ...]]) -> Tuple[str, str]:
+        """
+        生成缓存键
+
+        Returns:
+            tuple: (缓存键, 查询模板)
+        """
+        template = " ".join(make_template(user_query, params).split())
+        doc_hash = hashlib.md5(doc_api.encode('utf-8')).hexdigest()
+        return hashlib.md5(f"{template}\n{doc_hash}".encode('utf-8')).hexdigest(), template
+
+    def get(self, key: str) -> Optional[str]:
+        """读取代码模板"""
+        with self._lock:
+            row = self._conn.execute("SELECT code FROM code_templates WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self._conn.execute("UPDATE code_templates SET hits = hits + 1 WHERE key = ?", (key,))
+                self._conn.commit()
+        return row[0] if row else None
+
+    def put(self, key: str, query_template: str, code_template: str):
+        """保存代码模板"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO code_templates (key, query_template, code, hits, updated_at) VALUES (?, ?, ?, 0, ?)",
+                (key, query_template, code_template, time.time())
+            )
+            self._conn.commit()
+
+    def delete(self, key: str):
+        """删除失效的代码模板"""
+        with self._lock:
+            self._conn.execute("DELETE FROM code_templates WHERE key = ?", (key,))
+            self._conn.commit()
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_code_cache() -> CodeCache:
+    """获取进程内共享的代码缓存"""
+    global _default_cache
+    if _default_cache is None:
+        with _default_cache_lock:
+            if _default_cache is None:
+                _default_cache = CodeCache(os.getenv("CODE_CACHE_PATH", DEFAULT_CODE_CACHE_PATH))
+    return _default_cache
@@ -0,0 +1,212 @@
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+# 日线数据中各字段可能的列名（东财中文列名 / 新浪英文列名）
+COLUMN_ALIASES = {
+    "date": ("日期", "date", "trade_date"),
+    "open": ("开盘", "open"),
+    "high": ("最高", "high"),
+    "low": ("最低", "low"),
+    "close": ("收盘", "close"),
+    "volume": ("成交量", "volume"),
+}
+TRADING_DAYS_PER_YEAR = 252
+
+
+def find_bar_columns(df: pd.DataFrame) -> Dict[str, str]:
+    """
+    识别日线数据中的字段列名
+
+    Args:
+        df: 日线数据
+
+    Returns:
+        dict: 字段 -> 实际列名，只包含找到的字段
+    """
+    columns = {}
+    for field, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias in df.columns:
+                columns[field] = alias
+                break
+    return columns
+
+
+def sma(close: pd.Series, window: int) -> pd.Series:
+    """简单移动平均"""
+    return close.rolling(window, min_periods=window).mean()
+
+
+def ema(close: pd.Series, span: int) -> pd.Series:
+    """指数移动平均"""
+    return close.ewm(span=span, adjust=False).mean()
+
+
+def rsi(close: pd.Series, period: int = 14) -> pd.Series:
+    """相对强弱指标（Wilder平滑）"""
+    delta = close.diff()
+    gain = delta.clip(lower=0).ewm(alpha=1 / period, adjust=False, min_periods=period).mean()
+    loss = (-delta.clip(upper=0)).ewm(alpha=1 / period, adjust=False, min_periods=period).mean()
+    rs = gain / loss.replace(0, np.nan)
+    return (100 - 100 / (1 + rs)).where(loss != 0, 100.0)
+
+
+def macd(close: pd.Series, fast: int = 12, slow: int = 26, signal: int = 9) -> pd.DataFrame:
+    """MACD指标，返回 dif、dea 和柱状值 hist（按国内习惯为 2*(dif-dea)）"""
+    dif = ema(close, fast) - ema(close, slow)
+    dea = dif.ewm(span=signal, adjust=False).mean()
+    return pd.DataFrame({"dif": dif, "dea": dea, "hist": 2 * (dif - dea)})
+
+
+def bollinger(close: pd.Series, window: int = 20, num_std: float = 2.0) -> pd.DataFrame:
+    """布林带，返回中轨 mid、上轨 upper、下轨 lower"""
+    mid = sma(close, window)
+    std = close.rolling(window, min_periods=window).std(ddof=0)
+    return pd.DataFrame({"mid": mid, "upper": mid + num_std * std, "lower": mid - num_std * std})
+
+
+def atr(high: pd.Series, low: pd.Series, close: pd.Series, period: int = 14) -> pd.Series:
+    """平均真实波幅（Wilder平滑）"""
+    prev_close = close.shift(1)
+    true_range = pd.concat([high - low, (high - prev_close).abs(), (low - prev_close).abs()], axis=1).max(axis=1)
+    return true_range.ewm(alpha=1 / period, adjust=False, min_periods=period).mean()
+
+
+def max_drawdown(close: pd.Series) -> dict:
+    """
+    最大回撤
+
+    Returns:
+        dict: drawdown（负数比例）、peak（峰值位置）、trough（谷值位置）
+    """
+    values = close.to_numpy(dtype=float)
+    if len(values) == 0 or np.isnan(values).all():
+        return {"drawdown": 0.0, "peak": None, "trough": None}
+    # fmax 跳过缺失值，开头或中间的NaN不会传播到后面的累计最大值
+    running_max = np.fmax.accumulate(values)
+    drawdowns = values / running_max - 1
+    trough = int(np.nanargmin(drawdowns))
+    peak = int(np.nanargmax(values[:trough + 1]))
+    return {"drawdown": float(drawdowns[trough]), "peak": peak, "trough": trough}
+
+
+def volume_zscore(volume: pd.Series, window: int = 20) -> pd.Series:
+    """成交量相对前window日均值的z分数"""
+    mean = volume.rolling(window, min_periods=window).mean().shift(1)
+    std = volume.rolling(window, min_periods=window).std().shift(1)
+    return (volume - mean) / std.replace(0, np.nan)
+
+
+def return_stats(close: pd.Series) -> dict:
+    """区间收益统计：总收益、日均收益、年化波动率、夏普比率（无风险利率取0）、上涨天数占比"""
+    close = close.dropna()
+    returns = close.pct_change().dropna()
+    if len(returns) == 0:
+        return {}
+    daily_std = float(returns.std()) if len(returns) > 1 else 0.0
+    mean = float(returns.mean())
+    return {
+        "total_return": float(close.iloc[-1] / close.iloc[0] - 1),
+        "mean_daily_return": mean,
+        "annual_volatility": daily_std * np.sqrt(TRADING_DAYS_PER_YEAR),
+        "sharpe": mean / daily_std * np.sqrt(TRADING_DAYS_PER_YEAR) if daily_std else None,
+        "up_day_ratio": float((returns > 0).mean()),
+        "best_day": float(returns.max()),
+        "worst_day": float(returns.min()),
+    }
+
+
+def _fmt(value, digits: int = 2, pct: bool = False) -> str:
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return "-"
+    return f"{value * 100:.{digits}f}%" if pct else f"{value:.{digits}f}"
+
+
+def summarize_bars(df: pd.DataFrame) -> Optional[str]:
+    """
+    把日线数据压缩为技术指标摘要文本
+
+    Args:
+        df: 日线数据，至少包含收盘价列
+
+    Returns:
+        str: 指标摘要，不是日线数据时返回None
+    """
+    if not isinstance(df, pd.DataFrame) or df.empty:
+        return None
+    columns = find_bar_columns(df)
+    if "close" not in columns:
+        return None
+    if "date" in columns:
+        df = df.sort_values(columns["date"])
+    close = pd.to_numeric(df[columns["close"]], errors="coerce").reset_index(drop=True)
+    if close.notna().sum() < 2:
+        return None
+    dates = df[columns["date"]].astype(str).tolist() if "date" in columns else list(range(len(df)))
+    last = len(close) - 1
+
+    lines = [f"区间: {dates[0]} 至 {dates[-1]}，共{len(close)}个交易日"]
+    valid = close.dropna()
+    lines.append(f"收盘价: 期初 {_fmt(valid.iloc[0])}，期末 {_fmt(valid.iloc[-1])}，"
+                 f"最高 {_fmt(close.max())}（{dates[int(close.idxmax())]}），最低 {_fmt(close.min())}（{dates[int(close.idxmin())]}）")
+
+    stats = return_stats(close)
+    if stats:
+        lines.append(f"收益: 区间涨跌幅 {_fmt(stats['total_return'], pct=True)}，日均 {_fmt(stats['mean_daily_return'], 3, pct=True)}，"
+                     f"年化波动率 {_fmt(stats['annual_volatility'], pct=True)}，夏普比率 {_fmt(stats['sharpe'])}，"
+                     f"上涨天数占比 {_fmt(stats['up_day_ratio'], 1, pct=True)}，"
+                     f"单日最大涨幅 {_fmt(stats['best_day'], pct=True)}，单日最大跌幅 {_fmt(stats['worst_day'], pct=True)}")
+
+    drawdown = max_drawdown(close)
+    if drawdown["peak"] is not None:
+        lines.append(f"最大回撤: {_fmt(drawdown['drawdown'], pct=True)}（{dates[drawdown['peak']]} 至 {dates[drawdown['trough']]}）")
+
+    ma_parts = []
+    for window in (5, 10, 20, 60):
+        value = sma(close, window).iloc[-1]
+        if not np.isnan(value):
+            ma_parts.append(f"MA{window} {_fmt(value)}（收盘{'高于' if close.iloc[-1] >= value else '低于'}均线）")
+    if ma_parts:
+        lines.append("均线: " + "，".join(ma_parts))
+    lines.append(f"EMA: EMA12 {_fmt(ema(close, 12).iloc[-1])}，EMA26 {_fmt(ema(close, 26).iloc[-1])}")
+
+    macd_df = macd(close)
+    hist = macd_df["hist"]
+    cross = ""
+    if len(hist) > 1 and np.sign(hist.iloc[-1]) != np.sign(hist.iloc[-2]):
+        cross = "，最新一日出现" + ("金叉" if hist.iloc[-1] > 0 else "死叉")
+    lines.append(f"MACD: DIF {_fmt(macd_df['dif'].iloc[-1], 3)}，DEA {_fmt(macd_df['dea'].iloc[-1], 3)}，"
+                 f"柱 {_fmt(hist.iloc[-1], 3)}{cross}")
+
+    rsi_value = rsi(close).iloc[-1]
+    if not np.isnan(rsi_value):
+        state = "超买" if rsi_value >= 70 else "超卖" if rsi_value <= 30 else "中性"
+        lines.append(f"RSI14: {_fmt(rsi_value, 1)}（{state}）")
+
+    bands = bollinger(close).iloc[-1]
+    if not np.isnan(bands["mid"]):
+        width = (bands["upper"] - bands["lower"]) / bands["mid"]
+        lines.append(f"布林带(20,2): 上轨 {_fmt(bands['upper'])}，中轨 {_fmt(bands['mid'])}，下轨 {_fmt(bands['lower'])}，"
+                     f"带宽 {_fmt(width, pct=True)}")
+
+    if "high" in columns and "low" in columns:
+        high = pd.to_numeric(df[columns["high"]], errors="coerce").reset_index(drop=True)
+        low = pd.to_numeric(df[columns["low"]], errors="coerce").reset_index(drop=True)
+        atr_value = atr(high, low, close).iloc[-1]
+        if not np.isnan(atr_value):
+            lines.append(f"ATR14: {_fmt(atr_value, 3)}（占收盘价 {_fmt(atr_value / close.iloc[-1], pct=True)}）")
+
+    if "volume" in columns:
+        volume = pd.to_numeric(df[columns["volume"]], errors="coerce").reset_index(drop=True)
+        zscores = volume_zscore(volume)
+        lines.append(f"成交量: 区间日均 {_fmt(volume.mean(), 0)}，最新 {_fmt(volume.iloc[last], 0)}，"
+                     f"最新量能z分数 {_fmt(zscores.iloc[last])}")
+        spikes = zscores[zscores >= 2].index.tolist()
+        if spikes:
+            lines.append("放量日(z≥2): " + "，".join(f"{dates[i]}({_fmt(zscores.iloc[i], 1)})" for i in spikes[-5:]))
+
+    recent = close.iloc[-5:]
+    lines.append("最近收盘: " + "，".join(f"{dates[i]} {_fmt(recent.loc[i])}" for i in recent.index))
+    return "\n".join(lines)
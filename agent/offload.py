@@ -0,0 +1,102 @@
+import os
+import asyncio
+import functools
+import threading
+import contextvars
+import concurrent.futures
+import weakref
+from typing import Any, Callable
+
+
+class BlockingExecutor:
+    def __init__(self, max_workers: int = 16, max_pending: int = 64):
+        """
+        初始化阻塞调用执行器
+        异步代码中的阻塞调用（向量检索、等待沙箱执行结果等）统一放到这里的线程池执行，
+        超过max_pending个调用时后来的调用在事件循环中等待，而不是无限堆积在线程池队列里。
+
+        Args:
+            max_workers: 线程数
+            max_pending: 同时提交到线程池的调用数上限（包括正在执行和排队的）
+        """
+        self.max_workers = max_workers
+        self.max_pending = max(max_pending, max_workers)
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers,
+                                                               thread_name_prefix="offload")
+        # asyncio.Semaphore 只能在一个事件循环中使用，每个事件循环各用一个
+        self._slots = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self.active = 0
+        self.waiting = 0
+        self.completed = 0
+
+    def _get_slots(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            slots = self._slots.get(loop)
+            if slots is None:
+                slots = self._slots[loop] = asyncio.Semaphore(self.max_pending)
+        return slots
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """
+        在线程池中执行阻塞调用并等待结果，与 asyncio.to_thread 相同会传递上下文变量
+
+        Args:
+            func: 阻塞函数
+            *args, **kwargs: 函数参数
+
+        Returns:
+            函数返回值
+        """
+        slots = self._get_slots()
+        self.waiting += 1
+        try:
+            await slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        try:
+            context = contextvars.copy_context()
+            call = functools.partial(context.run, func, *args, **kwargs)
+            return await asyncio.get_running_loop().run_in_executor(self._executor, call)
+        finally:
+            self.active -= 1
+            self.completed += 1
+            slots.release()
+
+    def shutdown(self, wait: bool = False):
+        """关闭线程池"""
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+    def stats(self) -> dict:
+        """获取统计信息"""
+        return {
+            "max_workers": self.max_workers,
+            "max_pending": self.max_pending,
+            "active": self.active,
+            "waiting": self.waiting,
+            "completed": self.completed,
+        }
+
+
+_default_executor = None
+_default_executor_lock = threading.Lock()
+
+
+def get_default_executor() -> BlockingExecutor:
+    """获取进程内共享的阻塞调用执行器"""
+    global _default_executor
+    if _default_executor is None:
+        with _default_executor_lock:
+            if _default_executor is None:
+                _default_executor = BlockingExecutor(
+                    max_workers=int(os.getenv("OFFLOAD_MAX_WORKERS", "16")),
+                    max_pending=int(os.getenv("OFFLOAD_MAX_PENDING", "64"))
+                )
+    return _default_executor
+
+
+async def run_blocking(func: Callable, *args, **kwargs) -> Any:
+    """在共享的执行器中执行阻塞调用"""
+    return await get_default_executor().run(func, *args, **kwargs)
@@ -0,0 +1,100 @@
+import re
+from datetime import datetime
+from typing import Any, List, Optional, Tuple
+
+import pandas as pd
+
+DATE_PATTERN = re.compile(r'(?<!\d)(\d{4})-?(\d{2})-?(\d{2})(?!\d)')
+# 只检查行情类数据的交易日期列；新闻、公告接口通常只提供最近的数据，是否可用交给LLM判断。
+# 股票代码不做本地检查：查询中的代码可能是指数或基金（如成分股、持仓），
+# 单只股票的接口也常常不返回代码列，是否匹配交给LLM判断
+DATE_COLUMNS = ("日期", "交易日", "date", "trade_date")
+
+
+def _parse_dates(text: str) -> List[datetime]:
+    dates = []
+    for match in DATE_PATTERN.finditer(text):
+        try:
+            dates.append(datetime.strptime("".join(match.groups()), "%Y%m%d"))
+        except ValueError:
+            continue
+    return dates
+
+
+def _find_column(df: pd.DataFrame, candidates) -> Optional[str]:
+    for name in candidates:
+        if name in df.columns:
+            return name
+    return None
+
+
+def _first_error_line(error: Any) -> str:
+    """取出错误信息的首行和异常类型所在的最后一行"""
+    lines = [line for line in str(error).strip().splitlines() if line.strip()]
+    if len(lines) <= 1:
+        return lines[0] if lines else "未知错误"
+    return f"{lines[0]}（{lines[-1].strip()}）"
+
+
+def _frames(result: Any) -> List[pd.DataFrame]:
+    if isinstance(result, pd.DataFrame):
+        return [result]
+    if isinstance(result, pd.Series):
+        return [result.to_frame()]
+    if isinstance(result, dict):
+        return [frame for value in result.values() for frame in _frames(value)]
+    if isinstance(result, (list, tuple)):
+        return [frame for value in result for frame in _frames(value)]
+    return []
+
+
+def _check_date_range(df: pd.DataFrame, start: datetime, end: datetime) -> Optional[str]:
+    column = _find_column(df, DATE_COLUMNS)
+    if column is None:
+        return None
+    dates = pd.to_datetime(df[column], errors="coerce").dropna()
+    if dates.empty:
+        return None
+    if getattr(dates.dt, "tz", None) is not None:
+        dates = dates.dt.tz_localize(None)
+    in_range = dates[(dates >= start) & (dates <= end.replace(hour=23, minute=59, second=59))]
+    if not in_range.empty:
+        return None
+    return (f"返回数据的{column}范围为{dates.min():%Y-%m-%d}至{dates.max():%Y-%m-%d}，"
+            f"不在查询区间{start:%Y-%m-%d}至{end:%Y-%m-%d}内，请检查日期参数的格式和取值")
+
+
+def prejudge_result(result: Any, query_text: str = "") -> Tuple[Optional[bool], Optional[str]]:
+    """
+    在调用LLM分析之前，用规则判断明显不满足需求的执行结果
+
+    Args:
+        result: 代码执行结果
+        query_text: 用户查询和重写后的查询，用于提取日期区间
+
+    Returns:
+        tuple: (False, 改进建议) 表示结果明显不满足需求；
+               (None, None) 表示无法在本地判断，需要交给LLM分析
+    """
+    if isinstance(result, dict) and 'error' in result:
+        return False, f"代码执行出错：{_first_error_line(result['error'])}。请根据错误信息修改代码，必要时更换接口或参数。"
+    if result is None or (isinstance(result, (dict, list, tuple, str)) and len(result) == 0):
+        return False, "代码没有返回任何数据，请确认把最终数据赋值给result变量，并检查接口参数是否正确。"
+
+    frames = _frames(result)
+    if not frames:
+        return None, None
+    if all(frame.empty for frame in frames):
+        return False, "返回的数据为空，请检查股票代码、日期格式等接口参数，或更换其他接口。"
+    non_empty = [frame for frame in frames if not frame.empty]
+    if all(frame.isna().all().all() for frame in non_empty):
+        return False, "返回的数据全部为空值(NaN)，请检查接口参数和字段处理逻辑，避免类型转换或合并时丢失数据。"
+
+    dates = _parse_dates(query_text)
+    if len(dates) >= 2:
+        start, end = min(dates), max(dates)
+        problems = [_check_date_range(frame, start, end) for frame in non_empty]
+        if all(problems):
+            return False, problems[0]
+
+    return None, None
@@ -1,5 +1,6 @@
 from datetime import datetime
 from .sweagent import DataFetchAgent
+from .offload import run_blocking
 from promptstore.prompt import rewrite_query_prompt, data_api_doc_prompt, judge_chat_prompt
 import os
 import json_repair
@@ -12,12 +13,15 @@ from log_manager import SyncLogManager
 
 # 配置日志文件路径
 LOG_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), "chat_logs.txt")
+# 查询重写和是否需要查询数据的判断结果在短时间内可以复用（秒），只在模型配置了响应缓存时生效
+REWRITE_CACHE_TTL = 60
+JUDGE_CACHE_TTL = 60
 
 class QueryAgent:
     def __init__(self, llm_api_key=None, llm_base_url=None, chat_model="glm-4-plus", 
                  embedding_model_name="embedding-2", embedding_store_dir=".index_all_embedding_2",
                  update_rag_doc=False, embedding_api_key=None, embedding_base_url=None,
-                 model=None, log_manager=None, index=None):
+                 model=None, log_manager=None, index=None, code_agent_options: dict = None):
         """
         初始化QueryAgent
         
@@ -33,14 +37,16 @@ class QueryAgent:
             model: LLM模型实例（新增）
             log_manager: 日志管理器实例（新增）
             index: 索引实例（新增）
+            code_agent_options: 传给DataFetchAgent的额外参数，如 speculative_candidates
         """
+        code_agent_options = code_agent_options or {}
         if model and log_manager and index:
             # 新版本初始化
             self.model = model
             self.log_manager = log_manager
             self.index = index
-            self.titles = "\n".join(index.get_titles())
-            self.code_agent = DataFetchAgent(model, log_manager, index)
+            self.titles = self._format_titles(index.get_titles())
+            self.code_agent = DataFetchAgent(model, log_manager, index, **code_agent_options)
         else:
             # 旧版本初始化
             self.llm_api_key = llm_api_key
@@ -57,7 +63,7 @@ class QueryAgent:
                 api_key=embedding_api_key,
                 base_url=embedding_base_url
             )
-            self.titles = "\n".join(self.index.get_titles())
+            self.titles = self._format_titles(self.index.get_titles())
             # 初始化LLM模型
             self.model = OpenaiApi(
                 api_key=llm_api_key,
@@ -67,12 +73,34 @@ class QueryAgent:
             # 初始化日志管理器
             self.log_manager = SyncLogManager(LOG_FILE)
             # 初始化DataFetchAgent
-            self.code_agent = DataFetchAgent(self.model, self.log_manager, self.index)
+            self.code_agent = DataFetchAgent(self.model, self.log_manager, self.index, **code_agent_options)
+    @staticmethod
+    def _format_titles(titles) -> str:
+        """IndexStore.get_titles 返回已拼接好的字符串，直接复用共享的标题目录"""
+        if isinstance(titles, str):
+            return titles
+        return "\n".join(titles)
+
     def get_code_agent(self):
         return self.code_agent
     def _get_current_time(self):
-        """获取当前时间字符串"""
-        return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        """获取当前时间字符串，精确到分钟，使同一分钟内相同问题的重写请求可以命中响应缓存"""
+        return datetime.now().strftime("%Y-%m-%d %H:%M")
+
+    def _build_rewrite_messages(self, user_query, current_time):
+        """构建重写查询语句的消息"""
+        prompt = rewrite_query_prompt.format(
+            user_query=user_query,
+            data_api=self.titles,
+            current_time=current_time
+        )
+        return [{"role": "user", "content": prompt}]
+
+    @staticmethod
+    def _format_doc_api(search_results):
+        """把检索到的API文档拼接成prompt中的文档段落"""
+        doc_api_list = search_results[:min(10, len(search_results))]
+        return "\n".join([f"【第{i}个文档】{doc}" for i, doc in enumerate(doc_api_list)])
 
     def query(self, user_query, max_iterations=5):
         """
@@ -90,19 +118,13 @@ class QueryAgent:
         
 
         # 生成新的查询语句
-        prompt = rewrite_query_prompt.format(
-            user_query=user_query,
-            data_api=self.titles,
-            current_time=current_time
-        )
-        messages = [{"role": "user", "content": prompt}]
-        rewrite_user_query = self.model.chat_model(messages)
+        messages = self._build_rewrite_messages(user_query, current_time)
+        rewrite_user_query = self.model.chat_model(messages, cache_ttl=REWRITE_CACHE_TTL)
         self.log_manager.append_log(f"agent 生成新的查询语句:\n {rewrite_user_query} \n--------------------------------")
 
         # 搜索相关API文档
         search_results = self.index.search(rewrite_user_query,10)
-        doc_api_list = search_results[:min(10, len(search_results))]
-        doc_api = "\n".join([f"【第{i}个文档】{doc}" for i, doc in enumerate(doc_api_list)])
+        doc_api = self._format_doc_api(search_results)
         # # 精排API文档
         # prompt = data_api_doc_prompt.format(
         #     user_query=user_query+'\n[新的查询语句]\n'+rewrite_user_query,
@@ -125,31 +147,86 @@ class QueryAgent:
             max_iterations=max_iterations
         )
 
-    def chat_llm(self, messages):
-        """流式输出聊天响应"""
-        return self.model.chat_model(messages)
+    async def aquery(self, user_query, max_iterations=5):
+        """
+        query 的异步版本，LLM调用走异步客户端，检索放到线程中执行
+        
+        Args:
+            user_query: 用户查询字符串
+            max_iterations: 最大迭代次数
+            
+        Returns:
+            dict: 查询结果
+        """
+        current_time = self._get_current_time()
+        self.log_manager.append_log(f"agent 开始查询: {user_query} \n--------------------------------")
+
+        # 生成新的查询语句
+        messages = self._build_rewrite_messages(user_query, current_time)
+        rewrite_user_query = await self.model.achat_model(messages, cache_ttl=REWRITE_CACHE_TTL)
+        self.log_manager.append_log(f"agent 生成新的查询语句:\n {rewrite_user_query} \n--------------------------------")
+
+        # 搜索相关API文档
+        search_results = await run_blocking(self.index.search, rewrite_user_query, 10)
+        doc_api = self._format_doc_api(search_results)
+
+        # 使用DataFetchAgent生成和执行代码
+        return await self.code_agent.agenerate_and_execute_data_fetch_code(
+            user_query=user_query,
+            rewrite_query=rewrite_user_query,
+            doc_api=doc_api,
+            max_iterations=max_iterations
+        )
+
+    def chat_llm(self, messages, cache_ttl=None):
+        """获取聊天响应，cache_ttl 为响应缓存的有效期（秒）"""
+        return self.model.chat_model(messages, cache_ttl=cache_ttl)
     
     def stream_chat_llm(self, messages):
         """流式输出聊天响应"""
         return self.model.stream_chat_model(messages)
-    
-    def check_need_query(self, user_query):
-        """检查是否需要使用query获取数据"""
+
+    async def achat_llm(self, messages, cache_ttl=None):
+        """异步获取聊天响应，cache_ttl 为响应缓存的有效期（秒）"""
+        return await self.model.achat_model(messages, cache_ttl=cache_ttl)
+
+    async def astream_chat_llm(self, messages):
+        """异步流式输出聊天响应"""
+        return await self.model.astream_chat_model(messages)
+
+    @staticmethod
+    def _build_judge_messages(user_query):
+        """构建判断是否需要查询数据的消息"""
         prompt = judge_chat_prompt.format(
             user_query=user_query
         )
-        messages = [{
+        return [{
             "role": "system",
             "content": "你是一个判断用户问题是否需要查询数据的助手。如果用户问题涉及到需要实时数据、历史数据、或者具体的数据分析，就需要使用query。"
         }, {
             "role": "user",
             "content": prompt
         }]
-        result = self.chat_llm(messages)
+
+    @staticmethod
+    def _parse_judge_result(result):
+        """解析判断结果，返回 (是否需要数据, 查询列表)"""
         judge_result = json_repair.loads(result)
         is_need_data = judge_result['result']['is_need_data']
         query_list = judge_result['result']['query_list']
         return is_need_data, query_list
+    
+    def check_need_query(self, user_query):
+        """检查是否需要使用query获取数据"""
+        messages = self._build_judge_messages(user_query)
+        result = self.chat_llm(messages, cache_ttl=JUDGE_CACHE_TTL)
+        return self._parse_judge_result(result)
+
+    async def acheck_need_query(self, user_query):
+        """异步检查是否需要使用query获取数据"""
+        messages = self._build_judge_messages(user_query)
+        result = await self.achat_llm(messages, cache_ttl=JUDGE_CACHE_TTL)
+        return self._parse_judge_result(result)
 
     async def chat_stream(self, messages: List[Dict[str, str]]) -> AsyncGenerator[str, None]:
         """
@@ -0,0 +1,300 @@
+import os
+import sys
+import queue
+import pickle
+import struct
+import builtins
+import time
+import atexit
+import threading
+import traceback
+import subprocess
+from typing import Any, Dict, Tuple
+
+# 工作进程启动时预先导入的模块，避免在请求中付出导入开销
+DEFAULT_PRELOAD_MODULES = ("akshare", "pandas", "numpy")
+# 后台替换工作进程时启动失败的重试次数
+SPAWN_RETRIES = 3
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_HEADER = struct.Struct("!Q")
+
+
+def build_exec_context() -> Dict[str, Any]:
+    """
+    构建执行生成代码时使用的全局命名空间
+    默认替换 __import__，使生成代码导入的akshare带有结果缓存，
+    设置环境变量 AKSHARE_CACHE_ENABLED=0 可关闭；
+    同时提供 get_daily_bars 辅助函数，从本地行情存储读取日线数据
+
+    Returns:
+        Dict: exec使用的全局命名空间
+    """
+    from agent.barstore import get_daily_bars
+    context = {"get_daily_bars": get_daily_bars}
+    if os.getenv("AKSHARE_CACHE_ENABLED", "1") != "0":
+        from agent.akcache import make_caching_import
+        exec_builtins = dict(vars(builtins))
+        exec_builtins["__import__"] = make_caching_import()
+        context["__builtins__"] = exec_builtins
+    return context
+
+
+def run_code(code: str) -> Any:
+    """
+    在当前进程中执行代码
+
+    Args:
+        code: 要执行的代码字符串
+
+    Returns:
+        代码中 result 变量的值
+    """
+    context = build_exec_context()
+    compiled_code = compile(code, '<string>', 'exec')
+    exec(compiled_code, context)
+    return context.get('result', {})
+
+
+def _write_frame(stream, obj):
+    data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    stream.write(_HEADER.pack(len(data)) + data)
+    stream.flush()
+
+
+def _read_frame(stream):
+    header = stream.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        raise EOFError("管道已关闭")
+    (length,) = _HEADER.unpack(header)
+    data = stream.read(length)
+    if len(data) < length:
+        raise EOFError("管道已关闭")
+    return pickle.loads(data)
+
+
+class _Worker:
+    def __init__(self, memory_limit_mb, preload_modules):
+        """启动一个工作进程，并用后台线程读取它的输出"""
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join([PROJECT_ROOT, env.get("PYTHONPATH", "")]).rstrip(os.pathsep)
+        args = [sys.executable, "-m", "agent.sandbox",
+                str(memory_limit_mb or 0), ",".join(preload_modules)]
+        self.process = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env)
+        self.responses = queue.Queue()
+        self.tasks_done = 0
+        self._reader = threading.Thread(target=self._read_loop, daemon=True)
+        self._reader.start()
+
+    def _read_loop(self):
+        try:
+            while True:
+                self.responses.put(_read_frame(self.process.stdout))
+        except Exception:
+            # 进程退出或管道损坏
+            self.responses.put(None)
+
+    @property
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def kill(self):
+        try:
+            self.process.kill()
+            self.process.wait(timeout=5)
+        except Exception:
+            pass
+
+    def stop(self):
+        try:
+            _write_frame(self.process.stdin, None)
+            self.process.wait(timeout=5)
+        except Exception:
+            self.kill()
+
+
+class CodeWorkerPool:
+    def __init__(self, size: int = None, timeout: float = 120, memory_limit_mb: int = 4096,
+                 preload_modules=DEFAULT_PRELOAD_MODULES, max_tasks_per_worker: int = 200,
+                 acquire_timeout: float = None):
+        """
+        初始化代码执行进程池
+        工作进程预先导入常用模块，代码和结果通过管道传递；
+        每次执行有超时和内存限制，崩溃、超时或执行次数过多的进程会被回收替换。
+
+        Args:
+            size: 工作进程数量，默认取CPU核数与4的较小值
+            timeout: 单次执行的超时时间（秒）
+            memory_limit_mb: 工作进程的内存上限（MB），为0或None时不限制
+            preload_modules: 预先导入的模块
+            max_tasks_per_worker: 单个工作进程最多执行的次数
+            acquire_timeout: 等待空闲进程的最长时间（秒），默认为执行超时的2倍
+        """
+        self.size = size or min(4, os.cpu_count() or 1)
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.preload_modules = tuple(preload_modules)
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.acquire_timeout = acquire_timeout or self.timeout * 2
+        self._idle = queue.Queue()
+        self._closed = False
+        # 池中现有的工作进程数（空闲、执行中和正在替换的），替换失败时减少，之后的请求会补齐
+        self._workers = 0
+        self._lock = threading.Lock()
+        for _ in range(self.size):
+            self._idle.put(self._spawn())
+            self._workers += 1
+
+    def _spawn(self) -> _Worker:
+        return _Worker(self.memory_limit_mb, self.preload_modules)
+
+    def _discard(self):
+        """记录一个工作进程已被回收且没有替换"""
+        with self._lock:
+            self._workers -= 1
+
+    def _replace(self, worker: _Worker):
+        """在后台回收并替换工作进程，不阻塞当前请求；启动失败时重试，仍失败则让池暂时缩小"""
+        def _run():
+            worker.kill()
+            for attempt in range(SPAWN_RETRIES):
+                if self._closed:
+                    break
+                try:
+                    self._idle.put(self._spawn())
+                    return
+                except Exception as e:
+                    print(f"启动代码执行进程失败（第{attempt + 1}次）: {e}")
+                    time.sleep(2 ** attempt)
+            self._discard()
+        threading.Thread(target=_run, daemon=True).start()
+
+    def _refill(self):
+        """池因替换失败缩小时，在当前线程中补齐工作进程"""
+        with self._lock:
+            missing = self.size - self._workers
+            self._workers += max(missing, 0)
+        for _ in range(missing):
+            try:
+                self._idle.put(self._spawn())
+            except Exception as e:
+                print(f"补充代码执行进程失败: {e}")
+                self._discard()
+
+    def execute(self, code: str, timeout: float = None) -> Tuple[bool, Any]:
+        """
+        在工作进程中执行代码，没有空闲进程时阻塞等待
+
+        Args:
+            code: 要执行的代码字符串
+            timeout: 本次执行的超时时间，默认使用池的配置
+
+        Returns:
+            tuple: (是否执行成功, result变量的值或错误信息字典)
+        """
+        if self._closed:
+            raise RuntimeError("代码执行进程池已关闭")
+        timeout = timeout or self.timeout
+        self._refill()
+        if self._workers <= 0:
+            raise RuntimeError("没有可用的代码执行进程，工作进程启动失败")
+        try:
+            worker = self._idle.get(timeout=self.acquire_timeout)
+        except queue.Empty:
+            raise RuntimeError(f"等待空闲的代码执行进程超时（超过{self.acquire_timeout}秒，"
+                               f"可用进程{self._workers}/{self.size}）")
+        if not worker.alive:
+            worker.kill()
+            try:
+                worker = self._spawn()
+            except Exception as e:
+                self._discard()
+                raise RuntimeError(f"代码执行进程已退出且无法重新启动: {e}")
+
+        try:
+            _write_frame(worker.process.stdin, code)
+            response = worker.responses.get(timeout=timeout)
+        except queue.Empty:
+            self._replace(worker)
+            return False, {"error": f"代码执行超时（超过{timeout}秒），执行进程已被回收"}
+        except Exception as e:
+            self._replace(worker)
+            return False, {"error": f"代码执行进程通信失败: {e}"}
+
+        if response is None:
+            self._replace(worker)
+            return False, {"error": "代码执行进程异常退出（可能超出内存限制），执行进程已被回收"}
+
+        worker.tasks_done += 1
+        if worker.tasks_done >= self.max_tasks_per_worker:
+            self._replace(worker)
+        else:
+            self._idle.put(worker)
+        return response
+
+    def shutdown(self):
+        """关闭所有工作进程"""
+        self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                break
+
+
+_default_pool = None
+_default_pool_lock = threading.Lock()
+
+
+def get_default_pool() -> CodeWorkerPool:
+    """获取进程内共享的代码执行进程池，首次调用时启动"""
+    global _default_pool
+    if _default_pool is None:
+        with _default_pool_lock:
+            if _default_pool is None:
+                _default_pool = CodeWorkerPool()
+                atexit.register(_default_pool.shutdown)
+    return _default_pool
+
+
+def _worker_main(memory_limit_mb: int, preload_modules):
+    """工作进程入口：从stdin读取代码，执行后把结果写回stdout"""
+    # 帧协议独占原始stdout，生成代码里的print输出转到stderr
+    channel = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    sys.stdout = sys.stderr
+    requests = sys.stdin.buffer
+
+    if memory_limit_mb:
+        try:
+            import resource
+            limit = memory_limit_mb * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        except (ImportError, ValueError, OSError) as e:
+            print(f"设置内存限制失败: {e}")
+
+    for module in preload_modules:
+        if module:
+            try:
+                __import__(module)
+            except ImportError as e:
+                print(f"预加载模块 {module} 失败: {e}")
+
+    while True:
+        try:
+            code = _read_frame(requests)
+        except EOFError:
+            break
+        if code is None:
+            break
+        try:
+            response = (True, run_code(code))
+        except Exception as e:
+            response = (False, {"error": str(e)+"\n"+traceback.format_exc()})
+        try:
+            _write_frame(channel, response)
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            _write_frame(channel, (False, {"error": f"执行结果无法传回主进程: {e}"}))
+
+
+if __name__ == "__main__":
+    _worker_main(int(sys.argv[1]), sys.argv[2].split(","))
@@ -0,0 +1,240 @@
+import os
+import json
+import time
+import zlib
+import asyncio
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from .chat_manager import ChatManager
+from .offload import run_blocking
+
+# 过期会话的磁盘清理间隔（秒）
+DISK_CLEANUP_INTERVAL = 60
+
+
+class SessionStore:
+    def __init__(self, max_sessions: int = 1000, max_bytes: int = 64 * 1024 * 1024, idle_ttl: float = 3600,
+                 spill_path: Optional[str] = None):
+        """
+        初始化聊天会话存储
+        内存中按LRU保存ChatManager，会话数或估计内存超过上限时换出最久未使用的会话；
+        配置了spill_path时换出的会话压缩后写入SQLite，再次访问时恢复，否则直接丢弃。
+        超过idle_ttl未访问的会话无论在内存还是磁盘中都会被删除。
+        内存中的查找和淘汰在事件循环中完成，SQLite的读写放到线程池执行，不阻塞事件循环。
+
+        Args:
+            max_sessions: 内存中最多保留的会话数
+            max_bytes: 内存中会话历史的估计总字节数上限
+            idle_ttl: 会话空闲多久后过期（秒）
+            spill_path: 换出会话的SQLite文件路径，为None时不换出到磁盘
+        """
+        self.max_sessions = max(1, max_sessions)
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        # key -> [ChatManager, 估计字节数, 最近访问时间]
+        self._sessions = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.RLock()
+        # 已从内存淘汰、尚未写完磁盘的会话，写盘期间再次访问时直接取回
+        self._spilling = {}
+        # 正在从磁盘读取的会话，同一会话的并发请求共用一次读取
+        self._loading = {}
+        # SQLite连接在线程池的多个线程中使用，读写需要串行
+        self._db_lock = threading.Lock()
+        self._last_cleanup = 0.0
+        self.created = 0
+        self.restored = 0
+        self.spilled = 0
+        self.expired = 0
+        self._conn = None
+        if spill_path:
+            spill_dir = os.path.dirname(spill_path)
+            if spill_dir:
+                os.makedirs(spill_dir, exist_ok=True)
+            self._conn = sqlite3.connect(spill_path, timeout=30, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions (key TEXT PRIMARY KEY, state BLOB, last_access REAL)"
+            )
+            self._conn.commit()
+
+    @staticmethod
+    def make_key(session_id: str, stock_name: str, chat_model: str) -> str:
+        """同一个会话中不同股票、不同模型的聊天分开保存"""
+        return f"{session_id}\x1f{stock_name}\x1f{chat_model}"
+
+    def _remove(self, key: str):
+        entry = self._sessions.pop(key, None)
+        if entry is not None:
+            self._total_bytes -= entry[1]
+        return entry
+
+    def _spill(self, items: list):
+        """把淘汰的会话压缩后写入磁盘，在线程池中执行"""
+        try:
+            for key, _, state, last_access in items:
+                state = zlib.compress(json.dumps(state, ensure_ascii=False).encode("utf-8"))
+                with self._db_lock:
+                    self._conn.execute("INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)", (key, state, last_access))
+                    self._conn.commit()
+                self.spilled += 1
+        finally:
+            with self._lock:
+                for key, manager, _, _ in items:
+                    if self._spilling.get(key) is manager:
+                        del self._spilling[key]
+
+    def _restore(self, key: str) -> Optional[dict]:
+        """从磁盘读取并删除换出的会话状态，在线程池中执行"""
+        if self._conn is None:
+            return None
+        with self._db_lock:
+            row = self._conn.execute("SELECT state, last_access FROM sessions WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("DELETE FROM sessions WHERE key = ?", (key,))
+            self._conn.commit()
+        if time.time() - row[1] > self.idle_ttl:
+            self.expired += 1
+            return None
+        return json.loads(zlib.decompress(row[0]).decode("utf-8"))
+
+    def _cleanup_disk(self, now: float):
+        """删除磁盘中空闲超时的会话，在线程池中执行"""
+        with self._db_lock:
+            self._conn.execute("DELETE FROM sessions WHERE last_access < ?", (now - self.idle_ttl,))
+            self._conn.commit()
+
+    def _expire(self, now: float) -> bool:
+        """
+        删除内存中空闲超时的会话，内存中按访问时间排序，只需检查最久未使用的一端
+
+        Returns:
+            bool: 是否需要清理磁盘中的过期会话
+        """
+        while self._sessions:
+            key, entry = next(iter(self._sessions.items()))
+            if now - entry[2] <= self.idle_ttl:
+                break
+            self._remove(key)
+            self.expired += 1
+        if self._conn is not None and now - self._last_cleanup > DISK_CLEANUP_INTERVAL:
+            self._last_cleanup = now
+            return True
+        return False
+
+    def _evict(self, keep: str) -> list:
+        """
+        会话数或估计内存超过上限时从内存淘汰最久未使用的会话，当前会话保留
+
+        Returns:
+            list: 需要写入磁盘的 (key, ChatManager, 导出的状态, 最近访问时间)，
+                状态在事件循环中导出，写盘时不再读取ChatManager
+        """
+        evicted = []
+        while len(self._sessions) > 1 and (
+                len(self._sessions) > self.max_sessions or self._total_bytes > self.max_bytes):
+            key = next(iter(self._sessions))
+            if key == keep:
+                self._sessions.move_to_end(key)
+                continue
+            manager, _, last_access = self._remove(key)
+            if self._conn is not None:
+                self._spilling[key] = manager
+                evicted.append((key, manager, manager.export_state(), last_access))
+        return evicted
+
+    def _put(self, key: str, manager: ChatManager, now: float) -> list:
+        self._remove(key)
+        size = manager.memory_size()
+        self._sessions[key] = [manager, size, now]
+        self._total_bytes += size
+        return self._evict(keep=key)
+
+    async def _aspill(self, evicted: list):
+        """在线程池中写盘，请求被取消时写盘仍会完成，避免淘汰的会话丢失"""
+        future = asyncio.ensure_future(run_blocking(self._spill, evicted))
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        await asyncio.shield(future)
+
+    async def aget_or_create(self, key: str, factory: Callable[[], ChatManager]) -> ChatManager:
+        """
+        获取会话对应的ChatManager，不存在时用factory创建，换出到磁盘的会话会被恢复
+
+        Args:
+            key: 会话键，见 make_key
+            factory: 创建新ChatManager的函数
+
+        Returns:
+            ChatManager: 会话的聊天管理器
+        """
+        now = time.time()
+        with self._lock:
+            cleanup = self._expire(now)
+            entry = self._sessions.get(key)
+            if entry is not None:
+                entry[2] = now
+                self._sessions.move_to_end(key)
+                manager = entry[0]
+            else:
+                manager = self._spilling.get(key)
+        if cleanup:
+            await run_blocking(self._cleanup_disk, now)
+        if entry is not None:
+            return manager
+        # 正在写盘的会话直接取回，否则从磁盘恢复
+        state = None
+        if manager is None:
+            future = self._loading.get(key)
+            if future is None:
+                future = asyncio.ensure_future(run_blocking(self._restore, key))
+                self._loading[key] = future
+                future.add_done_callback(lambda f: self._loading.pop(key, None))
+            state = await asyncio.shield(future)
+        with self._lock:
+            # 读磁盘期间同一会话的其他请求可能已经创建了ChatManager
+            entry = self._sessions.get(key)
+            if entry is not None:
+                return entry[0]
+            if manager is not None or state is not None:
+                self.restored += 1
+            else:
+                self.created += 1
+            if manager is None:
+                manager = factory()
+                if state is not None:
+                    manager.import_state(state)
+            evicted = self._put(key, manager, now)
+        if evicted:
+            await self._aspill(evicted)
+        return manager
+
+    async def atouch(self, key: str, manager: ChatManager):
+        """
+        一轮对话结束后更新会话的内存估计和访问时间；
+        会话在对话过程中被换出时重新放回内存，避免丢失本轮消息
+        """
+        with self._lock:
+            evicted = self._put(key, manager, time.time())
+        if evicted:
+            await self._aspill(evicted)
+
+    def stats(self) -> dict:
+        """获取统计信息"""
+        with self._lock:
+            spilled_sessions = 0
+            if self._conn is not None:
+                with self._db_lock:
+                    spilled_sessions = self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            return {
+                "sessions": len(self._sessions),
+                "bytes": self._total_bytes,
+                "spilled_sessions": spilled_sessions,
+                "created": self.created,
+                "restored": self.restored,
+                "spilled": self.spilled,
+                "expired": self.expired,
+            }
@@ -1,35 +1,37 @@
 from agent.query import QueryAgent
 from promptstore.prompt import stock_report_prompt
+from agent.indicators import summarize_bars
+from agent.summarize import summarize_result
+from agent.offload import run_blocking
+import re
+import asyncio
+import concurrent.futures
 import traceback
 
-class StockAnalyzer:
-    def __init__(self, query_processor: QueryAgent):
-        """
-        初始化股票分析器
-        
-        Args:
-            query_processor: QueryProcessor实例，用于执行查询
-        """
-        self.query_processor = query_processor
-        self.code_agent = query_processor.get_code_agent()
-    
-    def analyze_stock(self, stock_name: str, start_date: str, end_date: str,reflection_nums=10) -> dict:
-        """
-        分析指定时间段内的股票信息
-        
-        Args:
-            stock_name: 股票名称
-            start_date: 开始日期 (YYYY-MM-DD)
-            end_date: 结束日期 (YYYY-MM-DD)
-            
-        Returns:
-            dict: 包含公司概况、估值分析和股票走势分析的结果
-        """
-        try:
-            print(f"开始分析股票: {stock_name}")
-            
-            # 1. 查询公司概况
-            doc_api = """
+# 生成报告时各部分数据的token预算
+REPORT_SECTION_TOKENS = {
+    "company_profile": 1500,
+    "trend_analysis": 1500,
+    "news_reports": 3000,
+}
+
+SYMBOL_PATTERN = re.compile(r'(?<!\d)(\d{6})(?!\d)')
+
+
+def date_spellings(date: str) -> tuple:
+    """
+    日期参数的等价写法，akshare接口通常使用YYYYMMDD格式
+
+    Returns:
+        tuple: (YYYY-MM-DD, YYYYMMDD)，无法识别的日期只返回原值
+    """
+    compact = date.strip().replace('-', '')
+    if len(compact) != 8 or not compact.isdigit():
+        return (date,)
+    return (f"{compact[:4]}-{compact[4:6]}-{compact[6:]}", compact)
+
+# 公司概况相关的数据接口文档
+COMPANY_INFO_DOC_API = """
 #### 个股信息查询
 
 接口: stock_individual_info_em
@@ -450,17 +452,33 @@ print(stock_comment_detail_scrd_cost_em_df)
 ```
 
             """
-            company_info_query = f"请提供{stock_name}的个股信息"
-            company_info = self.code_agent.generate_and_execute_data_fetch_code(
-                user_query=company_info_query,
-                rewrite_query=company_info_query,
-                doc_api=doc_api,
-                max_iterations=reflection_nums
-            )
 
-            # 3. 股票走势分析
-            trend_query = f"请分析{stock_name}在{start_date}到{end_date}期间的历史股价走势"
-            doc_api = """
+# 股票走势相关的数据接口文档
+TREND_DOC_API = """
+##### 本地日线行情（优先使用）
+
+函数: get_daily_bars
+
+描述: 执行环境中已提供该函数，无需导入。数据与 stock_zh_a_hist 的日频数据完全相同，但只会向上游请求本地没有的日期区间，重复查询直接从本地读取
+
+输入参数
+
+| 名称         | 类型  | 描述                                        |
+|------------|-----|-------------------------------------------|
+| symbol     | str | symbol='000001'; 股票代码                     |
+| start_date | str | start_date='20240101'; 开始查询的日期             |
+| end_date   | str | end_date='20240301'; 结束查询的日期, 默认到今天       |
+| adjust     | str | 默认返回不复权的数据; qfq: 返回前复权后的数据; hfq: 返回后复权后的数据 |
+
+输出参数与 stock_zh_a_hist 相同, 返回的 DataFrame 是本地数据的切片, 需要修改时请先 .copy()
+
+接口示例
+
+```python
+stock_zh_a_hist_df = get_daily_bars(symbol="000001", start_date="20240101", end_date="20240301", adjust="")
+result = stock_zh_a_hist_df
+```
+
             ##### 历史行情数据-东财
 
 接口: stock_zh_a_hist
@@ -598,17 +616,9 @@ print(stock_zh_a_daily_hfq_df)
 ```
 
             """
-            trend_analysis = self.code_agent.generate_and_execute_data_fetch_code(
-                user_query=trend_query,
-                rewrite_query=trend_query,
-                doc_api=doc_api,
-                max_iterations=reflection_nums
-            )
 
-
-            # 4. 整合新闻数据
-            news_query = f"请提供{start_date}到{end_date}期间关于{stock_name}的新闻数据"
-            doc_api = """
+# 个股新闻相关的数据接口文档
+NEWS_DOC_API = """
             ### 个股新闻
 
 接口: stock_news_em
@@ -663,12 +673,137 @@ print(stock_news_em_df)
 [100 rows x 6 columns]
 ```
             """
-            news_info = self.code_agent.generate_and_execute_data_fetch_code(
-                user_query=news_query,
-                rewrite_query=news_query,
+
+class StockAnalyzer:
+    def __init__(self, query_processor: QueryAgent, max_workers: int = 3, section_tokens: dict = None,
+                 progress_callback=None):
+        """
+        初始化股票分析器
+        
+        Args:
+            query_processor: QueryProcessor实例，用于执行查询
+            max_workers: 并发模式下同时执行的数据获取阶段数上限
+            section_tokens: 生成报告时各部分数据的token预算，默认使用 REPORT_SECTION_TOKENS
+            progress_callback: 进度回调 callback(event, data)，event 为 stage_started / stage_finished /
+                report_started / report_finished；并发模式下可能在工作线程中调用
+        """
+        self.query_processor = query_processor
+        self.code_agent = query_processor.get_code_agent()
+        self.max_workers = max_workers
+        self.section_tokens = {**REPORT_SECTION_TOKENS, **(section_tokens or {})}
+        self.progress_callback = progress_callback
+        self._symbols = {}
+
+    def _notify(self, event: str, **data):
+        """通知分析进度，回调出错不影响分析"""
+        if self.progress_callback is None:
+            return
+        try:
+            self.progress_callback(event, data)
+        except Exception as e:
+            print(f"进度回调出错: {str(e)}")
+
+    def _resolve_symbol(self, stock_name: str):
+        """
+        获取股票名称对应的股票代码，用于把生成的代码参数化后缓存
+
+        Returns:
+            str: 6位股票代码，无法确定时返回None
+        """
+        match = SYMBOL_PATTERN.search(stock_name)
+        if match:
+            return match.group(1)
+        if not getattr(self.code_agent, "use_code_cache", False):
+            return None
+        if stock_name not in self._symbols:
+            symbol = None
+            try:
+                import akshare as ak
+                from agent.akcache import get_default_cache
+                code_names = get_default_cache().wrap(ak.stock_info_a_code_name, "stock_info_a_code_name")()
+                matched = code_names[code_names["name"] == stock_name.strip()]
+                if not matched.empty:
+                    symbol = str(matched.iloc[0]["code"])
+            except Exception as e:
+                print(f"查询股票代码失败: {str(e)}")
+            self._symbols[stock_name] = symbol
+        return self._symbols[stock_name]
+
+    def _build_stages(self, stock_name: str, start_date: str, end_date: str, symbol: str = None) -> list:
+        """
+        构建相互独立的数据获取阶段
+        
+        Returns:
+            list: (结果键名, 查询语句, API文档, 模板参数) 组成的列表
+        """
+        template_params = {
+            "stock": (stock_name, symbol),
+            # 日期的两种写法位置固定，请求使用YYYYMMDD时第一种写法不在查询语句中，该参数不参与缓存
+            "start_date": date_spellings(start_date),
+            "end_date": date_spellings(end_date),
+        }
+        return [
+            ("company_profile", f"请提供{stock_name}的个股信息", COMPANY_INFO_DOC_API, template_params),
+            ("trend_analysis", f"请分析{stock_name}在{start_date}到{end_date}期间的历史股价走势", TREND_DOC_API, template_params),
+            ("news_reports", f"请提供{start_date}到{end_date}期间关于{stock_name}的新闻数据", NEWS_DOC_API, template_params),
+        ]
+
+    def _run_stage(self, stage: str, query: str, doc_api: str, reflection_nums: int, template_params: dict = None):
+        """
+        执行单个数据获取阶段，异常只影响当前阶段
+        
+        Returns:
+            阶段执行结果，失败时返回包含error的字典
+        """
+        self._notify("stage_started", stage=stage)
+        try:
+            result = self.code_agent.generate_and_execute_data_fetch_code(
+                user_query=query,
+                rewrite_query=query,
                 doc_api=doc_api,
-                max_iterations=reflection_nums
+                max_iterations=reflection_nums,
+                template_params=template_params
             )
+        except Exception as e:
+            error_info = traceback.format_exc()
+            print(f"阶段 {stage} 执行失败: {str(e)}")
+            self.code_agent.log_manager.append_log(f"阶段 {stage} 执行失败:\n{error_info}\n--------------------------------")
+            result = {"error": str(e)+"\n"+error_info}
+        self._notify("stage_finished", stage=stage, success=not (isinstance(result, dict) and "error" in result))
+        return result
+
+    def analyze_stock(self, stock_name: str, start_date: str, end_date: str,reflection_nums=10,
+                      parallel: bool = True) -> dict:
+        """
+        分析指定时间段内的股票信息
+        
+        Args:
+            stock_name: 股票名称
+            start_date: 开始日期 (YYYY-MM-DD)
+            end_date: 结束日期 (YYYY-MM-DD)
+            reflection_nums: 每个阶段的最大反思次数
+            parallel: 是否并发执行公司概况、股票走势和新闻三个阶段
+            
+        Returns:
+            dict: 包含公司概况、估值分析和股票走势分析的结果
+        """
+        try:
+            print(f"开始分析股票: {stock_name}")
+            stages = self._build_stages(stock_name, start_date, end_date, self._resolve_symbol(stock_name))
+
+            stage_results = {}
+            if parallel:
+                # 三个阶段互不依赖，放到有界线程池中并行执行
+                with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                    futures = {
+                        stage: executor.submit(self._run_stage, stage, query, doc_api, reflection_nums, params)
+                        for stage, query, doc_api, params in stages
+                    }
+                    for stage, future in futures.items():
+                        stage_results[stage] = future.result()
+            else:
+                for stage, query, doc_api, params in stages:
+                    stage_results[stage] = self._run_stage(stage, query, doc_api, reflection_nums, params)
 
             # 整合所有分析结果
             result = {
@@ -676,20 +811,83 @@ print(stock_news_em_df)
                 "analysis_period": {
                     "start_date": start_date,
                     "end_date": end_date
-                },
-                "company_profile": {
-                    "query": company_info_query,
-                    "result": company_info
-                },
-                "trend_analysis": {
-                    "query": trend_query,
-                    "result": trend_analysis
-                },
-                "news_reports": {
-                    "query": news_query,
-                    "result": news_info
                 }
             }
+            for stage, query, _, _ in stages:
+                result[stage] = {
+                    "query": query,
+                    "result": stage_results[stage]
+                }
+            print("分析完成，返回结果")
+            return result
+            
+        except Exception as e:
+            print(f"分析过程中出现错误: {str(e)}")
+            print("错误堆栈:")
+            traceback.print_exc()
+            raise Exception(f"股票分析失败: {str(e)}\n{traceback.format_exc()}")
+
+    async def _arun_stage(self, stage: str, query: str, doc_api: str, reflection_nums: int,
+                          template_params: dict = None):
+        """_run_stage 的异步版本"""
+        self._notify("stage_started", stage=stage)
+        try:
+            result = await self.code_agent.agenerate_and_execute_data_fetch_code(
+                user_query=query,
+                rewrite_query=query,
+                doc_api=doc_api,
+                max_iterations=reflection_nums,
+                template_params=template_params
+            )
+        except Exception as e:
+            error_info = traceback.format_exc()
+            print(f"阶段 {stage} 执行失败: {str(e)}")
+            self.code_agent.log_manager.append_log(f"阶段 {stage} 执行失败:\n{error_info}\n--------------------------------")
+            result = {"error": str(e)+"\n"+error_info}
+        self._notify("stage_finished", stage=stage, success=not (isinstance(result, dict) and "error" in result))
+        return result
+
+    async def aanalyze_stock(self, stock_name: str, start_date: str, end_date: str, reflection_nums=10) -> dict:
+        """
+        analyze_stock 的异步版本，各阶段作为并发任务运行，不阻塞事件循环
+        
+        Args:
+            stock_name: 股票名称
+            start_date: 开始日期 (YYYY-MM-DD)
+            end_date: 结束日期 (YYYY-MM-DD)
+            reflection_nums: 每个阶段的最大反思次数
+            
+        Returns:
+            dict: 与 analyze_stock 结构相同的分析结果
+        """
+        try:
+            print(f"开始分析股票: {stock_name}")
+            symbol = await run_blocking(self._resolve_symbol, stock_name)
+            stages = self._build_stages(stock_name, start_date, end_date, symbol)
+            semaphore = asyncio.Semaphore(self.max_workers)
+
+            async def _run(stage, query, doc_api, params):
+                async with semaphore:
+                    return await self._arun_stage(stage, query, doc_api, reflection_nums, params)
+
+            # 单个阶段出错只记录在该阶段的结果中，不影响其他阶段
+            stage_results = await asyncio.gather(*[_run(*stage) for stage in stages], return_exceptions=True)
+
+            result = {
+                "stock_name": stock_name,
+                "analysis_period": {
+                    "start_date": start_date,
+                    "end_date": end_date
+                }
+            }
+            for (stage, query, _, _), stage_result in zip(stages, stage_results):
+                if isinstance(stage_result, Exception):
+                    print(f"阶段 {stage} 执行失败: {str(stage_result)}")
+                    stage_result = {"error": str(stage_result)}
+                result[stage] = {
+                    "query": query,
+                    "result": stage_result
+                }
             print("分析完成，返回结果")
             return result
             
@@ -699,34 +897,66 @@ print(stock_news_em_df)
             traceback.print_exc()
             raise Exception(f"股票分析失败: {str(e)}\n{traceback.format_exc()}")
 
+    @staticmethod
+    def _format_trend_result(result, max_tokens: int) -> str:
+        """
+        把走势数据转为报告使用的文本，日线数据替换为技术指标摘要
+
+        Args:
+            result: 走势分析阶段的执行结果
+            max_tokens: 非日线数据的token预算
+
+        Returns:
+            str: 走势数据文本
+        """
+        summary = summarize_bars(result)
+        if summary is not None:
+            return "\n" + summary
+        if isinstance(result, dict) and result:
+            parts = []
+            share = max_tokens // len(result)
+            for key, value in result.items():
+                summary = summarize_bars(value)
+                if summary is None:
+                    summary = summarize_result(value, share)
+                parts.append(f"{key}:\n{summary}")
+            return "\n" + "\n".join(parts)
+        return summarize_result(result, max_tokens)
+
+    def _build_report_messages(self, analysis_result: dict) -> list:
+        """根据分析结果构建生成报告的消息"""
+        analysis_text = ''
+        stock_name = analysis_result['stock_name']
+        analysis_period = analysis_result['analysis_period']
+        company_profile = analysis_result['company_profile']
+        trend_analysis = analysis_result['trend_analysis']
+        news_reports = analysis_result['news_reports']
+
+        
+        analysis_text += f"股票名称: {stock_name}\n"
+        analysis_text += f"分析时间段: {analysis_period['start_date']} 到 {analysis_period['end_date']}\n"
+        analysis_text += f"公司概况数据: {summarize_result(company_profile['result'], self.section_tokens['company_profile'])}\n"
+        analysis_text += f"股票走势分析数据: {self._format_trend_result(trend_analysis['result'], self.section_tokens['trend_analysis'])}\n"
+        analysis_text += f"新闻报告数据: {summarize_result(news_reports['result'], self.section_tokens['news_reports'])}\n"
+
+
+        print("生成报告提示词")
+        report_prompt = stock_report_prompt.format(stock_data=analysis_text)
+        # print(report_prompt)
+        return [
+            {"role": "system", "content": "你是一名专业的金融分析师，需要根据提供的股票数据生成一份专业、客观的股票分析报告。标题要带上分析时间段"},
+            {"role": "user", "content": report_prompt}
+        ]
+
     def get_stock_report(self, analysis_result: dict) -> str:
         """处理分析结果，生成报告"""
         try:
             print("开始生成股票报告")
-            analysis_text = ''
-            stock_name = analysis_result['stock_name']
-            analysis_period = analysis_result['analysis_period']
-            company_profile = analysis_result['company_profile']
-            trend_analysis = analysis_result['trend_analysis']
-            news_reports = analysis_result['news_reports']
-
-            
-            analysis_text += f"股票名称: {stock_name}\n"
-            analysis_text += f"分析时间段: {analysis_period['start_date']} 到 {analysis_period['end_date']}\n"
-            analysis_text += f"公司概况数据: {company_profile['result']}\n"
-            analysis_text += f"股票走势分析数据: {trend_analysis['result']}\n"
-            analysis_text += f"新闻报告数据: {news_reports['result']}\n"
-
-
-            print("生成报告提示词")
-            report_prompt = stock_report_prompt.format(stock_data=analysis_text)
-            # print(report_prompt)
-            messages = [
-                {"role": "system", "content": "你是一名专业的金融分析师，需要根据提供的股票数据生成一份专业、客观的股票分析报告。标题要带上分析时间段"},
-                {"role": "user", "content": report_prompt}
-            ]
+            messages = self._build_report_messages(analysis_result)
             print("调用LLM生成报告")
+            self._notify("report_started")
             report_result = self.query_processor.chat_llm(messages)
+            self._notify("report_finished")
             print("报告生成完成")
             return report_result
             
@@ -734,4 +964,22 @@ print(stock_news_em_df)
             print(f"生成报告时出现错误: {str(e)}")
             print("错误堆栈:")
             traceback.print_exc()
-            raise Exception(f"生成股票报告失败: {str(e)}\n{traceback.format_exc()}")
\ No newline at end of file
+            raise Exception(f"生成股票报告失败: {str(e)}\n{traceback.format_exc()}")
+
+    async def aget_stock_report(self, analysis_result: dict) -> str:
+        """get_stock_report 的异步版本"""
+        try:
+            print("开始生成股票报告")
+            messages = self._build_report_messages(analysis_result)
+            print("调用LLM生成报告")
+            self._notify("report_started")
+            report_result = await self.query_processor.achat_llm(messages)
+            self._notify("report_finished")
+            print("报告生成完成")
+            return report_result
+
+        except Exception as e:
+            print(f"生成报告时出现错误: {str(e)}")
+            print("错误堆栈:")
+            traceback.print_exc()
+            raise Exception(f"生成股票报告失败: {str(e)}\n{traceback.format_exc()}")
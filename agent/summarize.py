@@ -0,0 +1,170 @@
+import re
+import hashlib
+import pickle
+from typing import Any
+
+import numpy as np
+import pandas as pd
+
+# 执行结果写入反思prompt时的默认token预算
+DEFAULT_RESULT_TOKENS = 800
+CJK_PATTERN = re.compile(r'[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]')
+MAX_COLUMNS_LISTED = 30
+MAX_STATS_COLUMNS = 10
+MAX_ITEMS = 20
+MAX_DEPTH = 3
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估计token数：中文字符约1个token，其他字符约4个字符1个token"""
+    cjk = len(CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def truncate_text(text: str, max_tokens: int) -> str:
+    """把文本截断到token预算内，保留开头和结尾"""
+    tokens = estimate_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    keep = max(int(len(text) * max_tokens / tokens * 0.9), 20)
+    head, tail = keep * 2 // 3, keep // 3
+    return f"{text[:head]}\n...(省略约{len(text) - head - tail}个字符)...\n{text[-tail:]}"
+
+
+def _summarize_frame(df: pd.DataFrame, max_tokens: int, kind: str = "DataFrame") -> str:
+    """按预算逐步减少展示行数和单元格宽度，只渲染首尾几行，不生成完整字符串"""
+    rows, cols = df.shape
+    listed = [f"{name}({dtype})" for name, dtype in list(df.dtypes.items())[:MAX_COLUMNS_LISTED]]
+    if cols > MAX_COLUMNS_LISTED:
+        listed.append(f"...共{cols}列")
+    header = f"{kind}: {rows}行 x {cols}列\n列: " + ", ".join(listed)
+
+    stats = ""
+    numeric = df.select_dtypes(include="number").iloc[:, :MAX_STATS_COLUMNS]
+    if rows > 10 and numeric.shape[1]:
+        described = numeric.describe().loc[["mean", "std", "min", "max"]].T
+        stats = "数值列统计:\n" + described.to_string(float_format=lambda v: f"{v:.4g}")
+
+    text = header
+    for n_rows in (25, 10, 5, 3, 2, 1):
+        for width in (100, 50, 20, 10):
+            render = dict(max_colwidth=width, max_cols=20)
+            if rows <= 2 * n_rows:
+                body = "全部数据:\n" + df.to_string(**render)
+            else:
+                body = (f"前{n_rows}行:\n{df.head(n_rows).to_string(**render)}\n"
+                        f"后{n_rows}行:\n{df.tail(n_rows).to_string(**render)}")
+            text = "\n".join(part for part in (header, body, stats) if part)
+            if estimate_tokens(text) <= max_tokens:
+                return text
+        if stats and estimate_tokens(header + stats) > max_tokens // 2:
+            stats = ""
+    return truncate_text(text, max_tokens)
+
+
+def _summarize(result: Any, max_tokens: int, depth: int) -> str:
+    if isinstance(result, pd.DataFrame):
+        return _summarize_frame(result, max_tokens)
+    if isinstance(result, pd.Series):
+        return _summarize_frame(result.to_frame(), max_tokens, kind=f"Series[{result.name}]")
+    if isinstance(result, str):
+        return truncate_text(result, max_tokens)
+    if isinstance(result, np.ndarray):
+        with np.printoptions(threshold=50, edgeitems=3):
+            return truncate_text(f"ndarray(shape={result.shape}, dtype={result.dtype}): {result}", max_tokens)
+    if isinstance(result, dict) and depth < MAX_DEPTH:
+        if not result:
+            return "{}"
+        items = list(result.items())[:MAX_ITEMS]
+        share = max(max_tokens // len(items), 30)
+        lines = [f"{key}: {_summarize(value, share, depth + 1)}" for key, value in items]
+        if len(result) > MAX_ITEMS:
+            lines.append(f"...共{len(result)}个键")
+        return truncate_text("\n".join(lines), max_tokens)
+    if isinstance(result, (list, tuple)) and depth < MAX_DEPTH:
+        head = result[:MAX_ITEMS]
+        if all(isinstance(item, (str, int, float, bool, type(None))) for item in head):
+            text = repr(list(head))
+        else:
+            share = max(max_tokens // max(len(head), 1), 30)
+            text = "\n".join(f"[{i}] {_summarize(item, share, depth + 1)}" for i, item in enumerate(head))
+        if len(result) > MAX_ITEMS:
+            text += f"\n...共{len(result)}项"
+        return truncate_text(text, max_tokens)
+    return truncate_text(repr(result), max_tokens)
+
+
+def summarize_result(result: Any, max_tokens: int = DEFAULT_RESULT_TOKENS) -> str:
+    """
+    把代码执行结果压缩为适合放入prompt的文本
+    DataFrame/Series只渲染结构、行数、首尾几行和数值列统计，
+    dict/list按预算分配给各个元素，超出预算的文本保留首尾截断。
+
+    Args:
+        result: 代码执行结果
+        max_tokens: token预算
+
+    Returns:
+        str: 结果摘要
+    """
+    return _summarize(result, max_tokens, 0)
+
+
+# 估计DataFrame/数组文本长度时抽样的行数
+SIZE_SAMPLE_ROWS = 20
+
+
+def result_size(result: Any) -> int:
+    """
+    估计结果转为文本后的字符数，用于在多次结果中挑选数据最多的一个
+    所有类型都按字符计量；DataFrame/Series/ndarray只渲染前几行，按行数外推，不生成完整字符串
+    """
+    if isinstance(result, (pd.DataFrame, pd.Series)):
+        rows = len(result)
+        if rows == 0:
+            return len(str(result))
+        sample = result.head(SIZE_SAMPLE_ROWS)
+        return int(len(sample.to_string()) * rows / len(sample))
+    if isinstance(result, np.ndarray):
+        if result.size == 0:
+            return len(repr(result))
+        sample = result.ravel()[:SIZE_SAMPLE_ROWS]
+        return int(len(repr(sample.tolist())) * result.size / len(sample))
+    if isinstance(result, str):
+        return len(result)
+    if isinstance(result, dict):
+        return sum(len(repr(key)) + result_size(value) for key, value in result.items())
+    if isinstance(result, (list, tuple)):
+        return sum(result_size(item) for item in result)
+    return len(repr(result))
+
+
+def result_fingerprint(result: Any) -> str:
+    """计算结果内容的指纹，用于判断两次执行结果是否相同，不生成结果的完整字符串"""
+    digest = hashlib.md5()
+
+    def _update(value):
+        if isinstance(value, (pd.DataFrame, pd.Series)):
+            labels = list(value.columns) if isinstance(value, pd.DataFrame) else [value.name]
+            digest.update(repr((type(value).__name__, value.shape, labels)).encode())
+            try:
+                digest.update(pd.util.hash_pandas_object(value, index=True).values.tobytes())
+            except TypeError:
+                # 含不可哈希单元格（如list）时退回pickle
+                digest.update(pickle.dumps(value))
+        elif isinstance(value, dict):
+            digest.update(b"{")
+            for key, item in value.items():
+                digest.update(repr(key).encode())
+                _update(item)
+            digest.update(b"}")
+        elif isinstance(value, (list, tuple)):
+            digest.update(b"[")
+            for item in value:
+                _update(item)
+            digest.update(b"]")
+        else:
+            digest.update(repr(value).encode())
+
+    _update(result)
+    return digest.hexdigest()
@@ -1,10 +1,88 @@
+import asyncio
+import concurrent.futures
 from typing import Dict, Any
 from datetime import datetime
 import json_repair
 from promptstore.prompt import data_fetch_code_prompt, data_fetch_reflection_code_prompt, data_fetch_reflection_analysis_prompt, get_code_fromat
+from agent.sandbox import get_default_pool, run_code
+from agent.offload import run_blocking
+from agent.summarize import DEFAULT_RESULT_TOKENS, summarize_result, result_size, result_fingerprint
+from agent.prejudge import prejudge_result
+from agent.codecache import get_default_code_cache, normalize_params, parameterize_code, render_code
+
+# 推测执行时各候选代码使用的温度，按顺序循环取用
+DEFAULT_CANDIDATE_TEMPERATURES = (0.2, 0.7, 1.0)
+# 相同代码和结果的分析结论可以复用的时间（秒）；代码生成不缓存，否则重试时会得到相同的代码
+ANALYSIS_CACHE_TTL = 600
+
+class _RoundState:
+    def __init__(self, agent, candidates: int, query_text: str, iteration: int,
+                 historical_results: list, historical_fingerprints: set):
+        """
+        一轮推测执行的候选状态，同步和异步的 _run_round 共用，只在提交和等待任务的方式上不同
+
+        Args:
+            agent: DataFetchAgent实例
+            candidates: 本轮候选代码数量
+            query_text: 用户查询和重写后的查询，用于本地预判
+            iteration: 当前迭代次数
+            historical_results: 历史执行结果，本轮新结果追加到其中
+            historical_fingerprints: 历史结果指纹，用于检测重复结果
+        """
+        self.agent = agent
+        self.candidates = candidates
+        self.query_text = query_text
+        self.iteration = iteration
+        self.historical_results = historical_results
+        self.historical_fingerprints = historical_fingerprints
+        self.failed = None
+        self.rejected = []
+        self.generation_errors = []
+
+    def on_generated(self, future):
+        """处理生成执行完成的候选代码，需要LLM判断时返回 (代码, 结果)，否则返回None"""
+        try:
+            code, result = future.result()
+        except Exception as e:
+            if self.candidates == 1:
+                raise
+            self.agent.log_manager.append_log(f"agent 候选代码生成失败: {e}\n--------------------------------")
+            self.generation_errors.append(e)
+            return None
+        if not self.agent._accept_candidate(code, result, self.iteration, self.historical_results,
+                                            self.historical_fingerprints):
+            return None
+        feedback = self.agent._prejudge(result, self.query_text)
+        if feedback is not None:
+            self.rejected.append((code, result, feedback))
+            return None
+        return code, result
+
+    def on_judged(self, future, candidate) -> bool:
+        """处理LLM判断结果，通过时返回True"""
+        is_pass, feedback = future.result()
+        if is_pass:
+            return True
+        if self.failed is None:
+            self.failed = (candidate[0], candidate[1], feedback)
+        return False
+
+    def outcome(self):
+        """没有候选通过时本轮的结果：(状态, 代码, 结果, 改进建议)"""
+        if self.failed is not None:
+            return ("fail",) + self.failed
+        if self.rejected:
+            return ("fail",) + self.rejected[0]
+        if self.generation_errors and len(self.generation_errors) == self.candidates:
+            raise self.generation_errors[-1]
+        return "duplicate", None, None, None
+
 
 class DataFetchAgent:
-    def __init__(self, model, log_manager, index):
+    def __init__(self, model, log_manager, index, code_executor=None, use_sandbox: bool = True,
+                 result_token_budget: int = DEFAULT_RESULT_TOKENS, speculative_candidates: int = 1,
+                 candidate_temperatures=DEFAULT_CANDIDATE_TEMPERATURES, speculative_concurrency: int = 3,
+                 use_prejudge: bool = True, code_cache=None, use_code_cache: bool = True):
         """
         初始化DataFetchAgent
         
@@ -12,10 +90,28 @@ class DataFetchAgent:
             model: LLM模型实例
             log_manager: 日志管理器实例
             index: 检索索引实例
+            code_executor: 代码执行进程池，为None时使用进程内共享的默认进程池
+            use_sandbox: 是否在独立进程中执行生成的代码，为False时在当前进程中执行
+            result_token_budget: 执行结果写入反思prompt时的token预算
+            speculative_candidates: 每轮同时生成的候选代码数量，为1时与逐次生成相同
+            candidate_temperatures: 各候选代码使用的温度，数量不足时循环取用
+            speculative_concurrency: 同时生成和执行的候选代码数量上限
+            use_prejudge: 是否先用本地规则判断明显不合格的结果，跳过LLM分析
+            code_cache: 已通过代码的缓存，为None时使用进程内共享的缓存
+            use_code_cache: 带模板参数的查询是否优先复用已通过的代码
         """
         self.model = model
         self.log_manager = log_manager
         self.index = index
+        self.code_executor = code_executor
+        self.use_sandbox = use_sandbox
+        self.result_token_budget = result_token_budget
+        self.speculative_candidates = max(1, speculative_candidates)
+        self.candidate_temperatures = tuple(candidate_temperatures)
+        self.speculative_concurrency = max(1, speculative_concurrency)
+        self.use_prejudge = use_prejudge
+        self.code_cache = code_cache
+        self.use_code_cache = use_code_cache
 
     def _get_current_time(self) -> str:
         """获取当前时间字符串"""
@@ -24,6 +120,7 @@ class DataFetchAgent:
     def _execute_code(self, code: str) -> Dict[str, Any]:
         """
         执行代码并返回结果
+        默认在预热的工作进程中执行，进程池不可用时退回到当前进程执行
         
         Args:
             code: 要执行的代码字符串
@@ -31,23 +128,289 @@ class DataFetchAgent:
         Returns:
             Dict: 执行结果
         """
+        if self.use_sandbox:
+            try:
+                executor = self.code_executor or get_default_pool()
+                success, result = executor.execute(code)
+            except Exception as e:
+                self.log_manager.append_log(f"代码执行进程池不可用，改为在当前进程中执行: {e}\n--------------------------------")
+            else:
+                if not success:
+                    self.log_manager.append_log(f"代码执行错误:\n{result.get('error')}\n--------------------------------")
+                return result
+
         try:
-            context = {}
-            compiled_code = compile(code, '<string>', 'exec')
-            exec(compiled_code, context)
-            return context.get('result', {})
+            return run_code(code)
         except Exception as e:
             import traceback
             error_info = traceback.format_exc()
             self.log_manager.append_log(f"代码执行错误:\n{error_info}\n--------------------------------")
             return {"error": str(e)+"\n"+error_info}
 
+    def _build_code_messages(self, user_query: str, rewrite_query: str, doc_api: str, current_time: str,
+                             current_code=None, current_result=None, analysis_result=None) -> list:
+        """构建生成代码的消息，已有代码时使用反思修改代码的prompt"""
+        if current_code is None:
+            prompt = data_fetch_code_prompt.format(
+                user_query=user_query,
+                rewrite_user_query=rewrite_query,
+                data_api_doc=doc_api,
+                current_time=current_time
+            )
+        else:
+            prompt = data_fetch_reflection_code_prompt.format(
+                data_api_doc=doc_api,
+                history_code=current_code,
+                current_result=summarize_result(current_result, self.result_token_budget),
+                analysis_result=analysis_result,
+                current_time=current_time
+            )
+        return [{"role": "user", "content": prompt}]
+
+    def _build_analysis_messages(self, doc_api: str, current_result, current_code: str) -> list:
+        """构建分析执行结果的消息"""
+        analysis_prompt = data_fetch_reflection_analysis_prompt.format(
+            data_api_doc=doc_api,
+            current_result=summarize_result(current_result, self.result_token_budget),
+            current_code=current_code
+        )
+        return [{"role": "user", "content": analysis_prompt}]
+
+    def _parse_analysis(self, analysis_response: str):
+        """
+        解析结果分析的响应
+        
+        Returns:
+            tuple: (是否通过, 改进建议)
+        """
+        analysis_result = json_repair.loads(analysis_response)['result']
+        is_pass = analysis_result['is_pass']
+        thoughts = analysis_result['thoughts']
+        code_improve = analysis_result['code_improve']
+        if is_pass:
+            self.log_manager.append_log("agent 判断数据满足需求，返回结果")
+            return True, None
+        feedback = thoughts + code_improve
+        self.log_manager.append_log(f"agent 分析结果并提出修改建议:\n {feedback} \n--------------------------------")
+        return False, feedback
+
+    @staticmethod
+    def _pick_longest_result(historical_results: list):
+        """达到最大迭代次数时，返回数据量最大的结果，有成功结果时不返回执行出错的结果"""
+        succeeded = [result for result in historical_results
+                     if not (isinstance(result, dict) and 'error' in result)]
+        return max(succeeded or historical_results, key=result_size)
+
+    def _candidate_temperatures(self) -> list:
+        """本轮各候选代码使用的温度"""
+        return [self.candidate_temperatures[i % len(self.candidate_temperatures)]
+                for i in range(self.speculative_candidates)]
+
+    def _prejudge(self, result, query_text: str):
+        """本地规则预判，结果明显不合格时返回改进建议，否则返回None"""
+        if not self.use_prejudge:
+            return None
+        verdict, feedback = prejudge_result(result, query_text)
+        if verdict is False:
+            self.log_manager.append_log(f"agent 本地预判结果不满足需求，跳过LLM分析:\n {feedback} \n--------------------------------")
+            return feedback
+        return None
+
+    def _accept_candidate(self, code: str, result, iteration: int, historical_results: list,
+                          historical_fingerprints: set) -> bool:
+        """记录候选代码的执行结果，与历史结果重复时返回False"""
+        self.log_manager.append_log(f"agent 第{iteration}次生成执行代码:\n {code} \n--------------------------------")
+        fingerprint = result_fingerprint(result)
+        if fingerprint in historical_fingerprints:
+            return False
+        historical_results.append(result)
+        historical_fingerprints.add(fingerprint)
+        return True
+
+    def _generate_and_execute(self, messages: list, temperature: float):
+        """生成一份候选代码并执行"""
+        response = self.model.chat_model(messages, temperature=temperature)
+        code = get_code_fromat(response)
+        return code, self._execute_code(code)
+
+    def _judge(self, doc_api: str, result, code: str):
+        """调用LLM判断执行结果是否满足需求"""
+        messages = self._build_analysis_messages(doc_api, result, code)
+        return self._parse_analysis(self.model.chat_model(messages, cache_ttl=ANALYSIS_CACHE_TTL))
+
+    def _run_round(self, messages: list, doc_api: str, query_text: str, iteration: int,
+                   historical_results: list, historical_fingerprints: set):
+        """
+        执行一轮生成、执行和判断
+        同时生成多份候选代码，每份执行完成后立即判断，采用第一个通过的结果；
+        明显不合格的结果（执行出错、数据为空等）由本地规则给出改进建议，不调用LLM。
+
+        Returns:
+            tuple: (状态, 代码, 结果, 改进建议)，状态为 pass / fail / duplicate
+        """
+        temperatures = self._candidate_temperatures()
+        state = _RoundState(self, len(temperatures), query_text, iteration, historical_results, historical_fingerprints)
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=min(len(temperatures), self.speculative_concurrency))
+        try:
+            # future -> None 表示生成执行任务，(代码, 结果) 表示判断任务
+            pending = {executor.submit(self._generate_and_execute, messages, t): None for t in temperatures}
+            while pending:
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    candidate = pending.pop(future)
+                    if candidate is None:
+                        candidate = state.on_generated(future)
+                        if candidate is not None:
+                            pending[executor.submit(self._judge, doc_api, candidate[1], candidate[0])] = candidate
+                    elif state.on_judged(future, candidate):
+                        return "pass", candidate[0], candidate[1], None
+            return state.outcome()
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _agenerate_and_execute(self, messages: list, temperature: float):
+        """_generate_and_execute 的异步版本"""
+        response = await self.model.achat_model(messages, temperature=temperature)
+        code = get_code_fromat(response)
+        return code, await run_blocking(self._execute_code, code)
+
+    async def _ajudge(self, doc_api: str, result, code: str):
+        """_judge 的异步版本"""
+        messages = self._build_analysis_messages(doc_api, result, code)
+        return self._parse_analysis(await self.model.achat_model(messages, cache_ttl=ANALYSIS_CACHE_TTL))
+
+    async def _arun_round(self, messages: list, doc_api: str, query_text: str, iteration: int,
+                          historical_results: list, historical_fingerprints: set):
+        """_run_round 的异步版本"""
+        temperatures = self._candidate_temperatures()
+        state = _RoundState(self, len(temperatures), query_text, iteration, historical_results, historical_fingerprints)
+        semaphore = asyncio.Semaphore(self.speculative_concurrency)
+
+        async def _generate_and_execute(temperature):
+            async with semaphore:
+                return await self._agenerate_and_execute(messages, temperature)
+
+        pending = {asyncio.ensure_future(_generate_and_execute(t)): None for t in temperatures}
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    candidate = pending.pop(future)
+                    if candidate is None:
+                        candidate = state.on_generated(future)
+                        if candidate is not None:
+                            pending[asyncio.ensure_future(self._ajudge(doc_api, candidate[1], candidate[0]))] = candidate
+                    elif state.on_judged(future, candidate):
+                        return "pass", candidate[0], candidate[1], None
+            return state.outcome()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def _get_code_cache_entry(self, user_query: str, doc_api: str, template_params):
+        """
+        计算查询对应的代码缓存条目
+
+        Returns:
+            tuple: (缓存, 缓存键, 查询模板, 规范化参数)，不使用缓存时返回None
+        """
+        if not template_params or not self.use_code_cache:
+            return None
+        try:
+            cache = self.code_cache or get_default_code_cache()
+        except Exception as e:
+            self.log_manager.append_log(f"代码缓存不可用: {e}\n--------------------------------")
+            return None
+        # 只保留在查询语句中出现的参数
+        params = {name: values for name, values in normalize_params(template_params).items()
+                  if values[0] and values[0] in user_query}
+        if not params:
+            return None
+        key, query_template = cache.make_key(user_query, doc_api, params)
+        return cache, key, query_template, params
+
+    def _load_cached_code(self, entry):
+        """读取并填充缓存的代码，没有可用代码时返回None"""
+        if entry is None:
+            return None
+        cache, key, query_template, params = entry
+        template = cache.get(key)
+        if template is None:
+            return None
+        code = render_code(template, params)
+        if code is not None:
+            self.log_manager.append_log(f"agent 复用查询模板「{query_template}」已通过的代码:\n {code} \n--------------------------------")
+        return code
+
+    def _check_cached_result(self, entry, result, query_text: str) -> bool:
+        """检查缓存代码的执行结果，不合格时删除该缓存并返回False"""
+        verdict, feedback = prejudge_result(result, query_text)
+        if verdict is False:
+            cache, key, _, _ = entry
+            cache.delete(key)
+            self.log_manager.append_log(f"agent 缓存代码执行结果不满足需求，改为重新生成代码: {feedback}\n--------------------------------")
+            return False
+        return True
+
+    def _remember_code(self, entry, code: str):
+        """保存通过判断的代码，代码中没有出现全部模板参数时不缓存"""
+        if entry is None:
+            return
+        cache, key, query_template, params = entry
+        template = parameterize_code(code, params)
+        if template is not None:
+            cache.put(key, query_template, template)
+
+    def _reflection_cycle(self, user_query: str, rewrite_query: str, doc_api: str, max_iterations: int):
+        """
+        一次反思循环：根据上一轮的代码、结果和改进建议生成下一轮的prompt，直到结果通过或达到最大迭代次数
+        同步和异步版本共用这个生成器，每轮产出 _run_round 的参数，并接收该轮的执行结果
+
+        Returns:
+            tuple: (结果, 通过判断的代码)；出现重复结果时结果为None，未通过判断时代码为None，
+                   达到最大迭代次数时结果为数据量最大的结果
+        """
+        self.log_manager.append_log(f"agent 开始执行数据获取代码")
+
+        current_time = self._get_current_time()
+        query_text = f"{user_query}\n{rewrite_query}"
+        
+        # 初始化变量
+        current_code = None
+        current_result = None
+        analysis_result = None
+        iteration = 0
+        historical_results = []
+        historical_fingerprints = set()
+        
+        while iteration < max_iterations:
+            # 生成、执行并判断候选代码
+            messages = self._build_code_messages(user_query, rewrite_query, doc_api, current_time,
+                                                 current_code, current_result, analysis_result)
+            status, code, result, feedback = yield (messages, doc_api, query_text, iteration,
+                                                    historical_results, historical_fingerprints)
+            
+            # 检查重复结果
+            if status == "duplicate":
+                self.log_manager.append_log("agent 检测到重复结果，重新开始查询流程")
+                return None, None
+            
+            current_code, current_result, analysis_result = code, result, feedback
+            if status == "pass":
+                return current_result, current_code
+            iteration += 1
+        
+        # 达到最大迭代次数，返回最长结果
+        return self._pick_longest_result(historical_results), None
+
     def generate_and_execute_data_fetch_code(self, 
                                 user_query: str,
                                 rewrite_query: str,
                                 doc_api: str,
                                 max_iterations: int = 3,
-                                max_retries: int = 3) -> Dict[str, Any]:
+                                max_retries: int = 3,
+                                template_params: dict = None) -> Dict[str, Any]:
         """
         生成并执行数据获取代码，支持反思和重试机制
         
@@ -57,81 +420,31 @@ class DataFetchAgent:
             doc_api: API文档
             max_iterations: 最大迭代次数
             max_retries: 最大重试次数
+            template_params: 查询模板参数，如 {"stock": ("平安银行", "000001"), "start_date": "20240101"}，
+                             提供时优先复用相同模板已通过的代码
             
         Returns:
             Dict: 执行结果
         """
         def _execute_reflection_cycle():
-            self.log_manager.append_log(f"agent 开始执行数据获取代码")
+            cycle = self._reflection_cycle(user_query, rewrite_query, doc_api, max_iterations)
+            try:
+                round_args = next(cycle)
+                while True:
+                    round_args = cycle.send(self._run_round(*round_args))
+            except StopIteration as stop:
+                result, passed_code = stop.value
+            if passed_code is not None:
+                self._remember_code(cache_entry, passed_code)
+            return result
 
-            current_time = self._get_current_time()
-            
-            # 初始化变量
-            current_code = None
-            current_result = None
-            analysis_result = None
-            iteration = 0
-            historical_results = []
-            
-            while iteration < max_iterations:
-                # 生成代码
-                if current_code is None:
-                    prompt = data_fetch_code_prompt.format(
-                        user_query=user_query,
-                        rewrite_user_query=rewrite_query,
-                        data_api_doc=doc_api,
-                        current_time=current_time
-                    )
-                else:
-                    prompt = data_fetch_reflection_code_prompt.format(
-                        data_api_doc=doc_api,
-                        history_code=current_code,
-                        current_result=str(current_result)[:1000],
-                        analysis_result=analysis_result,
-                        current_time=current_time
-                    )
-                
-                messages = [{"role": "user", "content": prompt}]
-                result = self.model.chat_model(messages)
-                current_code = get_code_fromat(result)
-                self.log_manager.append_log(f"agent 第{iteration}次生成执行代码:\n {current_code} \n--------------------------------")
-                
-                # 执行代码
-                current_result = self._execute_code(current_code)
-                
-                # 检查重复结果
-                result_str = str(current_result)
-                if result_str in [str(r) for r in historical_results]:
-                    self.log_manager.append_log("agent 检测到重复结果，重新开始查询流程")
-                    return None
-                
-                historical_results.append(current_result)
-                
-                # 分析结果
-                analysis_prompt = data_fetch_reflection_analysis_prompt.format(
-                    data_api_doc=doc_api,
-                    current_result=str(current_result)[:1000],
-                    current_code=current_code
-                )
-                
-                messages = [{"role": "user", "content": analysis_prompt}]
-                analysis_response = self.model.chat_model(messages)
-                analysis_result = json_repair.loads(analysis_response)['result']
-                is_pass = analysis_result['is_pass']
-                thoughts = analysis_result['thoughts']
-                code_improve = analysis_result['code_improve']
-                
-                if is_pass:
-                    self.log_manager.append_log("agent 判断数据满足需求，返回结果")
-                    return current_result
-                else:
-                    analysis_result = thoughts + code_improve
-                    self.log_manager.append_log(f"agent 分析结果并提出修改建议:\n {analysis_result} \n--------------------------------")
-                iteration += 1
-            
-            # 达到最大迭代次数，返回最长结果
-            max_len = max(len(str(result)) for result in historical_results)
-            return [result for result in historical_results if len(str(result)) == max_len][0]
+        # 优先复用相同查询模板已通过的代码
+        cache_entry = self._get_code_cache_entry(user_query, doc_api, template_params)
+        cached_code = self._load_cached_code(cache_entry)
+        if cached_code is not None:
+            result = self._execute_code(cached_code)
+            if self._check_cached_result(cache_entry, result, f"{user_query}\n{rewrite_query}"):
+                return result
 
         # 主循环，支持重试
         retry_count = 0
@@ -143,4 +456,59 @@ class DataFetchAgent:
             self.log_manager.append_log(f"agent 开始第 {retry_count + 1} 次重试...")
         
         self.log_manager.append_log("agent 达到最大重试次数，返回最后一次结果")
-        return _execute_reflection_cycle()  # 最后一次尝试 
\ No newline at end of file
+        return _execute_reflection_cycle()  # 最后一次尝试
+
+    async def agenerate_and_execute_data_fetch_code(self,
+                                user_query: str,
+                                rewrite_query: str,
+                                doc_api: str,
+                                max_iterations: int = 3,
+                                max_retries: int = 3,
+                                template_params: dict = None) -> Dict[str, Any]:
+        """
+        generate_and_execute_data_fetch_code 的异步版本
+        LLM调用走异步客户端，代码执行放到线程中，不阻塞事件循环
+        
+        Args:
+            user_query: 用户查询
+            rewrite_query: 重写后的查询
+            doc_api: API文档
+            max_iterations: 最大迭代次数
+            max_retries: 最大重试次数
+            template_params: 查询模板参数，如 {"stock": ("平安银行", "000001"), "start_date": "20240101"}，
+                             提供时优先复用相同模板已通过的代码
+            
+        Returns:
+            Dict: 执行结果
+        """
+        async def _execute_reflection_cycle():
+            cycle = self._reflection_cycle(user_query, rewrite_query, doc_api, max_iterations)
+            try:
+                round_args = next(cycle)
+                while True:
+                    round_args = cycle.send(await self._arun_round(*round_args))
+            except StopIteration as stop:
+                result, passed_code = stop.value
+            if passed_code is not None:
+                await run_blocking(self._remember_code, cache_entry, passed_code)
+            return result
+
+        # 优先复用相同查询模板已通过的代码，代码缓存的SQLite读写放到线程池执行
+        cache_entry = await run_blocking(self._get_code_cache_entry, user_query, doc_api, template_params)
+        cached_code = await run_blocking(self._load_cached_code, cache_entry)
+        if cached_code is not None:
+            result = await run_blocking(self._execute_code, cached_code)
+            if await run_blocking(self._check_cached_result, cache_entry, result, f"{user_query}\n{rewrite_query}"):
+                return result
+
+        # 主循环，支持重试
+        retry_count = 0
+        while retry_count < max_retries:
+            result = await _execute_reflection_cycle()
+            if result is not None:
+                return result
+            retry_count += 1
+            self.log_manager.append_log(f"agent 开始第 {retry_count + 1} 次重试...")
+        
+        self.log_manager.append_log("agent 达到最大重试次数，返回最后一次结果")
+        return await _execute_reflection_cycle()  # 最后一次尝试
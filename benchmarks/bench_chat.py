@@ -0,0 +1,150 @@
+"""
+聊天接口并发基准测试
+
+启动一个模拟的 OpenAI 兼容服务（每次调用固定延迟、流式逐段输出），
+用模拟的向量检索（阻塞等待）和进程内代码执行跑完整的 ChatManager 流程，
+比较 1 个聊天和 N 个并发聊天的总耗时，以及期间事件循环的最大卡顿时间。
+事件循环不被阻塞时，N 个并发聊天的耗时应接近 1 个聊天。
+
+用法:
+    python benchmarks/bench_chat.py --concurrency 8 --delay 0.3
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+from agent.chat_manager import ChatManager
+from agent.query import QueryAgent
+from llm.api.func_get_openai import OpenaiApi
+from log_manager import SyncLogManager
+
+
+def create_fake_llm(delay: float) -> FastAPI:
+    """模拟的 OpenAI 兼容服务，根据prompt内容返回固定回复"""
+    app = FastAPI()
+
+    def answer(content: str) -> str:
+        if "判断用户问题是否需要查询数据" in content:
+            return '{"result":{"thoughts":"需要数据","is_need_data":true,"query_list":["近期走势"]}}'
+        if "重写用户问题" in content:
+            return "需要用到的数据是：日线行情，需要查询的主体是：平安银行(000001)"
+        if "请输出代码" in content:
+            return f"```python\nimport time\ntime.sleep({delay})\nresult = {{'收盘': [10.1, 10.3, 10.2]}}\n```"
+        if "is_pass" in content:
+            return '{"result":{"thoughts":"数据满足需求","is_pass":true,"code_improve":""}}'
+        return "根据查询到的数据，该股票近期走势平稳，收盘价在10元附近小幅波动。" * 3
+
+    @app.post("/v1/chat/completions")
+    async def chat(request: Request):
+        body = await request.json()
+        text = answer("\n".join(m["content"] for m in body["messages"]))
+        await asyncio.sleep(delay)
+        if not body.get("stream"):
+            return {"id": "bench", "object": "chat.completion", "created": 0, "model": body["model"],
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}]}
+
+        async def stream():
+            for i in range(0, len(text), 8):
+                chunk = {"id": "bench", "object": "chat.completion.chunk", "created": 0, "model": body["model"],
+                         "choices": [{"index": 0, "delta": {"content": text[i:i + 8]}, "finish_reason": None}]}
+                yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                await asyncio.sleep(0.01)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return app
+
+
+class FakeIndex:
+    """模拟的向量检索，search 阻塞等待，相当于同步调用embedding接口"""
+
+    def __init__(self, delay: float):
+        self.delay = delay
+
+    def get_titles(self):
+        return "股票日线行情"
+
+    def search(self, query, top_k=10):
+        time.sleep(self.delay)
+        return ["stock_zh_a_hist: 日线行情数据"]
+
+
+def start_server(app: FastAPI) -> str:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="error"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f"http://127.0.0.1:{port}/v1"
+
+
+async def run_chat(agent: QueryAgent, index: int) -> int:
+    """跑一次完整的聊天流程，返回收到的回复片段数"""
+    manager = ChatManager(agent)
+    chunks = 0
+    async for _ in manager.process_message_async(f"第{index}个用户：平安银行最近走势怎么样？", "平安银行"):
+        chunks += 1
+    return chunks
+
+
+async def measure(agent: QueryAgent, concurrency: int) -> dict:
+    """并发跑多个聊天，同时记录事件循环的最大卡顿时间"""
+    max_lag = 0.0
+    stopped = asyncio.Event()
+
+    async def monitor():
+        nonlocal max_lag
+        interval = 0.01
+        while not stopped.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            max_lag = max(max_lag, time.perf_counter() - start - interval)
+
+    monitor_task = asyncio.create_task(monitor())
+    start = time.perf_counter()
+    chunks = await asyncio.gather(*[run_chat(agent, i) for i in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    stopped.set()
+    await monitor_task
+    return {"concurrency": concurrency, "seconds": elapsed, "max_loop_lag": max_lag, "chunks": sum(chunks)}
+
+
+async def main(args):
+    base_url = start_server(create_fake_llm(args.delay))
+    log_dir = tempfile.mkdtemp(prefix="bench_chat_")
+    agent = QueryAgent(
+        model=OpenaiApi(api_key="bench", base_url=base_url, model="bench"),
+        log_manager=SyncLogManager(os.path.join(log_dir, "chat_logs.txt")),
+        index=FakeIndex(args.delay),
+        code_agent_options={"use_sandbox": False, "use_code_cache": False}
+    )
+    # 预热连接
+    await run_chat(agent, -1)
+    single = await measure(agent, 1)
+    concurrent = await measure(agent, args.concurrency)
+    for item in (single, concurrent):
+        print(f"并发 {item['concurrency']:>3}: 总耗时 {item['seconds']:.2f}s，"
+              f"事件循环最大卡顿 {item['max_loop_lag'] * 1000:.1f}ms，回复片段 {item['chunks']}")
+    print(f"耗时比例: {concurrent['seconds'] / single['seconds']:.2f}x（理想值接近1）")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="聊天接口并发基准测试")
+    parser.add_argument("--concurrency", type=int, default=8, help="并发聊天数")
+    parser.add_argument("--delay", type=float, default=0.3, help="每次LLM调用、检索和代码执行的模拟延迟（秒）")
+    asyncio.run(main(parser.parse_args()))
@@ -93,6 +93,8 @@ ${stockName ? `目前已选择股票：${stockName}` : '请先选择一个股票
   const [inputMessage, setInputMessage] = useState('');
   const [isLoading, setIsLoading] = useState(false);
   const messagesEndRef = useRef<HTMLDivElement>(null);
+  // 每个聊天窗口使用独立的会话ID，服务端按会话保存聊天历史
+  const sessionIdRef = useRef(`${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`);
   const [currentAssistantMessage, setCurrentAssistantMessage] = useState('');
   const [analysisTabs, setAnalysisTabs] = useState<AnalysisTab[]>([]);
   const [activeTab, setActiveTab] = useState(0);
@@ -139,7 +141,8 @@ ${stockName ? `目前已选择股票：${stockName}` : '请先选择一个股票
         body: JSON.stringify({
           message: userMessage,
           stock_name: stockName,
-          chat_model: 'deepseek-chat'
+          chat_model: 'deepseek-chat',
+          session_id: sessionIdRef.current
         }),
       });
 
@@ -14,6 +14,7 @@ export interface ChatRequest {
   message: string;
   stock_name: string;
   chat_history: ChatMessage[];
+  session_id?: string;
 }
 
 export interface ApiResponse<T> {
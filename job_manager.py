@@ -0,0 +1,206 @@
+import time
+import uuid
+import asyncio
+import itertools
+import traceback
+from collections import OrderedDict
+from typing import Any, AsyncGenerator, Awaitable, Callable, Dict, Optional
+
+# 任务状态
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+FINISHED_STATUSES = (JOB_SUCCEEDED, JOB_FAILED)
+
+
+class QueueFullError(Exception):
+    """任务队列已满，需要稍后重试"""
+
+
+class Job:
+    def __init__(self, params: dict, priority: int = 0):
+        """
+        初始化后台任务
+
+        Args:
+            params: 任务参数
+            priority: 优先级，数值越小越先执行
+        """
+        self.job_id = uuid.uuid4().hex
+        self.params = params
+        self.priority = priority
+        self.status = JOB_QUEUED
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.result = None
+        self.error = None
+        # 进度事件列表，订阅者从任意位置开始读取
+        self.events = []
+        self._changed = asyncio.Event()
+
+    def add_event(self, event: str, data: Optional[dict] = None):
+        """记录一条进度事件并唤醒订阅者，需要在事件循环所在线程中调用"""
+        self.events.append({"event": event, "data": data or {}, "time": time.time()})
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def subscribe(self) -> AsyncGenerator[dict, None]:
+        """按顺序产出全部进度事件，任务结束后停止"""
+        index = 0
+        while True:
+            while index < len(self.events):
+                yield self.events[index]
+                index += 1
+            if self.status in FINISHED_STATUSES:
+                return
+            await self._changed.wait()
+
+    def to_dict(self, include_result: bool = True) -> dict:
+        """转为接口返回的字典"""
+        info = {
+            "job_id": self.job_id,
+            "status": self.status,
+            "params": self.params,
+            "priority": self.priority,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "progress": self.events[-1] if self.events else None,
+            "error": self.error,
+        }
+        if include_result:
+            info["result"] = self.result
+        return info
+
+
+class JobManager:
+    def __init__(self, runner: Callable[[Job, Callable[[str, dict], None]], Awaitable[Any]],
+                 workers: int = 2, max_queue: int = 32, max_finished: int = 500, finished_ttl: float = 3600):
+        """
+        初始化后台任务管理器
+        固定数量的工作协程从优先级队列中取任务执行，同时执行的任务数由workers决定，
+        排队的任务超过max_queue时拒绝新任务。
+
+        Args:
+            runner: 执行任务的异步函数 runner(job, progress)，progress(event, data) 用于上报进度，
+                可以在工作线程中调用
+            workers: 工作协程数量
+            max_queue: 排队任务数上限
+            max_finished: 最多保留的已结束任务数
+            finished_ttl: 已结束任务的保留时间（秒）
+        """
+        self.runner = runner
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self.max_finished = max_finished
+        self.finished_ttl = finished_ttl
+        self.jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._queue = None
+        self._tasks = []
+        self._counter = itertools.count()
+        self._loop = None
+
+    def start(self):
+        """在当前事件循环中启动工作协程"""
+        if self._tasks:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.PriorityQueue()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def shutdown(self):
+        """停止工作协程，正在执行的任务会被取消"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def queued_count(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def _prune(self):
+        """清理过期的已结束任务"""
+        now = time.time()
+        finished = [job for job in self.jobs.values() if job.status in FINISHED_STATUSES]
+        overflow = len(finished) - self.max_finished
+        for job in finished:
+            if overflow > 0 or now - job.finished_at > self.finished_ttl:
+                del self.jobs[job.job_id]
+                overflow -= 1
+
+    def submit(self, params: dict, priority: int = 0) -> Job:
+        """
+        提交任务
+
+        Raises:
+            QueueFullError: 排队任务数已达上限
+        """
+        if not self._tasks:
+            raise RuntimeError("任务管理器尚未启动")
+        if self.queued_count() >= self.max_queue:
+            raise QueueFullError(f"排队任务数已达上限{self.max_queue}")
+        self._prune()
+        job = Job(params, priority)
+        self.jobs[job.job_id] = job
+        self._queue.put_nowait((priority, next(self._counter), job.job_id))
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self.jobs.get(job_id)
+
+    def stats(self) -> Dict[str, int]:
+        """获取各状态的任务数"""
+        counts = {JOB_QUEUED: 0, JOB_RUNNING: 0, JOB_SUCCEEDED: 0, JOB_FAILED: 0}
+        for job in self.jobs.values():
+            counts[job.status] += 1
+        return {**counts, "workers": self.workers, "max_queue": self.max_queue}
+
+    def _make_progress(self, job: Job) -> Callable[[str, dict], None]:
+        """生成进度回调，回调可能在工作线程中调用，统一切回事件循环记录"""
+        loop = self._loop
+
+        def progress(event: str, data: dict = None):
+            try:
+                running_loop = asyncio.get_running_loop()
+            except RuntimeError:
+                running_loop = None
+            if running_loop is loop:
+                job.add_event(event, data)
+            else:
+                loop.call_soon_threadsafe(job.add_event, event, data)
+
+        return progress
+
+    def _finish(self, job: Job, status: str, result: Any = None, error: str = None):
+        """记录任务结果，状态和结束事件同时更新，订阅者总能读到结束事件"""
+        job.result = result
+        job.error = error
+        job.finished_at = time.time()
+        job.status = status
+        if status == JOB_SUCCEEDED:
+            job.add_event("done")
+        else:
+            job.add_event("failed", {"error": error})
+
+    async def _worker(self):
+        while True:
+            _, _, job_id = await self._queue.get()
+            job = self.jobs.get(job_id)
+            if job is None:
+                continue
+            job.status = JOB_RUNNING
+            job.started_at = time.time()
+            job.add_event("started")
+            try:
+                result = await self.runner(job, self._make_progress(job))
+            except asyncio.CancelledError:
+                self._finish(job, JOB_FAILED, error="任务已取消")
+                raise
+            except Exception as e:
+                print(f"后台任务 {job_id} 执行失败: {str(e)}")
+                traceback.print_exc()
+                self._finish(job, JOB_FAILED, error=str(e))
+            else:
+                self._finish(job, JOB_SUCCEEDED, result=result)
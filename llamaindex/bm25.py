@@ -0,0 +1,143 @@
+import re
+import math
+from collections import Counter
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+try:
+    import jieba
+    jieba.setLogLevel(60)
+except ImportError:
+    jieba = None
+
+# akshare 文档中 "接口: stock_zh_a_hist" 形式的接口名
+INTERFACE_PATTERN = re.compile(r'接口[:：]\s*([A-Za-z_][A-Za-z0-9_]*)')
+ASCII_TOKEN_PATTERN = re.compile(r'[A-Za-z0-9_]+')
+CJK_RUN_PATTERN = re.compile(r'[\u4e00-\u9fff]+')
+
+
+def tokenize(text: str) -> List[str]:
+    """中英文混合分词
+    英文/数字按单词切分，带下划线的接口名同时保留整体和各个部分；
+    中文安装了 jieba 时使用搜索引擎模式分词，否则退化为单字加二元组。
+    Args:
+        text (str): 待分词文本
+    Returns:
+        list: 词项列表
+    """
+    tokens = []
+    for word in ASCII_TOKEN_PATTERN.findall(text):
+        word = word.lower()
+        tokens.append(word)
+        if '_' in word:
+            tokens.extend(part for part in word.split('_') if part)
+
+    for run in CJK_RUN_PATTERN.findall(text):
+        if jieba is not None:
+            tokens.extend(jieba.lcut_for_search(run))
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class BM25Index:
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        """初始化BM25倒排索引
+        Args:
+            k1 (float): 词频饱和参数
+            b (float): 文档长度归一化参数
+        """
+        self.k1 = k1
+        self.b = b
+        self.size = 0
+        # 词项 -> (文档行号数组, 预先算好的BM25权重数组)
+        self.postings: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        # 接口名 -> 文档行号列表
+        self.interfaces: Dict[str, List[int]] = {}
+
+    def build(self, texts: List[str]):
+        """根据文本列表构建倒排索引，行号与列表下标一致
+        Args:
+            texts (list): 完整文本列表
+        """
+        self.size = len(texts)
+        doc_lens = np.zeros(self.size, dtype=np.float32)
+        raw_postings: Dict[str, Tuple[List[int], List[int]]] = {}
+        self.interfaces = {}
+
+        for row, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            doc_lens[row] = sum(counts.values())
+            for token, tf in counts.items():
+                rows, tfs = raw_postings.setdefault(token, ([], []))
+                rows.append(row)
+                tfs.append(tf)
+            for name in INTERFACE_PATTERN.findall(text):
+                self.interfaces.setdefault(name.lower(), []).append(row)
+
+        avgdl = float(doc_lens.mean()) if self.size else 0.0
+        self.postings = {}
+        for token, (rows, tfs) in raw_postings.items():
+            rows = np.asarray(rows, dtype=np.int64)
+            tfs = np.asarray(tfs, dtype=np.float32)
+            df = len(rows)
+            idf = math.log(1 + (self.size - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * doc_lens[rows] / max(avgdl, 1e-6))
+            self.postings[token] = (rows, (idf * tfs * (self.k1 + 1) / (tfs + norm)).astype(np.float32))
+
+    def match_interfaces(self, query: str) -> List[int]:
+        """查找查询中精确出现的接口名
+        Args:
+            query (str): 查询文本
+        Returns:
+            list: 命中接口所在的文档行号
+        """
+        rows = []
+        for word in ASCII_TOKEN_PATTERN.findall(query):
+            for row in self.interfaces.get(word.lower(), []):
+                if row not in rows:
+                    rows.append(row)
+        return rows
+
+    def search(self, query: str, top_k: int = 10) -> List[Tuple[int, float]]:
+        """BM25检索
+        Args:
+            query (str): 查询文本
+            top_k (int): 返回结果数量
+        Returns:
+            list: 按得分降序排列的 (行号, 得分) 列表，不含零分文档
+        """
+        if self.size == 0 or top_k <= 0:
+            return []
+        scores = np.zeros(self.size, dtype=np.float32)
+        for token in set(tokenize(query)):
+            posting = self.postings.get(token)
+            if posting is not None:
+                rows, weights = posting
+                scores[rows] += weights
+
+        k = min(top_k, self.size)
+        if k < self.size:
+            rows = np.argpartition(-scores, k - 1)[:k]
+        else:
+            rows = np.arange(self.size)
+        rows = rows[np.argsort(-scores[rows])]
+        return [(int(row), float(scores[row])) for row in rows if scores[row] > 0]
+
+
+def reciprocal_rank_fusion(rankings: List[List[int]], k: int = 60) -> List[int]:
+    """倒数排名融合
+    Args:
+        rankings (list): 多路检索各自的行号排名
+        k (int): 平滑常数
+    Returns:
+        list: 融合后的行号排名
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking):
+            fused[row] = fused.get(row, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(fused, key=lambda row: fused[row], reverse=True)
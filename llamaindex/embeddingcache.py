@@ -0,0 +1,102 @@
+import os
+import sqlite3
+import hashlib
+import threading
+from array import array
+from typing import Dict, List
+
+DEFAULT_EMBEDDING_CACHE_PATH = os.path.join('.embedding_cache', 'embeddings.sqlite')
+
+
+class EmbeddingCache:
+    def __init__(self, cache_path: str = DEFAULT_EMBEDDING_CACHE_PATH):
+        """初始化embedding缓存
+        以 (嵌入模型, 规范化文本哈希) 为键把向量按float32存入SQLite，
+        与索引目录无关，多个进程可以同时读写同一个缓存文件。
+        Args:
+            cache_path (str): SQLite缓存文件路径
+        """
+        self.cache_path = cache_path
+        dir_path = os.path.dirname(cache_path)
+        if dir_path and not os.path.exists(dir_path):
+            os.makedirs(dir_path, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(cache_path, timeout=30, check_same_thread=False)
+        with self._lock:
+            # WAL模式下读写互不阻塞，适合多进程共享
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model TEXT NOT NULL, "
+                "text_hash TEXT NOT NULL, "
+                "vector BLOB NOT NULL, "
+                "PRIMARY KEY (model, text_hash)) WITHOUT ROWID"
+            )
+            self._conn.commit()
+
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        """规范化文本：合并连续空白并去除首尾空白"""
+        return " ".join(text.split())
+
+    @classmethod
+    def text_hash(cls, text: str) -> str:
+        """计算规范化文本的 MD5 哈希值"""
+        return hashlib.md5(cls.normalize_text(text).encode('utf-8')).hexdigest()
+
+    def get_many(self, model: str, texts: List[str], chunk_size: int = 500) -> Dict[int, List[float]]:
+        """批量读取缓存
+        Args:
+            model (str): 嵌入模型名称
+            texts (list): 文本列表
+            chunk_size (int): 单条SQL查询的最大键数量
+        Returns:
+            dict: 命中的 {文本下标: 向量}
+        """
+        hash_to_indices = {}
+        for i, text in enumerate(texts):
+            hash_to_indices.setdefault(self.text_hash(text), []).append(i)
+
+        hits = {}
+        hashes = list(hash_to_indices)
+        with self._lock:
+            for start in range(0, len(hashes), chunk_size):
+                chunk = hashes[start:start + chunk_size]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *chunk]
+                ).fetchall()
+                for text_hash, blob in rows:
+                    vector = array('f')
+                    vector.frombytes(blob)
+                    vector = vector.tolist()
+                    for i in hash_to_indices[text_hash]:
+                        hits[i] = vector
+        return hits
+
+    def put_many(self, model: str, texts: List[str], embeddings: List[List[float]]):
+        """批量写入缓存
+        Args:
+            model (str): 嵌入模型名称
+            texts (list): 文本列表
+            embeddings (list): 与文本一一对应的向量列表
+        """
+        rows = [
+            (model, self.text_hash(text), array('f', embedding).tobytes())
+            for text, embedding in zip(texts, embeddings)
+        ]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
@@ -1,8 +1,14 @@
 import os
+import time
+import threading
 
 
 from llama_index.core import VectorStoreIndex, Document,StorageContext,load_index_from_storage,Settings
 from llamaindex.instructionembedding import InstructionEmbedding
+from llamaindex.embeddingcache import DEFAULT_EMBEDDING_CACHE_PATH
+from llamaindex.vectorengine import NumpyVectorEngine
+from llamaindex.bm25 import BM25Index, reciprocal_rank_fusion
+from llamaindex.querycache import QueryCache, normalize_query
 from predata.get_rag_doc import RagDocProcessor
 
 import re
@@ -15,9 +21,19 @@ def extract_description(text):
         return match.group(1).strip()
     return None
 
+# 可选的向量检索后端，"llama_index" 表示使用 llama_index 默认的检索器
+VECTOR_BACKENDS = {
+    "numpy": NumpyVectorEngine,
+}
+# 向量引擎二进制索引在索引目录下的子目录名
+VECTOR_ENGINE_DIR = 'vector_engine'
+
 class IndexStore:
     def __init__(self, embedding_model_name="embedding-2", index_dir='.llama_index', 
-                 update_rag_doc=False, api_key=None, base_url=None):
+                 update_rag_doc=False, api_key=None, base_url=None,
+                 embedding_cache_path=DEFAULT_EMBEDDING_CACHE_PATH, vector_backend="numpy",
+                 search_mode="hybrid", bm25_confidence_ratio=2.0,
+                 query_cache_size=1024, query_cache_ttl=600):
         """初始化索引存储
         Args:
             embedding_model_name (str): 嵌入模型名称
@@ -25,13 +41,36 @@ class IndexStore:
             update_rag_doc (bool): 是否更新 RAG 文档
             api_key (str, optional): API密钥
             base_url (str, optional): 基础URL
+            embedding_cache_path (str, optional): embedding缓存文件路径，为None时不使用缓存
+            vector_backend (str): 向量检索后端，"numpy" 或 "llama_index"
+            search_mode (str): 检索模式，"vector" 仅向量检索，"hybrid" 为BM25与向量检索融合
+            bm25_confidence_ratio (float): BM25第一名得分超过第二名的倍数达到该值时，直接使用关键词结果
+            query_cache_size (int): 查询向量和检索结果缓存的最大条目数
+            query_cache_ttl (float): 查询缓存有效期（秒）
         """
+        if vector_backend != "llama_index" and vector_backend not in VECTOR_BACKENDS:
+            raise ValueError(f"Unsupported vector backend: {vector_backend}")
+        if search_mode not in ("vector", "hybrid"):
+            raise ValueError(f"Unsupported search mode: {search_mode}")
+
         # 初始化嵌入模型
-        Settings.embed_model = InstructionEmbedding(
+        self.embed_model = InstructionEmbedding(
             model_name=embedding_model_name,
             api_key=api_key,
-            base_url=base_url
+            base_url=base_url,
+            cache_path=embedding_cache_path
         )
+        Settings.embed_model = self.embed_model
+        self.vector_backend = vector_backend
+        self.search_mode = search_mode
+        self.bm25_confidence_ratio = bm25_confidence_ratio
+        # BM25索引在首次混合检索时基于向量引擎中的完整文本构建
+        self.bm25 = None
+        self._bm25_lock = threading.Lock()
+        # 查询向量与索引内容无关，只按查询文本缓存；检索结果随索引内容版本失效
+        self.query_embedding_cache = QueryCache(max_entries=query_cache_size, ttl=query_cache_ttl)
+        self.retrieval_cache = QueryCache(max_entries=query_cache_size, ttl=query_cache_ttl)
+        self.content_version = 0
         
         self.index_dir = index_dir
         self.processor = RagDocProcessor(history_nums=None)
@@ -40,9 +79,22 @@ class IndexStore:
         # 初始化文档变更列表
         self.add_doc = []
         self.del_doc_ids = []
+        # llama_index 的JSON存储按需加载；只有文档发生变更时才需要重新持久化
+        self._index = None
+        self._dirty = False
 
         self._initialize_index(update_rag_doc)
         self._persist_index()
+        self._build_vector_engine()
+        self._dirty = False
+
+    @property
+    def index(self):
+        """llama_index 索引，首次访问时才从JSON存储加载"""
+        if self._index is None:
+            storage_context = StorageContext.from_defaults(persist_dir=self.index_dir)
+            self._index = load_index_from_storage(storage_context)
+        return self._index
 
     def _process_changes(self, data_list, min_content_length=50):
         """处理文档变更
@@ -77,10 +129,7 @@ class IndexStore:
             self._create_new_index()
 
     def _load_existing_index(self, update_rag_doc):
-        """加载现有索引"""
-        storage_context = StorageContext.from_defaults(persist_dir=self.index_dir)
-        self.index = load_index_from_storage(storage_context)
-        
+        """加载现有索引，没有文档变更时不触碰 llama_index 的JSON存储"""
         if update_rag_doc:
             data_list = self.processor.update_run()
             self._process_changes(data_list)
@@ -90,17 +139,37 @@ class IndexStore:
                 self.index.delete_nodes(self.del_doc_ids)
             if self.add_doc:
                 self.index.insert_nodes(self.add_doc)
+            self._dirty = bool(self.del_doc_ids or self.add_doc)
 
     def _create_new_index(self):
         """创建新索引"""
         data_list = self.processor.update_run(is_new=True)
         self._process_changes(data_list)
-        self.index = VectorStoreIndex(self.add_doc)
+        self._index = VectorStoreIndex(self.add_doc)
         self.add_doc = []  # 清空添加列表
+        self._dirty = True
 
     def _persist_index(self):
-        """持久化索引"""
-        self.index.storage_context.persist(persist_dir=self.index_dir)
+        """持久化索引，只在文档有增删时写盘"""
+        if self._dirty:
+            self.index.storage_context.persist(persist_dir=self.index_dir)
+
+    def _build_vector_engine(self):
+        """根据配置的后端构建向量检索引擎
+        已有二进制索引且文档未变更时直接内存映射加载，否则从 llama_index 导出并保存。
+        """
+        self.bm25 = None
+        self.content_version += 1
+        if self.vector_backend == "llama_index":
+            self.engine = None
+            return
+        engine_cls = VECTOR_BACKENDS[self.vector_backend]
+        engine_dir = os.path.join(self.index_dir, VECTOR_ENGINE_DIR)
+        if not self._dirty and engine_cls.exists(engine_dir):
+            self.engine = engine_cls.load(engine_dir)
+        else:
+            self.engine = engine_cls.from_llama_index(self.index)
+            self.engine.save(engine_dir)
 
     def search(self, query: str, top_k: int = 5) -> list:
         """搜索相关文档
@@ -110,12 +179,86 @@ class IndexStore:
         Returns:
             list: 相关文档列表
         """
+        if self.engine is not None:
+            cache_key = (normalize_query(query), top_k)
+            node_ids = self.retrieval_cache.get(cache_key, version=self.content_version)
+            if node_ids is None:
+                start = time.time()
+                if self.search_mode == "hybrid":
+                    rows = self._hybrid_search(query, top_k)
+                else:
+                    rows = self._vector_search(query, top_k)
+                node_ids = [self.engine.get_id(row) for row in rows]
+                self.retrieval_cache.put(cache_key, node_ids, version=self.content_version, cost=time.time() - start)
+            else:
+                rows = [self.engine.get_row(node_id) for node_id in node_ids]
+            return [self.engine.get_text(row) for row in rows if row is not None]
+
         response = self.index.as_retriever(similarity_top_k=top_k).retrieve(query)
         return [item.node.metadata.get('full_text', '') for item in response]
     
-    def get_titles(self) -> list:
+    def _get_bm25(self) -> BM25Index:
+        """获取BM25索引，首次调用时构建"""
+        if self.bm25 is None:
+            with self._bm25_lock:
+                if self.bm25 is None:
+                    bm25 = BM25Index()
+                    bm25.build([self.engine.get_text(row) for row in range(len(self.engine))])
+                    self.bm25 = bm25
+        return self.bm25
+
+    def _get_query_embedding(self, query: str) -> list:
+        """获取查询向量，优先使用缓存"""
+        cache_key = normalize_query(query)
+        query_embedding = self.query_embedding_cache.get(cache_key)
+        if query_embedding is None:
+            start = time.time()
+            query_embedding = self.embed_model.get_query_embedding(query)
+            self.query_embedding_cache.put(cache_key, query_embedding, cost=time.time() - start)
+        return query_embedding
+
+    def _vector_search(self, query: str, top_k: int) -> list:
+        """向量检索，返回向量引擎中的行号"""
+        query_embedding = self._get_query_embedding(query)
+        return [row for row, _ in self.engine.search(query_embedding, top_k)]
+
+    def _hybrid_search(self, query: str, top_k: int) -> list:
+        """BM25与向量检索融合
+        查询中精确出现接口名，或BM25第一名明显领先，且关键词结果足够top_k条时，只用关键词结果，不调用embedding接口；
+        否则两路结果按倒数排名融合，精确命中的接口始终排在最前。
+        """
+        bm25 = self._get_bm25()
+        candidate_k = max(top_k * 2, 20)
+        exact_rows = bm25.match_interfaces(query)
+        lexical_hits = bm25.search(query, candidate_k)
+        lexical_rows = [row for row, _ in lexical_hits]
+
+        confident = bool(exact_rows)
+        if not confident and lexical_hits:
+            top_score = lexical_hits[0][1]
+            second_score = lexical_hits[1][1] if len(lexical_hits) > 1 else 0.0
+            confident = top_score >= self.bm25_confidence_ratio * second_score
+        if confident:
+            ranked = exact_rows + [row for row in lexical_rows if row not in exact_rows]
+            # 关键词结果不足top_k条时仍用向量检索补足，避免只返回一两条结果
+            if len(ranked) >= top_k:
+                return ranked[:top_k]
+
+        vector_rows = self._vector_search(query, candidate_k)
+        fused = reciprocal_rank_fusion([lexical_rows, vector_rows])
+        ranked = exact_rows + [row for row in fused if row not in exact_rows]
+        return ranked[:top_k]
+
+    def cache_stats(self) -> dict:
+        """获取查询缓存的命中率和节省时间统计"""
+        return {
+            "query_embedding": self.query_embedding_cache.stats(),
+            "retrieval": self.retrieval_cache.stats(),
+        }
+
+    def get_titles(self) -> str:
         """获取所有标题
         Returns:
-            list: 标题列表
+            str: 按文件拼接好的标题目录
         """
         return self.titles
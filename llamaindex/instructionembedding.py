@@ -3,9 +3,14 @@ import concurrent.futures
 from typing import Any, List, Optional
 from pydantic import Field, PrivateAttr
 from llm.api.func_get_openai import OpenaiApi
+from llm.api.retry import classify_error, CLIENT_ERROR
+from llamaindex.embeddingcache import EmbeddingCache
 from llama_index.core.embeddings import BaseEmbedding
 
 DEFAULT_EMBED_BATCH_SIZE = 100
+DEFAULT_EMBED_CONCURRENCY = 4
+# 单条文本被接口拒绝（4xx）时，截断到该长度再试一次
+TRUNCATED_TEXT_CHARS = 1000
 
 class InstructionEmbedding(BaseEmbedding):
     query_instruction: Optional[str] = Field(
@@ -16,10 +21,17 @@ class InstructionEmbedding(BaseEmbedding):
         description="Instruction to prepend to text.",
         default=None
     )
+    embed_concurrency: int = Field(
+        description="Number of embedding batches requested concurrently.",
+        default=DEFAULT_EMBED_CONCURRENCY,
+        gt=0
+    )
     model_name: str
     embedding_type: str = None
     device: Optional[str] = None
     model: Any = None
+    embedding_cache: Any = None
+    _embedding_dim: Optional[int] = PrivateAttr(default=None)
 
     def __init__(
         self, 
@@ -27,13 +39,16 @@ class InstructionEmbedding(BaseEmbedding):
         query_instruction: Optional[str] = None,
         text_instruction: Optional[str] = None,
         embed_batch_size: int = DEFAULT_EMBED_BATCH_SIZE,
+        embed_concurrency: int = DEFAULT_EMBED_CONCURRENCY,
         api_key: Optional[str] = None,
         base_url: Optional[str] = None,
         device: Optional[str] = None,
+        cache_path: Optional[str] = None,
         **kwargs: Any
     ) -> None:
         super().__init__(
             embed_batch_size=embed_batch_size,
+            embed_concurrency=embed_concurrency,
             model_name=model_name,
             query_instruction=query_instruction,
             text_instruction=text_instruction,
@@ -50,6 +65,9 @@ class InstructionEmbedding(BaseEmbedding):
         if base_url is None:
             base_url = os.getenv("openai_base_url")
         self.model = OpenaiApi(api_key=api_key, base_url=base_url)
+        # 配置了缓存路径时，文本embedding先查本地缓存，只对未命中的文本请求API
+        if cache_path:
+            self.embedding_cache = EmbeddingCache(cache_path)
 
     def _format_query_text(self, query_text: str) -> str:
         """Format query text with instruction if provided."""
@@ -114,11 +132,91 @@ class InstructionEmbedding(BaseEmbedding):
         formatted_texts = [self._format_text(text) for text in processed_texts]
         
         if self.embedding_type == "openai":
-            def get_embedding(text):
-                return self.model.embedding_model(text=text, model=self.model_name)
+            if self.embedding_cache is None:
+                return self._fill_skipped(self._request_embeddings(formatted_texts))
 
-            with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
-                embeddings = list(executor.map(get_embedding, formatted_texts))
-            
+            embeddings = self.embedding_cache.get_many(self.model_name, formatted_texts)
+            miss_indices = [i for i in range(len(formatted_texts)) if i not in embeddings]
+            if miss_indices:
+                miss_texts = [formatted_texts[i] for i in miss_indices]
+                miss_embeddings = self._request_embeddings(miss_texts)
+                # 跳过的文本不写入缓存，下次构建时重新请求
+                fetched = [(text, embedding) for text, embedding in zip(miss_texts, miss_embeddings)
+                           if embedding is not None]
+                if fetched:
+                    self.embedding_cache.put_many(self.model_name, [text for text, _ in fetched],
+                                                  [embedding for _, embedding in fetched])
+                embeddings.update(zip(miss_indices, miss_embeddings))
+            print(f"embedding缓存命中 {len(formatted_texts) - len(miss_indices)}/{len(formatted_texts)}")
+            return self._fill_skipped([embeddings[i] for i in range(len(formatted_texts))])
+        raise ValueError(f"Unsupported embedding type: {self.embedding_type}")
+
+    def _fill_skipped(self, embeddings: List[Optional[List[float]]]) -> List[List[float]]:
+        """跳过的文本用零向量占位，保持与输入一一对应，检索时零向量的相似度为0，不会被召回"""
+        if all(embedding is not None for embedding in embeddings):
             return embeddings
-        raise ValueError(f"Unsupported embedding type: {self.embedding_type}")
\ No newline at end of file
+        dim = next((len(embedding) for embedding in embeddings if embedding is not None), None)
+        if dim is None:
+            # 全部被跳过时用一条占位文本获取向量维度
+            if self._embedding_dim is None:
+                self._embedding_dim = len(self.model.embedding_model(text="占位", model=self.model_name))
+            dim = self._embedding_dim
+        return [embedding if embedding is not None else [0.0] * dim for embedding in embeddings]
+
+    def _request_embeddings(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """通过API获取embedding，按embed_batch_size切分，每个批次一次请求，多个批次并发；
+        被接口拒绝的文本对应位置为None
+        """
+        batches = [
+            texts[i:i + self.embed_batch_size]
+            for i in range(0, len(texts), self.embed_batch_size)
+        ]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.embed_concurrency) as executor:
+            batch_embeddings = list(executor.map(self._embed_batch, batches))
+
+        # executor.map保持批次顺序，展开后即与输入顺序一致
+        return [embedding for embeddings in batch_embeddings for embedding in embeddings]
+
+    def _embed_single(self, text: str) -> Optional[List[float]]:
+        """
+        请求单条文本的embedding
+        接口拒绝该文本（4xx）时截断后再试一次，仍被拒绝则记录并跳过，返回None；
+        服务端故障等其他错误照常抛出
+        """
+        attempts = [text]
+        if len(text) > TRUNCATED_TEXT_CHARS:
+            attempts.append(text[:TRUNCATED_TEXT_CHARS])
+        for attempt in attempts:
+            try:
+                return self.model.embedding_model(text=attempt, model=self.model_name)
+            except Exception as e:
+                if classify_error(e) != CLIENT_ERROR:
+                    raise
+                print(f"embedding请求被拒绝: {e}, text_length: {len(attempt)}")
+        print(f"跳过无法获取embedding的文本: {text[:200]}")
+        return None
+
+    def _embed_batch(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """请求一个批次的embedding，失败时对半拆分重试，避免单条坏文本拖垮整个批次"""
+        try:
+            return self.model.embedding_batch_model(texts=texts, model=self.model_name)
+        except Exception as e:
+            if len(texts) == 1:
+                # 单条文本退回到原有的带重试的接口
+                return [self._embed_single(texts[0])]
+            print(f"批量embedding失败，拆分后重试: {e}, batch_size: {len(texts)}")
+            mid = len(texts) // 2
+            return self._embed_batch(texts[:mid]) + self._embed_batch(texts[mid:])
+
+    def get_text_embedding_batch(
+        self,
+        texts: List[str],
+        show_progress: bool = False,
+        **kwargs: Any
+    ) -> List[List[float]]:
+        """Get text embeddings for all texts.
+
+        The base class hands texts over one embed_batch_size chunk at a time,
+        which would leave embed_concurrency unused, so pass them all at once.
+        """
+        return self._get_text_embeddings(texts)
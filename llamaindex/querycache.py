@@ -0,0 +1,78 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+def normalize_query(query: str) -> str:
+    """规范化查询文本：逐行合并空白并转小写，保留换行以免改变embedding取最后一行的行为"""
+    lines = [" ".join(line.split()) for line in query.strip().splitlines()]
+    return "\n".join(line for line in lines if line).lower()
+
+
+class QueryCache:
+    def __init__(self, max_entries: int = 1024, ttl: float = 600):
+        """初始化带过期时间的LRU缓存
+        Args:
+            max_entries (int): 最大缓存条目数
+            ttl (float): 条目有效期（秒）
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+
+    def get(self, key: Hashable, version: Any = None) -> Optional[Any]:
+        """读取缓存
+        Args:
+            key: 缓存键
+            version: 当前内容版本，与写入时不一致的条目视为失效
+        Returns:
+            命中时返回缓存值，否则返回None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expire_at, entry_version, cost = entry
+                if expire_at >= time.time() and entry_version == version:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    self.saved_seconds += cost
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, value: Any, version: Any = None, cost: float = 0.0):
+        """写入缓存
+        Args:
+            key: 缓存键
+            value: 缓存值
+            version: 当前内容版本
+            cost (float): 计算该值耗费的秒数，命中时计入节省的时间
+        """
+        with self._lock:
+            self._entries[key] = (value, time.time() + self.ttl, version, cost)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """获取缓存统计信息"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "saved_seconds": round(self.saved_seconds, 3),
+            }
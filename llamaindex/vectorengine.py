@@ -0,0 +1,234 @@
+import os
+import json
+import tempfile
+import contextlib
+from typing import List, Tuple
+
+import numpy as np
+
+# 二进制索引格式中的文件名
+META_FILE = "meta.json"
+EMBEDDINGS_FILE = "embeddings.npy"
+IDS_FILE = "ids.npy"
+TEXTS_FILE = "texts.bin"
+TEXT_OFFSETS_FILE = "text_offsets.npy"
+FORMAT_VERSION = 1
+
+
+class NumpyVectorEngine:
+    def __init__(self):
+        """初始化内存向量引擎
+        所有节点向量归一化后存放在一个连续的 float32 矩阵中，
+        检索时只需一次矩阵-向量乘法加 argpartition 取 top-k。
+        从磁盘加载时矩阵、id表和文本都以内存映射方式按需读取。
+        """
+        self.matrix = None
+        self._ids = []
+        self._texts = []
+        self._id_to_row = None
+        # 内存映射的只读数据，首次修改时才转成内存中的列表
+        self._id_table = None
+        self._text_blob = None
+        self._text_offsets = None
+
+    def __len__(self) -> int:
+        return 0 if self.matrix is None else self.matrix.shape[0]
+
+    @staticmethod
+    def _normalize(matrix: np.ndarray) -> np.ndarray:
+        """按行做L2归一化，使内积等价于余弦相似度"""
+        norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    @classmethod
+    def from_llama_index(cls, index) -> "NumpyVectorEngine":
+        """从 llama_index 的 VectorStoreIndex 导出向量和完整文本
+        Args:
+            index: 使用 SimpleVectorStore 的 VectorStoreIndex
+        Returns:
+            NumpyVectorEngine: 向量引擎实例
+        """
+        engine = cls()
+        embedding_dict = index.vector_store.data.embedding_dict
+        ids, embeddings, texts = [], [], []
+        for node_id, embedding in embedding_dict.items():
+            node = index.docstore.get_node(node_id, raise_error=False)
+            ids.append(node_id)
+            embeddings.append(embedding)
+            texts.append(node.metadata.get('full_text', '') if node is not None else '')
+        engine.add(ids, embeddings, texts)
+        return engine
+
+    @staticmethod
+    def exists(store_dir: str) -> bool:
+        """判断目录下是否存在完整的二进制索引"""
+        return os.path.exists(os.path.join(store_dir, META_FILE))
+
+    def save(self, store_dir: str):
+        """以二进制格式保存索引
+        向量矩阵、定长id表、文本偏移表分别存为 .npy，全部文本拼接为一个 UTF-8 文件。
+        meta.json 最后写入，作为索引完整的标志。
+        Args:
+            store_dir (str): 保存目录
+        """
+        os.makedirs(store_dir, exist_ok=True)
+        meta_path = os.path.join(store_dir, META_FILE)
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+
+        count = len(self)
+        matrix = self.matrix if self.matrix is not None else np.zeros((0, 0), dtype=np.float32)
+        encoded_texts = [self.get_text(row).encode('utf-8') for row in range(count)]
+        offsets = np.zeros(count + 1, dtype=np.int64)
+        if count:
+            offsets[1:] = np.cumsum([len(text) for text in encoded_texts])
+        id_table = np.array([self.get_id(row).encode('utf-8') for row in range(count)], dtype=np.bytes_)
+
+        self._atomic_save_npy(os.path.join(store_dir, EMBEDDINGS_FILE), np.ascontiguousarray(matrix, dtype=np.float32))
+        self._atomic_save_npy(os.path.join(store_dir, IDS_FILE), id_table)
+        self._atomic_save_npy(os.path.join(store_dir, TEXT_OFFSETS_FILE), offsets)
+        with self._atomic_open(os.path.join(store_dir, TEXTS_FILE)) as f:
+            for text in encoded_texts:
+                f.write(text)
+
+        with open(meta_path, 'w', encoding='utf-8') as f:
+            json.dump({"version": FORMAT_VERSION, "count": count, "dim": int(matrix.shape[1]) if count else 0}, f)
+
+    @staticmethod
+    @contextlib.contextmanager
+    def _atomic_open(path: str):
+        """先写临时文件再替换，避免其他进程读到写了一半的文件；
+        临时文件名唯一，多个进程同时保存时不会写入同一个临时文件
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                yield f
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def _atomic_save_npy(cls, path: str, array: np.ndarray):
+        """原子地保存 .npy 文件"""
+        with cls._atomic_open(path) as f:
+            np.save(f, array)
+
+    @classmethod
+    def load(cls, store_dir: str) -> "NumpyVectorEngine":
+        """以内存映射方式加载二进制索引，只读取文件头，数据在访问时才换入
+        Args:
+            store_dir (str): 索引目录
+        Returns:
+            NumpyVectorEngine: 向量引擎实例
+        """
+        with open(os.path.join(store_dir, META_FILE), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get("version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported vector engine format version: {meta.get('version')}")
+
+        engine = cls()
+        if meta["count"] == 0:
+            return engine
+        engine.matrix = np.load(os.path.join(store_dir, EMBEDDINGS_FILE), mmap_mode='r')
+        engine._id_table = np.load(os.path.join(store_dir, IDS_FILE), mmap_mode='r')
+        engine._text_offsets = np.load(os.path.join(store_dir, TEXT_OFFSETS_FILE), mmap_mode='r')
+        if engine._text_offsets[-1] > 0:
+            engine._text_blob = np.memmap(os.path.join(store_dir, TEXTS_FILE), dtype=np.uint8, mode='r')
+        else:
+            # 空文件无法做内存映射
+            engine._text_blob = np.zeros(0, dtype=np.uint8)
+        engine._ids = None
+        engine._texts = None
+        return engine
+
+    def _materialize(self):
+        """把内存映射的只读数据转成可修改的内存数据"""
+        if self._ids is None:
+            self._ids = [self.get_id(row) for row in range(len(self))]
+            self._texts = [self.get_text(row) for row in range(len(self))]
+            if self.matrix is not None:
+                self.matrix = np.array(self.matrix, dtype=np.float32)
+            self._id_table = None
+            self._text_blob = None
+            self._text_offsets = None
+        if self._id_to_row is None:
+            self._id_to_row = {node_id: i for i, node_id in enumerate(self._ids)}
+
+    def add(self, ids: List[str], embeddings: List[List[float]], texts: List[str]):
+        """添加向量，已存在的id会被替换
+        Args:
+            ids (list): 节点id列表
+            embeddings (list): 向量列表
+            texts (list): 完整文本列表
+        """
+        if not ids:
+            return
+        self._materialize()
+        self.delete([node_id for node_id in ids if node_id in self._id_to_row])
+        new_matrix = self._normalize(np.asarray(embeddings, dtype=np.float32))
+        if self.matrix is None or len(self) == 0:
+            self.matrix = np.ascontiguousarray(new_matrix)
+        else:
+            self.matrix = np.ascontiguousarray(np.vstack([self.matrix, new_matrix]))
+        for node_id in ids:
+            self._id_to_row[node_id] = len(self._ids)
+            self._ids.append(node_id)
+        self._texts.extend(texts)
+
+    def delete(self, ids: List[str]):
+        """删除向量
+        Args:
+            ids (list): 要删除的节点id列表
+        """
+        self._materialize()
+        rows = {self._id_to_row[node_id] for node_id in ids if node_id in self._id_to_row}
+        if not rows:
+            return
+        keep = np.array([i for i in range(len(self._ids)) if i not in rows], dtype=np.int64)
+        self.matrix = np.ascontiguousarray(self.matrix[keep])
+        self._ids = [self._ids[i] for i in keep]
+        self._texts = [self._texts[i] for i in keep]
+        self._id_to_row = {node_id: i for i, node_id in enumerate(self._ids)}
+
+    def search(self, query_embedding: List[float], top_k: int = 5) -> List[Tuple[int, float]]:
+        """检索与查询向量最相似的节点
+        Args:
+            query_embedding (list): 查询向量
+            top_k (int): 返回结果数量
+        Returns:
+            list: 按相似度降序排列的 (行号, 相似度) 列表
+        """
+        if len(self) == 0 or top_k <= 0:
+            return []
+        query = self._normalize(np.asarray(query_embedding, dtype=np.float32))
+        scores = self.matrix @ query
+        k = min(top_k, len(scores))
+        if k < len(scores):
+            rows = np.argpartition(-scores, k - 1)[:k]
+        else:
+            rows = np.arange(len(scores))
+        rows = rows[np.argsort(-scores[rows])]
+        return [(int(row), float(scores[row])) for row in rows]
+
+    def get_id(self, row: int) -> str:
+        """获取行号对应的节点id"""
+        if self._ids is not None:
+            return self._ids[row]
+        return bytes(self._id_table[row]).decode('utf-8')
+
+    def get_row(self, node_id: str) -> int:
+        """获取节点id对应的行号，不存在时返回None"""
+        if self._id_to_row is None:
+            self._id_to_row = {self.get_id(row): row for row in range(len(self))}
+        return self._id_to_row.get(node_id)
+
+    def get_text(self, row: int) -> str:
+        """获取行号对应的完整文本"""
+        if self._texts is not None:
+            return self._texts[row]
+        start, end = int(self._text_offsets[row]), int(self._text_offsets[row + 1])
+        return self._text_blob[start:end].tobytes().decode('utf-8')
@@ -1,16 +1,80 @@
 import openai
-import time
+import asyncio
+import threading
+import weakref
+import httpx
+from llm.api.retry import RetryPolicy, get_circuit_breaker
+from llm.api.response_cache import make_cache_key
+from agent.offload import run_blocking
+
+# 默认重试策略：指数退避加抖动，单次调用总时限3分钟
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+# 进程内共享的HTTP连接池参数，所有OpenaiApi实例复用同一个连接池
+HTTP_POOL_LIMITS = httpx.Limits(max_connections=200, max_keepalive_connections=50, keepalive_expiry=60)
+HTTP_TIMEOUT = httpx.Timeout(600, connect=10)
+
+_http_client = None
+_http_client_lock = threading.Lock()
+# httpx.AsyncClient 绑定创建它的事件循环，因此每个事件循环各有一个连接池
+_async_http_clients = weakref.WeakKeyDictionary()
+
+
+def get_http_client():
+    """获取共享的同步HTTP连接池"""
+    global _http_client
+    if _http_client is None:
+        with _http_client_lock:
+            if _http_client is None:
+                _http_client = openai.DefaultHttpxClient(limits=HTTP_POOL_LIMITS, timeout=HTTP_TIMEOUT)
+    return _http_client
+
+
+def get_async_http_client():
+    """获取当前事件循环共享的异步HTTP连接池"""
+    loop = asyncio.get_running_loop()
+    client = _async_http_clients.get(loop)
+    if client is None:
+        client = openai.DefaultAsyncHttpxClient(limits=HTTP_POOL_LIMITS, timeout=HTTP_TIMEOUT)
+        _async_http_clients[loop] = client
+    return client
+
 
 class OpenaiApi:
-    def __init__(self, api_key, base_url="",model = 'gpt-4o-2024-08-06'):
+    def __init__(self, api_key, base_url="",model = 'gpt-4o-2024-08-06', retry_policy=None, response_cache=None):
         self.api_key = api_key
         self.base_url = base_url
         self.model = model
+        # 可选的响应缓存（ResponseCache），只有调用时传入cache_ttl才会读写
+        self.response_cache = response_cache
+        # 同一提供方的所有实例共享一个熔断器，重试统一由retry_policy负责
+        retry_policy = retry_policy if retry_policy else DEFAULT_RETRY_POLICY
+        self.retry_policy = retry_policy.with_circuit_breaker(get_circuit_breaker(base_url or "default"))
+
+        self.client = self._create_client(openai.OpenAI, get_http_client())
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def _create_client(self, client_cls, http_client):
+        # 关闭SDK自带的重试，避免与retry_policy叠加
+        if self.base_url:
+            return client_cls(api_key=self.api_key, base_url=self.base_url, http_client=http_client, max_retries=0)
+        return client_cls(api_key=self.api_key, http_client=http_client, max_retries=0)
+
+    @property
+    def async_client(self):
+        """当前事件循环对应的 AsyncOpenAI 客户端"""
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            client = self._create_client(openai.AsyncOpenAI, get_async_http_client())
+            self._async_clients[loop] = client
+        return client
 
-        self.client = openai.OpenAI(api_key=self.api_key,base_url=self.base_url) if base_url!="" else openai.OpenAI(api_key=self.api_key)
     def stream_chat_model(self, messages_list, model=None, temperature=0.2, top_p=0.95):
+        # 只对建立流的请求重试，已经开始输出的流无法重放
         model = model if model else self.model
-        stream = self.client.chat.completions.create(
+        stream = self.retry_policy.call(
+            self.client.chat.completions.create,
             model=model,
             messages=messages_list,
             temperature=temperature,
@@ -20,47 +84,103 @@ class OpenaiApi:
         return stream
     
 
-    def chat_model(self, messages_list, model=None, temperature=0.2, top_p=0.95):
+    def _cache_key(self, messages_list, model, temperature, top_p, cache_ttl):
+        """需要缓存时返回缓存键，否则返回None"""
+        if self.response_cache is None or not cache_ttl:
+            return None
+        return make_cache_key(self.base_url, model, messages_list, temperature, top_p)
+
+    def chat_model(self, messages_list, model=None, temperature=0.2, top_p=0.95, cache_ttl=None, bypass_cache=False):
+        """
+        获取聊天响应
+
+        Args:
+            cache_ttl: 响应缓存的有效期（秒），为None时本次调用不使用缓存
+            bypass_cache: 跳过缓存读取，强制请求最新结果（结果仍会写入缓存）
+        """
         model = model if model else self.model
-        
-        try:
-            # 记录输入的消息
-            # print(f"Input messages: {messages_list[0]['content']}")
-            
-            resp = self.client.chat.completions.create(
-                model=model,
-                messages=messages_list,
-                temperature=temperature,
-                top_p=top_p,
-            )
-            content = resp.choices[0].message.content
-            
-            # 记录输出的响应
-            # print(f"Output response: {content}")
-            
-            return content
-        
-        except Exception as e:
-
-            time.sleep(60)  # Wait for 1 minute before retrying
-            return self.chat_model(messages_list, model=model, temperature=temperature, top_p=top_p)
+        cache_key = self._cache_key(messages_list, model, temperature, top_p, cache_ttl)
+        if cache_key is not None and not bypass_cache:
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                return cached
+        resp = self.retry_policy.call(
+            self.client.chat.completions.create,
+            model=model,
+            messages=messages_list,
+            temperature=temperature,
+            top_p=top_p,
+        )
+        content = resp.choices[0].message.content
+        if cache_key is not None:
+            self.response_cache.put(cache_key, content, cache_ttl)
+        return content
+
+    def cache_stats(self) -> dict:
+        """获取响应缓存的统计信息"""
+        return self.response_cache.stats() if self.response_cache is not None else {}
 
     def embedding_model(self,text,model = "text-embedding-ada-002"):
         if len(text) > 5120:
             text = text[:5120]
-        max_retries = 50
-        retries = 0
-        while retries < max_retries:
-            try:
-                response = self.client.embeddings.create(
-                    model=model,
-                    input=text
-                )
-                break
-            except Exception as e:
-                print(f"An error occurred: {e},query:{text}")
-                retries += 1
-                if retries >= max_retries:
-                    raise e
-                time.sleep(60)  # Optional: wait for 2 seconds before retrying
-        return response.data[0].embedding
\ No newline at end of file
+        response = self.retry_policy.call(
+            self.client.embeddings.create,
+            model=model,
+            input=text
+        )
+        return response.data[0].embedding
+
+    def embedding_batch_model(self, texts, model="text-embedding-ada-002"):
+        """一次请求获取多条文本的embedding，结果按输入顺序返回"""
+        texts = [text[:5120] for text in texts]
+        response = self.retry_policy.call(
+            self.client.embeddings.create,
+            model=model,
+            input=texts
+        )
+        # 接口返回的顺序不一定与输入一致，按index还原
+        data = sorted(response.data, key=lambda item: item.index)
+        return [item.embedding for item in data]
+
+    async def astream_chat_model(self, messages_list, model=None, temperature=0.2, top_p=0.95):
+        model = model if model else self.model
+        stream = await self.retry_policy.acall(
+            self.async_client.chat.completions.create,
+            model=model,
+            messages=messages_list,
+            temperature=temperature,
+            top_p=top_p,
+            stream=True  # 启用流式输出
+        )
+        return stream
+
+    async def achat_model(self, messages_list, model=None, temperature=0.2, top_p=0.95, cache_ttl=None,
+                          bypass_cache=False):
+        """chat_model 的异步版本，缓存参数含义相同，缓存的SQLite读写放到线程池执行"""
+        model = model if model else self.model
+        cache_key = self._cache_key(messages_list, model, temperature, top_p, cache_ttl)
+        if cache_key is not None and not bypass_cache:
+            cached = await run_blocking(self.response_cache.get, cache_key)
+            if cached is not None:
+                return cached
+        resp = await self.retry_policy.acall(
+            self.async_client.chat.completions.create,
+            model=model,
+            messages=messages_list,
+            temperature=temperature,
+            top_p=top_p,
+        )
+        content = resp.choices[0].message.content
+        if cache_key is not None:
+            await run_blocking(self.response_cache.put, cache_key, content, cache_ttl)
+        return content
+
+    async def aembedding_model(self, text, model="text-embedding-ada-002"):
+        if len(text) > 5120:
+            text = text[:5120]
+        response = await self.retry_policy.acall(
+            self.async_client.embeddings.create,
+            model=model,
+            input=text
+        )
+        return response.data[0].embedding
@@ -0,0 +1,128 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+DEFAULT_RESPONSE_CACHE_PATH = os.path.join(".llm_cache", "responses.sqlite")
+
+
+def make_cache_key(base_url: str, model: str, messages_list: list, temperature: float, top_p: float) -> str:
+    """
+    根据请求内容生成缓存键
+
+    Args:
+        base_url: 提供方地址，不同提供方的同名模型分开缓存
+        model: 模型名称
+        messages_list: 消息列表
+        temperature: 采样温度
+        top_p: 核采样参数
+
+    Returns:
+        str: 缓存键
+    """
+    payload = json.dumps([base_url, model, messages_list, temperature, top_p], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = 1024, cache_path: Optional[str] = DEFAULT_RESPONSE_CACHE_PATH):
+        """
+        初始化LLM响应缓存
+        内存中是带过期时间的LRU，可选的SQLite磁盘层在进程重启后依然有效。
+
+        Args:
+            max_entries: 内存中最多保留的响应数
+            cache_path: SQLite文件路径，为None时只使用内存缓存
+        """
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._conn = None
+        if cache_path:
+            cache_dir = os.path.dirname(cache_path)
+            if cache_dir:
+                os.makedirs(cache_dir, exist_ok=True)
+            self._conn = sqlite3.connect(cache_path, timeout=30, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT, expire_at REAL)")
+            self._conn.commit()
+
+    def _remember(self, key: str, value: str, expire_at: float):
+        self._entries[key] = (value, expire_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key: str) -> Optional[str]:
+        """读取缓存的响应，先查内存再查磁盘"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] >= now:
+                    self._entries.move_to_end(key)
+                    self.memory_hits += 1
+                    return entry[0]
+                del self._entries[key]
+            if self._conn is not None:
+                row = self._conn.execute("SELECT value, expire_at FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None and row[1] >= now:
+                    self._remember(key, row[0], row[1])
+                    self.disk_hits += 1
+                    return row[0]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: str, ttl: float):
+        """写入响应，ttl为有效期（秒）"""
+        if value is None:
+            return
+        expire_at = time.time() + ttl
+        with self._lock:
+            self._remember(key, value, expire_at)
+            if self._conn is not None:
+                self._conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?)", (key, value, expire_at))
+                self._conn.execute("DELETE FROM responses WHERE expire_at < ?", (time.time(),))
+                self._conn.commit()
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM responses")
+                self._conn.commit()
+
+    def stats(self) -> dict:
+        """获取缓存统计信息"""
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / total if total else 0.0,
+            }
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_response_cache() -> ResponseCache:
+    """获取进程内共享的响应缓存，设置 RESPONSE_CACHE_PATH 为空字符串时只使用内存缓存"""
+    global _default_cache
+    if _default_cache is None:
+        with _default_cache_lock:
+            if _default_cache is None:
+                _default_cache = ResponseCache(cache_path=os.getenv("RESPONSE_CACHE_PATH", DEFAULT_RESPONSE_CACHE_PATH))
+    return _default_cache
@@ -0,0 +1,284 @@
+import time
+import random
+import asyncio
+import threading
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+import openai
+
+# 错误分类
+RATE_LIMIT = "rate_limit"
+SERVER_ERROR = "server_error"
+CONNECTION_ERROR = "connection_error"
+CLIENT_ERROR = "client_error"
+UNKNOWN_ERROR = "unknown_error"
+
+# 可以重试的错误类型，同时也是熔断器统计的提供方故障
+RETRYABLE_ERRORS = {RATE_LIMIT, SERVER_ERROR, CONNECTION_ERROR}
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态时快速失败"""
+
+
+def classify_error(error: Exception) -> str:
+    """
+    对调用异常进行分类
+
+    Args:
+        error: 调用抛出的异常
+
+    Returns:
+        str: 错误类别
+    """
+    if isinstance(error, openai.RateLimitError):
+        return RATE_LIMIT
+    if isinstance(error, openai.APIConnectionError):
+        # 包含 APITimeoutError
+        return CONNECTION_ERROR
+    if isinstance(error, openai.APIStatusError):
+        status = error.status_code
+        if status == 429:
+            return RATE_LIMIT
+        if status >= 500 or status in (408, 409):
+            return SERVER_ERROR
+        return CLIENT_ERROR
+    return UNKNOWN_ERROR
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """
+    从响应头中读取服务端建议的重试等待秒数
+
+    Args:
+        error: 调用抛出的异常
+
+    Returns:
+        float: 等待秒数，没有相关响应头时返回None
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    try:
+        # HTTP-date 格式
+        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        """
+        初始化熔断器
+        连续失败达到阈值后打开，打开期间直接拒绝调用；
+        冷却时间过后放行一次试探调用，成功则关闭，失败则重新打开。
+
+        Args:
+            failure_threshold: 连续失败多少次后打开
+            recovery_timeout: 打开后多久允许试探调用（秒）
+        """
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._half_open_trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        with self._lock:
+            return self._opened_at is not None
+
+    def allow(self) -> bool:
+        """判断当前是否允许发起调用"""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.time() - self._opened_at < self.recovery_timeout or self._half_open_trial:
+                return False
+            # 进入半开状态，只放行一个试探调用
+            self._half_open_trial = True
+            return True
+
+    def record_success(self):
+        """记录一次成功调用"""
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._half_open_trial = False
+
+    def record_neutral(self):
+        """记录一次与提供方健康无关的失败，释放半开状态下的试探机会"""
+        with self._lock:
+            self._half_open_trial = False
+
+    def record_failure(self):
+        """记录一次提供方故障"""
+        with self._lock:
+            self._failures += 1
+            if self._half_open_trial or self._failures >= self.failure_threshold:
+                self._opened_at = time.time()
+                self._half_open_trial = False
+
+
+_circuit_breakers = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(key: str) -> CircuitBreaker:
+    """按提供方（base_url）获取进程内共享的熔断器"""
+    with _circuit_breakers_lock:
+        if key not in _circuit_breakers:
+            _circuit_breakers[key] = CircuitBreaker()
+        return _circuit_breakers[key]
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts: int = 6, base_delay: float = 1.0, max_delay: float = 30.0,
+                 deadline: float = 180.0, circuit_breaker: Optional[CircuitBreaker] = None):
+        """
+        初始化重试策略
+
+        Args:
+            max_attempts: 单次调用最多尝试次数
+            base_delay: 指数退避的初始等待秒数
+            max_delay: 单次等待上限（秒）
+            deadline: 单次调用（含所有重试）的总时限（秒）
+            circuit_breaker: 熔断器，为None时不熔断
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.circuit_breaker = circuit_breaker
+
+    def with_circuit_breaker(self, circuit_breaker: CircuitBreaker) -> "RetryPolicy":
+        """复制一份使用指定熔断器的策略"""
+        return RetryPolicy(self.max_attempts, self.base_delay, self.max_delay, self.deadline, circuit_breaker)
+
+    def _before_attempt(self):
+        if self.circuit_breaker is not None and not self.circuit_breaker.allow():
+            raise CircuitOpenError("LLM服务暂时不可用，熔断器已打开")
+
+    def _after_success(self):
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.record_success()
+
+    def _after_interrupted(self):
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.record_neutral()
+
+    def _attempt_timeout(self, started_at: float) -> float:
+        """
+        本次尝试可用的超时时间，即总时限的剩余部分
+
+        Raises:
+            TimeoutError: 总时限已用完，不再发起新的尝试
+        """
+        remaining = self.deadline - (time.time() - started_at)
+        if remaining <= 0:
+            raise TimeoutError(f"LLM调用超过总时限{self.deadline:.0f}秒")
+        return remaining
+
+    def _next_delay(self, error: Exception, attempt: int, started_at: float) -> Optional[float]:
+        """
+        记录失败并计算下一次重试前的等待时间
+
+        Returns:
+            float: 等待秒数，不应再重试时返回None
+        """
+        category = classify_error(error)
+        if category not in RETRYABLE_ERRORS:
+            if self.circuit_breaker is not None:
+                if category == CLIENT_ERROR:
+                    # 4xx说明服务端正常响应，只是请求本身有问题
+                    self.circuit_breaker.record_success()
+                else:
+                    self.circuit_breaker.record_neutral()
+            return None
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.record_failure()
+            if self.circuit_breaker.is_open:
+                return None
+        if attempt >= self.max_attempts:
+            return None
+
+        retry_after = get_retry_after(error)
+        if retry_after is not None:
+            delay = retry_after
+        else:
+            # 指数退避加全抖动
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        if time.time() - started_at + delay > self.deadline:
+            return None
+        print(f"LLM调用失败({category})，{delay:.1f}秒后第{attempt + 1}次尝试: {error}")
+        return delay
+
+    def call(self, func, *args, **kwargs):
+        """
+        按策略同步调用func
+        func需要接受timeout参数（如openai客户端的create），每次尝试的超时为总时限的剩余部分，
+        单次尝试不会超出总时限
+        """
+        started_at = time.time()
+        attempt = 0
+        while True:
+            attempt += 1
+            kwargs["timeout"] = self._attempt_timeout(started_at)
+            self._before_attempt()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                delay = self._next_delay(e, attempt, started_at)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            except BaseException:
+                # 调用被取消（如SSE客户端断开）时没有成功或失败的结论，释放半开状态下的试探机会
+                self._after_interrupted()
+                raise
+            self._after_success()
+            return result
+
+    async def acall(self, func, *args, **kwargs):
+        """
+        按策略调用异步函数func
+        func需要接受timeout参数（如openai客户端的create），每次尝试的超时为总时限的剩余部分，
+        单次尝试不会超出总时限
+        """
+        started_at = time.time()
+        attempt = 0
+        while True:
+            attempt += 1
+            kwargs["timeout"] = self._attempt_timeout(started_at)
+            self._before_attempt()
+            try:
+                result = await func(*args, **kwargs)
+            except Exception as e:
+                delay = self._next_delay(e, attempt, started_at)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                # 调用被取消（如SSE客户端断开）时没有成功或失败的结论，释放半开状态下的试探机会
+                self._after_interrupted()
+                raise
+            self._after_success()
+            return result
@@ -5,6 +5,9 @@ from typing import List
 from collections import deque
 import aiofiles
 import time
+import queue
+import atexit
+import threading
 
 class LogManager:
     def __init__(self, log_file: str, max_lines: int = 1000):
@@ -121,7 +124,13 @@ class SyncLogManager:
         self.last_file_size = 0
         self.last_file_inode = 0
         self.last_check_time = 0
+        # 日志由后台线程写入磁盘，append_log 不在调用方（包括事件循环）中做文件IO和fsync
+        self._lock = threading.Lock()
+        self._pending = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="log-writer", daemon=True)
         self.initialize()
+        self._writer.start()
+        atexit.register(self.flush)
         
     def initialize(self):
         """初始化日志管理器，读取现有日志"""
@@ -188,38 +197,59 @@ class SyncLogManager:
             self._read_full_log()
             self._update_file_stats()
 
+    def _write_loop(self):
+        """后台线程：把排队的日志批量写入文件，每批只fsync一次"""
+        while True:
+            entries = [self._pending.get()]
+            while True:
+                try:
+                    entries.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with self._lock:
+                    # 确保文件句柄正确关闭，并立即写入磁盘
+                    with open(self.log_file, 'a', encoding='utf-8') as f:
+                        f.write("".join(entries))
+                        f.flush()
+                        os.fsync(f.fileno())
+                    self._update_file_stats()
+            except Exception as e:
+                print(f"写入日志失败: {e}")
+            finally:
+                for _ in entries:
+                    self._pending.task_done()
+
     def append_log(self, message: str):
-        """同步追加日志"""
+        """追加日志，立即进入内存缓冲，由后台线程写入文件"""
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         log_entry = f"[{timestamp}] {message}\n"
-        
-        try:
-            # 确保文件句柄正确关闭，并立即写入磁盘
-            with open(self.log_file, 'a', encoding='utf-8', buffering=1) as f:
-                f.write(log_entry)
-                f.flush()
-                os.fsync(f.fileno())
-            self.log_buffer.append(log_entry)
-            self._update_file_stats()
-        except Exception as e:
-            print(f"写入日志失败: {e}")
+        self.log_buffer.append(log_entry)
+        self._pending.put(log_entry)
+
+    def flush(self):
+        """等待排队的日志全部写入文件"""
+        self._pending.join()
 
     def get_logs(self) -> str:
         """获取最新的日志"""
         # 检查文件是否有更新
-        self._check_file_changes()
+        with self._lock:
+            self._check_file_changes()
         return "".join(self.log_buffer)
 
     def clear_logs(self):
         """清除所有日志"""
+        self.flush()
         try:
-            with open(self.log_file, 'w', encoding='utf-8') as f:
-                timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                log_entry = f"[{timestamp}] 日志已清除\n"
-                f.write(log_entry)
-                self.log_buffer.clear()
-                self.log_buffer.append(log_entry)
-            self._update_file_stats()
+            with self._lock:
+                with open(self.log_file, 'w', encoding='utf-8') as f:
+                    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                    log_entry = f"[{timestamp}] 日志已清除\n"
+                    f.write(log_entry)
+                    self.log_buffer.clear()
+                    self.log_buffer.append(log_entry)
+                self._update_file_stats()
         except Exception as e:
             print(f"清除日志失败: {e}")
 
@@ -1,16 +1,19 @@
 import os
 import sys
+import threading
 
 from llamaindex.indexstore import IndexStore
 from llm.api.func_get_openai import OpenaiApi
+from llm.api.response_cache import get_default_response_cache
 from log_manager import SyncLogManager
 
 
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
 from sse_starlette.sse import EventSourceResponse
 import json
+import uuid
 import asyncio
 
 from pydantic import BaseModel
@@ -22,6 +25,11 @@ from dotenv import load_dotenv
 from agent.query import QueryAgent
 from agent.stock_analysis import StockAnalyzer
 from agent.chat_manager import ChatManager
+from agent.session_store import SessionStore
+from agent.sandbox import get_default_pool
+from agent.offload import get_default_executor, run_blocking
+from singleflight import SingleFlight
+from job_manager import JobManager, Job, QueueFullError
 
 # 加载环境变量
 load_dotenv()
@@ -44,15 +52,58 @@ class StockAnalysisRequest(BaseModel):
     end_date: str
     chat_model: str = "deepseek-chat"
 
+class AnalyzeJobRequest(StockAnalysisRequest):
+    priority: int = 5  # 数值越小越先执行
+
 class ChatRequest(BaseModel):
     message: str
     stock_name: str
     chat_model: str = "deepseek-chat"  # 默认使用 deepseek-chat
     chat_history: Optional[List[dict]] = []
+    session_id: Optional[str] = None  # 客户端会话ID，为空时服务端生成并在完成事件中返回，客户端之后带上该ID
 
 # 全局变量存储处理器实例
 processors = {}
-chat_managers = {}
+# 按客户端会话保存聊天管理器，LRU和空闲超时淘汰，设置 CHAT_SESSION_SPILL_PATH 时换出到SQLite
+chat_sessions = SessionStore(
+    max_sessions=int(os.getenv("CHAT_SESSION_MAX", "1000")),
+    max_bytes=int(os.getenv("CHAT_SESSION_MAX_BYTES", str(64 * 1024 * 1024))),
+    idle_ttl=float(os.getenv("CHAT_SESSION_IDLE_TTL", "3600")),
+    spill_path=os.getenv("CHAT_SESSION_SPILL_PATH") or None
+)
+# 相同股票、区间和模型的分析请求合并为一次执行，报告在短时间内直接复用
+analyze_flight = SingleFlight(ttl=int(os.getenv("ANALYZE_CACHE_TTL", "300")))
+
+# 进程内共享的索引和日志管理器，不同模型的QueryAgent只在其上增加各自的LLM客户端
+EMBEDDING_MODEL_NAME = 'embedding-3'
+EMBEDDING_STORE_DIR = '.index_all_embedding_3'
+_shared_index = None
+_shared_log_manager = None
+_shared_lock = threading.Lock()
+
+def get_shared_index() -> IndexStore:
+    """获取进程内共享的索引实例，首次调用时加载"""
+    global _shared_index
+    if _shared_index is None:
+        with _shared_lock:
+            if _shared_index is None:
+                _shared_index = IndexStore(
+                    embedding_model_name=EMBEDDING_MODEL_NAME,
+                    index_dir=EMBEDDING_STORE_DIR,
+                    update_rag_doc=False,
+                    api_key=os.getenv("zhipu_api_key"),
+                    base_url=os.getenv("zhipu_base_url")
+                )
+    return _shared_index
+
+def get_shared_log_manager() -> SyncLogManager:
+    """获取进程内共享的日志管理器"""
+    global _shared_log_manager
+    if _shared_log_manager is None:
+        with _shared_lock:
+            if _shared_log_manager is None:
+                _shared_log_manager = SyncLogManager(LOG_FILE)
+    return _shared_log_manager
 
 def init_query_processor(chat_model: str) -> QueryAgent:
     """初始化查询处理器"""
@@ -63,67 +114,141 @@ def init_query_processor(chat_model: str) -> QueryAgent:
         llm_api_key = os.getenv("deepseek_api_key")
         llm_base_url = os.getenv("deepseek_base_url")
     
-    embedding_api_key = os.getenv("zhipu_api_key")
-    embedding_base_url = os.getenv("zhipu_base_url")
-    
     if not llm_api_key or not llm_base_url:
         raise HTTPException(status_code=500, detail="API配置缺失")
-    embedding_model_name = 'embedding-3'
-    embedding_store_dir = '.index_all_embedding_3'
-    log_manager = SyncLogManager(LOG_FILE)
-    index = IndexStore(
-        embedding_model_name=embedding_model_name,
-        index_dir=embedding_store_dir,
-        update_rag_doc=False,
-        api_key=embedding_api_key,
-        base_url=embedding_base_url
-    )
+    # 响应缓存默认开启，设置 RESPONSE_CACHE_ENABLED=0 关闭
+    response_cache = get_default_response_cache() if os.getenv("RESPONSE_CACHE_ENABLED", "1") != "0" else None
     llm_model = OpenaiApi(
         api_key=llm_api_key,
         base_url=llm_base_url,
-        model=chat_model
+        model=chat_model,
+        response_cache=response_cache
     )
     return QueryAgent(
         model=llm_model,
-        log_manager=log_manager,
-        index=index
+        log_manager=get_shared_log_manager(),
+        index=get_shared_index(),
+        code_agent_options={
+            "speculative_candidates": int(os.getenv("SPECULATIVE_CANDIDATES", "1")),
+            "speculative_concurrency": int(os.getenv("SPECULATIVE_CONCURRENCY", "3")),
+        }
     )
 
-def get_or_create_chat_manager(stock_name: str, chat_model: str) -> ChatManager:
-    """获取或创建聊天管理器"""
+async def aget_query_processor(chat_model: str) -> QueryAgent:
+    """获取或创建指定模型的查询处理器，首次创建（含加载共享索引）放到线程池执行，不阻塞事件循环"""
     if chat_model not in processors:
-        processors[chat_model] = init_query_processor(chat_model)
-    
-    manager_key = f"{stock_name}_{chat_model}"
-    if manager_key not in chat_managers:
-        chat_managers[manager_key] = ChatManager(processors[chat_model])
+        processor = await run_blocking(init_query_processor, chat_model)
+        processors.setdefault(chat_model, processor)
+    return processors[chat_model]
+
+async def get_or_create_chat_manager(session_id: str, stock_name: str, chat_model: str) -> ChatManager:
+    """获取或创建会话的聊天管理器"""
+    processor = await aget_query_processor(chat_model)
     
-    return chat_managers[manager_key]
+    manager_key = SessionStore.make_key(session_id, stock_name, chat_model)
+    return await chat_sessions.aget_or_create(manager_key, lambda: ChatManager(processor))
+
+async def run_analysis(stock_name: str, start_date: str, end_date: str, chat_model: str,
+                       progress_callback=None) -> str:
+    """执行完整的分析流程并生成报告，相同请求合并为一次执行"""
+    processor = await aget_query_processor(chat_model)
+
+    async def _run():
+        analyzer = StockAnalyzer(processor, progress_callback=progress_callback)
+        # 执行分析，异步版本不会阻塞事件循环
+        result = await analyzer.aanalyze_stock(
+            stock_name=stock_name,
+            start_date=start_date,
+            end_date=end_date
+        )
+        return await analyzer.aget_stock_report(result)
+
+    key = (stock_name.strip(), start_date, end_date, chat_model)
+    return await analyze_flight.do(key, _run)
+
+async def run_analyze_job(job: Job, progress) -> str:
+    """后台任务执行函数"""
+    return await run_analysis(progress_callback=progress, **job.params)
+
+# 后台报告生成任务，同时执行的任务数由工作协程数量决定
+analyze_jobs = JobManager(
+    run_analyze_job,
+    workers=int(os.getenv("ANALYZE_JOB_WORKERS", "2")),
+    max_queue=int(os.getenv("ANALYZE_JOB_QUEUE_SIZE", "32"))
+)
+
+@app.on_event("startup")
+async def warm_up_code_workers():
+    """启动时预热代码执行进程池和共享索引，避免首个请求等待工作进程导入akshare或加载索引"""
+    get_default_pool()
+    analyze_jobs.start()
+    try:
+        await run_blocking(get_shared_index)
+    except Exception as e:
+        # 索引加载失败时不影响启动，首个请求会再次尝试加载
+        print(f"预加载索引失败: {str(e)}")
+
+@app.on_event("shutdown")
+async def shutdown_code_workers():
+    """关闭代码执行进程池"""
+    await analyze_jobs.shutdown()
+    get_default_pool().shutdown()
+    get_default_executor().shutdown()
 
 @app.post("/api/analyze")
 async def analyze_stock(request: StockAnalysisRequest):
     """分析股票接口"""
     try:
-        # 获取或创建处理器
-        if request.chat_model not in processors:
-            processors[request.chat_model] = init_query_processor(request.chat_model)
-        
-        processor = processors[request.chat_model]
-        analyzer = StockAnalyzer(processor)
-        
-        # 执行分析
-        result = analyzer.analyze_stock(
+        analysis_result = await run_analysis(
             stock_name=request.stock_name,
             start_date=request.start_date,
-            end_date=request.end_date
+            end_date=request.end_date,
+            chat_model=request.chat_model
         )
-        analysis_result = analyzer.get_stock_report(result)
         
         return {"status": "success", "report": analysis_result}
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/analyze/jobs")
+async def create_analyze_job(request: AnalyzeJobRequest, response: Response):
+    """提交后台分析任务，立即返回任务ID"""
+    # 提前检查模型配置，配置错误时直接返回而不是进入队列
+    await aget_query_processor(request.chat_model)
+    params = request.dict(exclude={"priority"})
+    try:
+        job = analyze_jobs.submit(params, priority=request.priority)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
+    response.status_code = 202
+    return {"job_id": job.job_id, "status": job.status, "queued": analyze_jobs.queued_count()}
+
+def get_analyze_job(job_id: str) -> Job:
+    job = analyze_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return job
+
+@app.get("/api/analyze/jobs/{job_id}")
+async def get_analyze_job_status(job_id: str):
+    """查询后台分析任务的状态，完成后返回报告"""
+    return get_analyze_job(job_id).to_dict()
+
+@app.get("/api/analyze/jobs/{job_id}/events")
+async def stream_analyze_job_events(job_id: str):
+    """SSE 流式推送后台分析任务的进度和最终报告"""
+    job = get_analyze_job(job_id)
+
+    async def event_generator():
+        async for event in job.subscribe():
+            data = {"type": event["event"], **event["data"]}
+            if event["event"] == "done":
+                data["report"] = job.result
+            yield {"event": "message", "data": json.dumps(data, ensure_ascii=False)}
+
+    return EventSourceResponse(event_generator())
+
 @app.post("/api/chat")
 async def chat(request: ChatRequest):
     """聊天接口 - SSE 流式输出"""
@@ -132,7 +257,9 @@ async def chat(request: ChatRequest):
             print(f"处理聊天请求: {request.message}")
 
             # 获取或创建聊天管理器
-            chat_manager = get_or_create_chat_manager(request.stock_name, request.chat_model)
+            # 不同客户端之间不共享会话，未提供ID时生成新的ID
+            session_id = request.session_id or uuid.uuid4().hex
+            chat_manager = await get_or_create_chat_manager(session_id, request.stock_name, request.chat_model)
             
             # 构建增强的输入
             enriched_input = f"关于股票【{request.stock_name}】的问题：{request.message}"
@@ -150,13 +277,13 @@ async def chat(request: ChatRequest):
                                 "type": "content"
                             })
                         }
-                        await asyncio.sleep(0.01)  # 小延迟以确保流畅输出
                 
                 # 发送完成信号
                 yield {
                     "event": "message",
                     "data": json.dumps({
-                        "type": "done"
+                        "type": "done",
+                        "session_id": session_id
                     })
                 }
                 
@@ -173,6 +300,10 @@ async def chat(request: ChatRequest):
                         "type": "error"
                     })
                 }
+            finally:
+                # 更新会话的内存估计，本轮对话中被换出的会话重新放回内存
+                await chat_sessions.atouch(SessionStore.make_key(session_id, request.stock_name, request.chat_model),
+                                           chat_manager)
         
         except Exception as e:
             error_msg = f"聊天处理出错: {str(e)}"
@@ -190,6 +321,18 @@ async def chat(request: ChatRequest):
 
     return EventSourceResponse(event_generator())
 
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    """获取LLM响应缓存、索引查询缓存、分析请求合并、后台任务、阻塞调用执行器和聊天会话的运行统计"""
+    return {
+        "llm": {model: processor.model.cache_stats() for model, processor in processors.items()},
+        "index": _shared_index.cache_stats() if _shared_index else {},
+        "analyze": analyze_flight.stats(),
+        "analyze_jobs": analyze_jobs.stats(),
+        "offload": get_default_executor().stats(),
+        "chat_sessions": chat_sessions.stats(),
+    }
+
 @app.get("/api/models")
 async def get_available_models():
     """获取可用的模型列表"""
@@ -216,3 +216,19 @@ output:
 """
 
 
+
+chat_history_summary_prompt = """
+你是一个对话摘要助手。请把【已有摘要】和【新增对话】合并为一份新的对话摘要，供后续回答用户问题时参考。
+注意事项：
+1. 保留用户关注的股票、时间范围、数据结论、用户的偏好和尚未解决的问题。
+2. 省略寒暄和重复内容，不要编造对话中没有的信息。
+3. 摘要不超过{max_chars}字，直接输出摘要正文，不要使用markdown格式。
+
+【已有摘要】
+{summary}
+
+【新增对话】
+{conversation}
+
+output:
+"""
@@ -0,0 +1,88 @@
+import time
+import asyncio
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    def __init__(self, ttl: float = 300, max_entries: int = 256):
+        """
+        初始化请求合并器
+        同一个键同时只执行一次计算，并发的重复请求等待同一个结果；
+        计算成功的结果在ttl秒内直接复用。
+
+        Args:
+            ttl: 结果缓存的有效期（秒），为0时只合并并发请求，不缓存结果
+            max_entries: 最多缓存的结果数
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self._results = OrderedDict()
+        self.computed = 0
+        self.coalesced = 0
+        self.cache_hits = 0
+
+    def _get_cached(self, key: Hashable):
+        entry = self._results.get(key)
+        if entry is None:
+            return False, None
+        value, expire_at = entry
+        if expire_at < time.monotonic():
+            del self._results[key]
+            return False, None
+        self._results.move_to_end(key)
+        return True, value
+
+    def _store(self, key: Hashable, value: Any):
+        if self.ttl <= 0:
+            return
+        self._results[key] = (value, time.monotonic() + self.ttl)
+        self._results.move_to_end(key)
+        while len(self._results) > self.max_entries:
+            self._results.popitem(last=False)
+
+    async def _compute(self, key: Hashable, func: Callable[[], Awaitable[Any]]):
+        try:
+            value = await func()
+            self._store(key, value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        获取键对应的结果
+
+        Args:
+            key: 请求键
+            func: 无参数的异步函数，只在没有缓存结果和进行中的计算时调用
+
+        Returns:
+            func 的返回值；计算出错时所有等待的请求都会收到同一个异常，异常不会被缓存
+        """
+        hit, value = self._get_cached(key)
+        if hit:
+            self.cache_hits += 1
+            return value
+        future = self._inflight.get(key)
+        if future is None:
+            # 计算放在独立的任务中执行，发起请求的客户端断开时不会取消其他请求等待的计算
+            future = asyncio.ensure_future(self._compute(key, func))
+            # 等待的请求都已断开时也要取出异常，避免未处理异常的警告
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            self._inflight[key] = future
+            self.computed += 1
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(future)
+
+    def stats(self) -> dict:
+        """获取统计信息"""
+        return {
+            "inflight": len(self._inflight),
+            "cached": len(self._results),
+            "computed": self.computed,
+            "coalesced": self.coalesced,
+            "cache_hits": self.cache_hits,
+        }
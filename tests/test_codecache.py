@@ -0,0 +1,32 @@
+from agent.codecache import CodeCache, normalize_params, parameterize_code, render_code
+from agent.stock_analysis import StockAnalyzer, TREND_DOC_API
+
+CODE = '''import akshare as ak
+result = ak.stock_zh_a_hist(symbol="000001", period="daily", start_date="20240101", end_date="20240301", adjust="qfq")
+'''
+
+
+def _stage_params(stock_name, start_date, end_date, symbol):
+    analyzer = object.__new__(StockAnalyzer)
+    stages = analyzer._build_stages(stock_name, start_date, end_date, symbol)
+    return dict((stage, (query, params)) for stage, query, _, params in stages)["trend_analysis"]
+
+
+def test_yyyymmdd_code_is_cached_and_rendered(tmp_path):
+    query, template_params = _stage_params("平安银行", "2024-01-01", "2024-03-01", "000001")
+    params = normalize_params(template_params)
+    template = parameterize_code(CODE, params)
+    assert template is not None
+    assert "20240101" not in template and "000001" not in template
+
+    cache = CodeCache(str(tmp_path / "code.sqlite"))
+    key, query_template = cache.make_key(query, TREND_DOC_API, params)
+    cache.put(key, query_template, template)
+
+    other_query, other_params = _stage_params("万科A", "2023-05-04", "2023-06-30", "000002")
+    other_params = normalize_params(other_params)
+    other_key, _ = cache.make_key(other_query, TREND_DOC_API, other_params)
+    assert other_key == key
+    code = render_code(cache.get(other_key), other_params)
+    assert 'symbol="000002"' in code
+    assert 'start_date="20230504"' in code and 'end_date="20230630"' in code